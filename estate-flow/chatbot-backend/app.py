@@ -1,13 +1,31 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 from flask_cors import CORS
 import openai
 import os
 from dotenv import load_dotenv
+import asyncio
 import json
+import time
 import logging
 from datetime import datetime
 from scheduler_service import start_rent_scheduler, stop_rent_scheduler, manual_rent_check, get_scheduler_status
-from email_service import email_service
+from shard_runner import sharded_rent_runner
+from scheduler_lease import scheduler_lease
+from notification_ledger import notification_ledger
+from email_service import email_service, OutgoingEmail
+from portfolio_engine import PortfolioFrame, parse_rent, to_number
+from portfolio_store import portfolio_store, PortfolioNotFoundError, PortfolioVersionConflict
+from csv_ingest import csv_ingestor, CSVImportError
+from summary_cache import summary_cache, portfolio_fingerprint
+from response_cache import response_cache
+from prompt_builder import prompt_builder, estimate_tokens
+from query_engine import query_planner, query_engine, RANKED_INTENTS
+from ranking_index import PortfolioIndex
+from openai_stub import StubOpenAI, AsyncStubOpenAI
+from metrics import (metrics, ratio, CONTENT_TYPE, HTTP_REQUESTS, HTTP_REQUEST_SECONDS, CHAT_STAGE_SECONDS,
+                     PROMPT_TOKENS)
+from profiling import profiler, span, stage
+from upstream_governor import openai_governor, UpstreamUnavailable
 
 # Load environment variables
 load_dotenv()
@@ -19,19 +37,36 @@ CORS(app)  # Enable CORS for React frontend
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+UNREADABLE_PROPERTIES_RESPONSE = "I'm having trouble reading your property data. Please make sure you have imported your properties correctly."
+NO_PROPERTIES_RESPONSE = "I don't see any property data yet. Please import your properties using the CSV upload feature, then I can help you analyze your portfolio!"
+
 class PropertyAnalyzer:
     def __init__(self):
         self.api_key = os.getenv('OPENAI_API_KEY')
-        if self.api_key:
+        if os.getenv('OPENAI_STUB', 'false').lower() == 'true':
+            # Offline stand-in with canned, word-by-word replies (no network, no key needed)
+            self.client = StubOpenAI()
+            self.async_client = AsyncStubOpenAI()
+            logger.info("Using stub OpenAI client")
+        elif self.api_key:
             try:
-                self.client = openai.OpenAI(api_key=self.api_key)
+                # A bounded timeout, so a hung upstream counts against the circuit breaker
+                timeout = float(os.getenv('OPENAI_TIMEOUT', '30'))
+                self.client = openai.OpenAI(api_key=self.api_key, timeout=timeout)
+                # Used by the asyncio serving mode (asgi.py)
+                self.async_client = openai.AsyncOpenAI(api_key=self.api_key, timeout=timeout)
                 logger.info("OpenAI client initialized successfully")
             except Exception as e:
                 logger.error(f"Failed to initialize OpenAI client: {str(e)}")
                 self.client = None
+                self.async_client = None
         else:
             logger.warning("No OpenAI API key found")
             self.client = None
+            self.async_client = None
+        
+        # Exact analytic questions are answered from the portfolio data without calling OpenAI
+        self.local_queries = os.getenv('LOCAL_QUERY_ENGINE', 'true').lower() != 'false'
     
     def analyze_properties(self, properties, user_message):
         """Analyze properties and generate insights based on user query"""
@@ -40,179 +75,397 @@ class PropertyAnalyzer:
             # Ensure properties is a list
             if not isinstance(properties, list):
                 logger.warning("Properties data is not a list")
-                return "I'm having trouble reading your property data. Please make sure you have imported your properties correctly."
-            
-            # Extract key metrics from properties
-            total_properties = len(properties)
-            total_units = sum(len(prop.get('units', [])) for prop in properties if isinstance(prop, dict))
-            
-            occupied_units = []
-            vacant_units = []
-            total_revenue = 0
-            
-            for prop in properties:
-                for unit in prop.get('units', []):
-                    tenant = unit.get('tenant')
-                    if tenant and isinstance(tenant, dict) and tenant.get('name'):
-                        occupied_units.append(unit)
-                        rent = self._parse_rent(unit.get('rent', 0))
-                        total_revenue += rent
-                    else:
-                        vacant_units.append(unit)
+                return UNREADABLE_PROPERTIES_RESPONSE
             
-            occupancy_rate = (len(occupied_units) / total_units * 100) if total_units > 0 else 0
+            snapshot = self._properties_snapshot(properties)
+            return self._respond(snapshot, user_message)
             
-            # Create property summary for AI
-            property_summary = {
-                "total_properties": total_properties,
-                "total_units": total_units,
-                "occupied_units": len(occupied_units),
-                "vacant_units": len(vacant_units),
-                "occupancy_rate": round(occupancy_rate, 1),
-                "monthly_revenue": total_revenue,
-                "annual_revenue": total_revenue * 12,
-                "properties": []
-            }
+        except Exception as e:
+            logger.error(f"Error in analyze_properties method: {str(e)}")
+            return self._analysis_error_response(properties, user_message)
+    
+    def _analysis_error_response(self, properties, user_message):
+        """Basic fallback answer when the portfolio couldn't be analyzed"""
+        # Create basic property data for fallback
+        fallback_data = {
+            "total_properties": len(properties) if isinstance(properties, list) else 0,
+            "total_units": 0,
+            "occupied_units": 0,
+            "vacant_units": 0,
+            "occupancy_rate": 0,
+            "monthly_revenue": 0,
+            "annual_revenue": 0
+        }
+        return self._generate_fallback_response(fallback_data, user_message)
+    
+    async def analyze_properties_async(self, properties, user_message):
+        """asyncio counterpart of analyze_properties, awaiting OpenAI with the async client"""
+        try:
+            if not isinstance(properties, list):
+                logger.warning("Properties data is not a list")
+                return UNREADABLE_PROPERTIES_RESPONSE
             
-            # Add detailed property information
-            for prop in properties:
-                property_info = {
-                    "name": prop.get('name', 'Unknown'),
-                    "address": prop.get('address', 'Unknown'),
-                    "total_units": len(prop.get('units', [])),
-                    "units": []
-                }
-                
-                prop_revenue = 0
-                prop_occupied = 0
-                
-                for unit in prop.get('units', []):
-                    tenant = unit.get('tenant', {})
-                    rent = self._parse_rent(unit.get('rent', 0))
-                    
-                    unit_info = {
-                        "number": unit.get('number', 'Unknown'),
-                        "bedrooms": unit.get('bedrooms', 0),
-                        "bathrooms": unit.get('bathrooms', 0),
-                        "square_feet": unit.get('squareFeet', 0),
-                        "rent": rent,
-                        "is_occupied": bool(tenant and isinstance(tenant, dict) and tenant.get('name')),
-                        "tenant_name": tenant.get('name') if tenant and isinstance(tenant, dict) else None
-                    }
-                    
-                    if unit_info["is_occupied"]:
-                        prop_revenue += rent
-                        prop_occupied += 1
-                    
-                    property_info["units"].append(unit_info)
-                
-                property_info["monthly_revenue"] = prop_revenue
-                property_info["occupancy_rate"] = round((prop_occupied / len(prop.get('units', [])) * 100) if len(prop.get('units', [])) > 0 else 0, 1)
-                property_summary["properties"].append(property_info)
+            # Summarizing a large uncached payload is CPU work; keep it off the event loop
+            snapshot = await asyncio.to_thread(self._properties_snapshot, properties)
+            return await self._respond_async(snapshot, user_message)
             
-            return self._generate_ai_response(property_summary, user_message)
+        except Exception as e:
+            logger.error(f"Error in analyze_properties_async method: {str(e)}")
+            return self._analysis_error_response(properties, user_message)
+    
+    async def analyze_portfolio_async(self, record, user_message):
+        """asyncio counterpart of analyze_portfolio"""
+        return await self._respond_async(self._portfolio_snapshot(record), user_message)
+    
+    async def stream_properties_async(self, properties, user_message):
+        """asyncio counterpart of stream_properties"""
+        if not isinstance(properties, list):
+            logger.warning("Properties data is not a list")
+            yield UNREADABLE_PROPERTIES_RESPONSE
+            return
+        snapshot = await asyncio.to_thread(self._properties_snapshot, properties)
+        async for piece in self._stream_response_async(snapshot, user_message):
+            yield piece
+    
+    async def stream_portfolio_async(self, record, user_message):
+        """asyncio counterpart of stream_portfolio"""
+        async for piece in self._stream_response_async(self._portfolio_snapshot(record), user_message):
+            yield piece
+    
+    def analyze_portfolio(self, record, user_message):
+        """Answer a question against a portfolio held in the server-side store"""
+        return self._respond(self._portfolio_snapshot(record), user_message)
+    
+    def stream_properties(self, properties, user_message):
+        """Like analyze_properties, but yields the answer in pieces as it is generated"""
+        if not isinstance(properties, list):
+            logger.warning("Properties data is not a list")
+            yield UNREADABLE_PROPERTIES_RESPONSE
+            return
+        yield from self._stream_response(self._properties_snapshot(properties), user_message)
+    
+    def stream_portfolio(self, record, user_message):
+        """Like analyze_portfolio, but yields the answer in pieces as it is generated"""
+        yield from self._stream_response(self._portfolio_snapshot(record), user_message)
+    
+    @stage('aggregate')
+    def _properties_snapshot(self, properties):
+        """Cached snapshot for a properties payload"""
+        # Identical payloads share one cached snapshot; on a miss the columnar
+        # frame is built in one pass and aggregated with vectorized reductions
+        built = {}
+        
+        def build_summary():
+            built['frame'] = PortfolioFrame.from_properties(properties)
+            return built['frame'].summary()
+        
+        snapshot = summary_cache.get_or_build(portfolio_fingerprint(properties), build_summary)
+        if 'frame' in built:
+            snapshot.memo('frame', lambda: built['frame'])
+        return snapshot
+    
+    @stage('aggregate')
+    def _portfolio_snapshot(self, record):
+        """Cached snapshot for the current version of a stored portfolio"""
+        # The store keeps the summary up to date as deltas arrive, so nothing is re-parsed
+        # here, and the ID/version pair already identifies the content for the cache
+        version, property_summary = record.versioned_summary()
+        snapshot = summary_cache.get_or_build(
+            f"portfolio:{record.portfolio_id}:{version}",
+            lambda: property_summary,
+            lineage=f"portfolio:{record.portfolio_id}",
+            version=version
+        )
+        # Ranked reads share the record's index while it is still at this version
+        snapshot.memo('record', lambda: record)
+        return snapshot
+    
+    async def _respond_async(self, snapshot, user_message):
+        local_answer = self._answer_locally(snapshot, user_message)
+        if local_answer is not None:
+            return local_answer
+        return await self._generate_ai_response_async(snapshot, user_message)
+    
+    def _stream_response(self, snapshot, user_message):
+        """Streaming counterpart of _respond: local and fallback answers arrive as one piece"""
+        local_answer = self._answer_locally(snapshot, user_message)
+        if local_answer is not None:
+            yield local_answer
+            return
+        
+        if not self.client:
+            logger.info("OpenAI client not available, using fallback response")
+            yield self._generate_fallback_response(snapshot.summary, user_message, snapshot)
+            return
+        
+        cached_answer = self._cached_answer(snapshot, user_message)
+        if cached_answer is not None:
+            yield cached_answer
+            return
+        
+        building_started = time.perf_counter()
+        prompt = self._build_prompt(snapshot, user_message)
+        completion_request = self._completion_request(prompt, user_message)
+        upstream_tokens = self._upstream_tokens(prompt, completion_request)
+        stream = None
+        pieces = []
+        try:
+            logger.info(f"Streaming request to OpenAI API for message: {user_message} ({prompt.token_count} prompt tokens)")
+            with stage('llm_queue'):
+                permit = openai_governor.acquire(upstream_tokens)
+            started = time.perf_counter()
+            with permit, span('llm_stream'):
+                stream = self.client.chat.completions.create(stream=True, **completion_request)
+                for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    content = chunk.choices[0].delta.content
+                    if content:
+                        if not pieces:
+                            CHAT_STAGE_SECONDS.labels('llm_first_token').observe(time.perf_counter() - started)
+                        pieces.append(content)
+                        yield content
+            logger.info("Finished streaming response from OpenAI API")
+            response_cache.store(snapshot, user_message, ''.join(pieces), time.perf_counter() - building_started,
+                                 upstream_tokens)
+        except GeneratorExit:
+            # The client went away; the finally block closes the upstream response
+            logger.info("Client disconnected, cancelling OpenAI stream")
+            raise
+        except UpstreamUnavailable as e:
+            yield self._upstream_unavailable_response(e, snapshot, user_message)
+        except Exception as e:
+            logger.error(f"OpenAI API error while streaming: {str(e)}")
+            if pieces:
+                yield " (Sorry, I lost my connection partway through that answer. Please ask again.)"
+            else:
+                yield self._ai_error_response(e, snapshot, user_message)
+        finally:
+            if stream is not None:
+                # Closing the stream drops the HTTP connection, which stops generation upstream
+                stream.close()
+    
+    def _respond(self, snapshot, user_message):
+        """Use the local query engine when the question has an exact answer, OpenAI otherwise"""
+        local_answer = self._answer_locally(snapshot, user_message)
+        if local_answer is not None:
+            return local_answer
+        return self._generate_ai_response(snapshot, user_message)
+    
+    async def _stream_response_async(self, snapshot, user_message):
+        """asyncio counterpart of _stream_response"""
+        local_answer = self._answer_locally(snapshot, user_message)
+        if local_answer is not None:
+            yield local_answer
+            return
+        
+        if not self.async_client:
+            logger.info("OpenAI client not available, using fallback response")
+            yield self._generate_fallback_response(snapshot.summary, user_message, snapshot)
+            return
+        
+        cached_answer = self._cached_answer(snapshot, user_message)
+        if cached_answer is not None:
+            yield cached_answer
+            return
+        
+        building_started = time.perf_counter()
+        prompt = self._build_prompt(snapshot, user_message)
+        completion_request = self._completion_request(prompt, user_message)
+        upstream_tokens = self._upstream_tokens(prompt, completion_request)
+        stream = None
+        pieces = []
+        try:
+            logger.info(f"Streaming request to OpenAI API for message: {user_message} ({prompt.token_count} prompt tokens)")
+            with stage('llm_queue'):
+                permit = await openai_governor.acquire_async(upstream_tokens)
+            started = time.perf_counter()
+            with permit, span('llm_stream'):
+                stream = await self.async_client.chat.completions.create(stream=True, **completion_request)
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    content = chunk.choices[0].delta.content
+                    if content:
+                        if not pieces:
+                            CHAT_STAGE_SECONDS.labels('llm_first_token').observe(time.perf_counter() - started)
+                        pieces.append(content)
+                        yield content
+            logger.info("Finished streaming response from OpenAI API")
+            response_cache.store(snapshot, user_message, ''.join(pieces), time.perf_counter() - building_started,
+                                 upstream_tokens)
+        except (GeneratorExit, asyncio.CancelledError):
+            logger.info("Client disconnected, cancelling OpenAI stream")
+            raise
+        except UpstreamUnavailable as e:
+            yield self._upstream_unavailable_response(e, snapshot, user_message)
+        except Exception as e:
+            logger.error(f"OpenAI API error while streaming: {str(e)}")
+            if pieces:
+                yield " (Sorry, I lost my connection partway through that answer. Please ask again.)"
+            else:
+                yield self._ai_error_response(e, snapshot, user_message)
+        finally:
+            if stream is not None:
+                await stream.close()
+    
+    @stage('local_query')
+    def _answer_locally(self, snapshot, user_message):
+        """Plan the question into a structured query and run it on the portfolio columns"""
+        if not self.local_queries:
+            return None
+        
+        try:
+            frame = snapshot.memo('frame', lambda: PortfolioFrame.from_summary(snapshot.summary))
+            query = query_planner.plan(user_message, frame.names)
+            if query is None:
+                return None
             
+            logger.info(f"Answering locally with structured query: {query.intent}")
+            if query.intent in RANKED_INTENTS:
+                return self._with_index(snapshot.summary, snapshot,
+                                        lambda index: query_engine.execute(query, frame, index))
+            return query_engine.execute(query, frame)
         except Exception as e:
-            logger.error(f"Error in analyze_properties method: {str(e)}")
-            # Create basic property data for fallback
-            fallback_data = {
-                "total_properties": len(properties) if isinstance(properties, list) else 0,
-                "total_units": 0,
-                "occupied_units": 0,
-                "vacant_units": 0,
-                "occupancy_rate": 0,
-                "monthly_revenue": 0,
-                "annual_revenue": 0
-            }
-            return self._generate_fallback_response(fallback_data, user_message)
+            logger.error(f"Local query engine error, falling back to OpenAI: {str(e)}")
+            return None
     
     def _parse_rent(self, rent_value):
         """Parse rent value to float, handling various formats"""
-        if isinstance(rent_value, (int, float)):
-            return float(rent_value)
-        
-        if isinstance(rent_value, str):
-            # Remove currency symbols, commas, and spaces
-            cleaned = rent_value.replace('$', '').replace(',', '').replace(' ', '')
-            try:
-                return float(cleaned)
-            except ValueError:
-                return 0.0
-        
-        return 0.0
+        return parse_rent(rent_value)
     
-    def _generate_ai_response(self, property_data, user_message):
+    def _generate_ai_response(self, snapshot, user_message):
         """Generate AI response using OpenAI API"""
+        property_data = snapshot.summary
         
         # Check if OpenAI client is available
         if not self.client:
             logger.info("OpenAI client not available, using fallback response")
-            return self._generate_fallback_response(property_data, user_message)
+            return self._generate_fallback_response(property_data, user_message, snapshot)
+        
+        cached_answer = self._cached_answer(snapshot, user_message)
+        if cached_answer is not None:
+            return cached_answer
+        
+        started = time.perf_counter()
+        # Overview and rollups are rendered once per portfolio version; unit detail is
+        # only added for what the question is about, within the token budget
+        prompt = self._build_prompt(snapshot, user_message)
+        
+        completion_request = self._completion_request(prompt, user_message)
+        upstream_tokens = self._upstream_tokens(prompt, completion_request)
         
-        system_prompt = f"""You are a friendly, knowledgeable property management assistant. You speak naturally and conversationally, like you're chatting with a friend who owns rental properties.
-
-Current Portfolio Overview:
-- Total Properties: {property_data['total_properties']}
-- Total Units: {property_data['total_units']}
-- Occupied Units: {property_data['occupied_units']}
-- Vacant Units: {property_data['vacant_units']}
-- Occupancy Rate: {property_data['occupancy_rate']}%
-- Monthly Revenue: ${property_data['monthly_revenue']:,.2f}
-- Annual Revenue: ${property_data['annual_revenue']:,.2f}
-
-Detailed Property Data:
-{json.dumps(property_data['properties'], indent=2)}
-
-IMPORTANT FORMATTING RULES:
-- Write responses in a natural, conversational tone
-- NO markdown formatting (no **, *, #, or - symbols)
-- NO bullet points or numbered lists
-- Use plain text only, like you're having a conversation
-- Make responses feel personal and friendly
-- Use "you" and "your" to keep it conversational
-- When mentioning specific numbers, work them naturally into sentences
-- Keep responses concise but informative
-- If listing multiple items, use commas or write them in paragraph form
-
-Example good response: "Looking at your portfolio, I can see you have 3 vacant units right now. The most expensive one is unit PH2 at Luxury Towers, which could bring in $8,500 per month once rented. That's a 4-bedroom, 4-bathroom penthouse with 3,500 square feet. It's definitely your premium unit!"
-
-Answer questions directly based on the data and provide helpful insights in a conversational way."""
-
         try:
-            logger.info(f"Sending request to OpenAI API for message: {user_message}")
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",  # Using more cost-effective model
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ],
-                max_tokens=1000,
-                temperature=0.7
-            )
+            logger.info(f"Sending request to OpenAI API for message: {user_message} ({prompt.token_count} prompt tokens)")
+            # Waits for a concurrency slot and rate budget, or raises straight away if OpenAI is unhealthy
+            with stage('llm_queue'):
+                permit = openai_governor.acquire(upstream_tokens)
+            with permit, stage('llm_wait'):
+                response = self.client.chat.completions.create(**completion_request)
             
             ai_response = response.choices[0].message.content
             logger.info("Successfully received response from OpenAI API")
+            response_cache.store(snapshot, user_message, ai_response, time.perf_counter() - started, upstream_tokens)
             return ai_response
             
+        except UpstreamUnavailable as e:
+            return self._upstream_unavailable_response(e, snapshot, user_message)
         except Exception as e:
             logger.error(f"OpenAI API error: {str(e)}")
+            return self._ai_error_response(e, snapshot, user_message)
+    
+    async def _generate_ai_response_async(self, snapshot, user_message):
+        """asyncio counterpart of _generate_ai_response; the event loop is free while OpenAI works"""
+        if not self.async_client:
+            logger.info("OpenAI client not available, using fallback response")
+            return self._generate_fallback_response(snapshot.summary, user_message, snapshot)
+        
+        cached_answer = self._cached_answer(snapshot, user_message)
+        if cached_answer is not None:
+            return cached_answer
+        
+        started = time.perf_counter()
+        prompt = self._build_prompt(snapshot, user_message)
+        
+        completion_request = self._completion_request(prompt, user_message)
+        upstream_tokens = self._upstream_tokens(prompt, completion_request)
+        
+        try:
+            logger.info(f"Sending async request to OpenAI API for message: {user_message} ({prompt.token_count} prompt tokens)")
+            with stage('llm_queue'):
+                permit = await openai_governor.acquire_async(upstream_tokens)
+            with permit, stage('llm_wait'):
+                response = await self.async_client.chat.completions.create(**completion_request)
             
-            # Check for specific error types
-            error_str = str(e).lower()
-            if "insufficient_quota" in error_str or "quota" in error_str:
-                logger.error("OpenAI API quota exceeded")
-                return "I'm having trouble connecting to my AI service right now due to quota limits. Let me help you with a basic analysis instead! " + self._generate_fallback_response(property_data, user_message)
-            elif "invalid_api_key" in error_str or "unauthorized" in error_str or "401" in error_str:
-                logger.error("Invalid or insufficient OpenAI API key permissions")
-                return "I'm having some technical difficulties with my AI connection. No worries though, I can still help you analyze your portfolio! " + self._generate_fallback_response(property_data, user_message)
-            elif "rate_limit" in error_str:
-                logger.error("OpenAI API rate limit exceeded")
-                return "I'm getting a lot of questions right now! Give me just a moment and try asking again."
-            else:
-                logger.error(f"Unknown OpenAI error: {str(e)}")
-                return "I'm experiencing some technical issues, but I can still help you out! " + self._generate_fallback_response(property_data, user_message)
+            ai_response = response.choices[0].message.content
+            logger.info("Successfully received response from OpenAI API")
+            response_cache.store(snapshot, user_message, ai_response, time.perf_counter() - started, upstream_tokens)
+            return ai_response
+            
+        except UpstreamUnavailable as e:
+            return self._upstream_unavailable_response(e, snapshot, user_message)
+        except Exception as e:
+            logger.error(f"OpenAI API error: {str(e)}")
+            return self._ai_error_response(e, snapshot, user_message)
     
-    def _generate_fallback_response(self, property_data, user_message):
+    @stage('response_cache')
+    def _cached_answer(self, snapshot, user_message):
+        """An earlier AI answer to the same question, or a rephrasing of it, about this portfolio version"""
+        return response_cache.lookup(snapshot, user_message)
+    
+    @stage('prompt_build')
+    def _build_prompt(self, snapshot, user_message):
+        """System prompt for the question, with its size recorded for /metrics"""
+        prompt = prompt_builder.build(snapshot, user_message)
+        PROMPT_TOKENS.observe(prompt.token_count)
+        return prompt
+    
+    def _completion_request(self, prompt, user_message):
+        """Chat completion parameters shared by the blocking and streaming calls"""
+        return {
+            'model': "gpt-4o-mini",  # Using more cost-effective model
+            'messages': [
+                {"role": "system", "content": prompt.text},
+                {"role": "user", "content": user_message}
+            ],
+            'max_tokens': 1000,
+            'temperature': 0.7
+        }
+    
+    def _upstream_tokens(self, prompt, completion_request):
+        """Tokens a call counts against the tokens/minute quota: prompt, question and max_tokens"""
+        return prompt.token_count + estimate_tokens(completion_request['messages'][1]['content']) + completion_request['max_tokens']
+    
+    def _upstream_unavailable_response(self, e, snapshot, user_message):
+        """Answer from the portfolio data when the governor won't call OpenAI"""
+        logger.warning(f"Not calling OpenAI ({e.reason}), answering from the fallback")
+        if e.reason == 'circuit_open':
+            intro = "I can't reach my AI service right now, but here's what I can tell you from your data! "
+        else:
+            intro = "I'm getting a lot of questions right now, so here's a quick answer straight from your data! "
+        return intro + self._generate_fallback_response(snapshot.summary, user_message, snapshot)
+    
+    def _ai_error_response(self, e, snapshot, user_message):
+        """User-facing reply for a failed OpenAI call, with a basic analysis where possible"""
+        property_data = snapshot.summary
+        
+        # Check for specific error types
+        error_str = str(e).lower()
+        if "insufficient_quota" in error_str or "quota" in error_str:
+            logger.error("OpenAI API quota exceeded")
+            return "I'm having trouble connecting to my AI service right now due to quota limits. Let me help you with a basic analysis instead! " + self._generate_fallback_response(property_data, user_message, snapshot)
+        elif "invalid_api_key" in error_str or "unauthorized" in error_str or "401" in error_str:
+            logger.error("Invalid or insufficient OpenAI API key permissions")
+            return "I'm having some technical difficulties with my AI connection. No worries though, I can still help you analyze your portfolio! " + self._generate_fallback_response(property_data, user_message, snapshot)
+        elif "rate_limit" in error_str:
+            logger.error("OpenAI API rate limit exceeded")
+            return "I'm getting a lot of questions right now! Give me just a moment and try asking again."
+        else:
+            logger.error(f"Unknown OpenAI error: {str(e)}")
+            return "I'm experiencing some technical issues, but I can still help you out! " + self._generate_fallback_response(property_data, user_message, snapshot)
+    
+    @stage('fallback')
+    def _generate_fallback_response(self, property_data, user_message, snapshot=None):
         """Generate a fallback response when OpenAI API is not available"""
         
         message_lower = user_message.lower()
@@ -228,19 +481,19 @@ Answer questions directly based on the data and provide helpful insights in a co
         
         # Advanced analytical queries
         if any(phrase in message_lower for phrase in ['highest rent', 'most rent', 'pays the most', 'highest paying']):
-            return self._find_highest_rent_tenant(property_data)
+            return self._with_index(property_data, snapshot, self._find_highest_rent_tenant)
         
         elif any(phrase in message_lower for phrase in ['lowest rent', 'least rent', 'pays the least', 'cheapest']):
-            return self._find_lowest_rent_tenant(property_data)
+            return self._with_index(property_data, snapshot, self._find_lowest_rent_tenant)
         
         elif any(phrase in message_lower for phrase in ['most expensive vacant', 'highest rent vacant', 'expensive vacant']):
-            return self._find_most_expensive_vacant_unit(property_data)
+            return self._with_index(property_data, snapshot, self._find_most_expensive_vacant_unit)
         
         elif any(phrase in message_lower for phrase in ['vacant units', 'empty units', 'available units']):
-            return self._list_vacant_units(property_data)
+            return self._with_index(property_data, snapshot, self._list_vacant_units)
         
         elif any(phrase in message_lower for phrase in ['which property', 'best property', 'most revenue property']):
-            return self._analyze_property_performance(property_data)
+            return self._with_index(property_data, snapshot, self._analyze_property_performance)
         
         # Basic keyword matching for common queries
         elif any(word in message_lower for word in ['occupancy', 'vacant', 'empty', 'available']):
@@ -278,206 +531,488 @@ Answer questions directly based on the data and provide helpful insights in a co
         else:
             return f"I can help you analyze your {total_properties} properties with {total_units} units. You're currently at {occupancy_rate}% occupancy generating ${monthly_revenue:,.2f} per month. Try asking about occupancy rates, revenue, specific properties, or ways to improve your portfolio!"
     
-    def _find_highest_rent_tenant(self, property_data):
+    def _with_index(self, property_data, snapshot, read):
+        """Run read against a ranking index for this data and return its result.
+
+        A stored portfolio's own index is used while it is still at the
+        snapshot's version, with the record locked so no delta lands mid-read;
+        otherwise an index is built from the summary and cached on the snapshot.
+        """
+        if snapshot is None:
+            return read(PortfolioIndex.from_summary(property_data))
+        record = snapshot.memo('record', lambda: None)
+        if record is not None:
+            with record.ranking_index_at(snapshot.version) as index:
+                if index is not None:
+                    return read(index)
+        return read(snapshot.memo('ranking_index', lambda: PortfolioIndex.from_summary(snapshot.summary)))
+    
+    def _find_highest_rent_tenant(self, index):
         """Find the tenant who pays the highest rent"""
-        properties = property_data.get('properties', [])
-        if not properties:
+        if not index.properties:
             return "I don't have any property data to analyze tenant rents right now."
         
-        highest_rent = 0
-        highest_rent_tenant = None
-        highest_rent_unit = None
-        highest_rent_property = None
-        
-        for prop in properties:
-            for unit in prop.get('units', []):
-                if unit.get('is_occupied') and unit.get('tenant_name'):
-                    rent = unit.get('rent', 0)
-                    if rent > highest_rent:
-                        highest_rent = rent
-                        highest_rent_tenant = unit.get('tenant_name')
-                        highest_rent_unit = unit.get('number')
-                        highest_rent_property = prop.get('name')
-        
-        if highest_rent_tenant:
-            return f"The tenant who pays the most rent is {highest_rent_tenant} in unit {highest_rent_unit} at {highest_rent_property}. They pay ${highest_rent:,.2f} per month."
+        top = index.top_units('occupied_rent', 1)
+        if top:
+            unit = top[0]['unit']
+            return f"The tenant who pays the most rent is {unit['tenant_name']} in unit {unit['number']} at {top[0]['property']}. They pay ${unit['rent']:,.2f} per month."
         else:
             return "I couldn't find any occupied units with tenant information to compare rents."
     
-    def _find_lowest_rent_tenant(self, property_data):
+    def _find_lowest_rent_tenant(self, index):
         """Find the tenant who pays the lowest rent"""
-        properties = property_data.get('properties', [])
-        if not properties:
+        if not index.properties:
             return "I don't have any property data to analyze tenant rents right now."
         
-        lowest_rent = float('inf')
-        lowest_rent_tenant = None
-        lowest_rent_unit = None
-        lowest_rent_property = None
-        
-        for prop in properties:
-            for unit in prop.get('units', []):
-                if unit.get('is_occupied') and unit.get('tenant_name'):
-                    rent = unit.get('rent', 0)
-                    if rent > 0 and rent < lowest_rent:
-                        lowest_rent = rent
-                        lowest_rent_tenant = unit.get('tenant_name')
-                        lowest_rent_unit = unit.get('number')
-                        lowest_rent_property = prop.get('name')
-        
-        if lowest_rent_tenant:
-            return f"The tenant who pays the least rent is {lowest_rent_tenant} in unit {lowest_rent_unit} at {lowest_rent_property}. They pay ${lowest_rent:,.2f} per month."
+        bottom = index.bottom_units('occupied_rent', 1)
+        if bottom:
+            unit = bottom[0]['unit']
+            return f"The tenant who pays the least rent is {unit['tenant_name']} in unit {unit['number']} at {bottom[0]['property']}. They pay ${unit['rent']:,.2f} per month."
         else:
             return "I couldn't find any occupied units with tenant information to compare rents."
     
-    def _find_most_expensive_vacant_unit(self, property_data):
+    def _find_most_expensive_vacant_unit(self, index):
         """Find the most expensive vacant unit"""
-        properties = property_data.get('properties', [])
-        if not properties:
+        if not index.properties:
             return "I don't have any property data to analyze vacant units right now."
         
-        highest_rent = 0
-        highest_rent_unit = None
-        
-        for prop in properties:
-            for unit in prop.get('units', []):
-                if not unit.get('is_occupied'):
-                    rent = unit.get('rent', 0)
-                    if rent > highest_rent:
-                        highest_rent = rent
-                        highest_rent_unit = {
-                            'property': prop.get('name'),
-                            'unit': unit.get('number'),
-                            'rent': rent,
-                            'bedrooms': unit.get('bedrooms', 0),
-                            'bathrooms': unit.get('bathrooms', 0),
-                            'square_feet': unit.get('squareFeet', 0)
-                        }
-        
-        if highest_rent_unit:
-            unit = highest_rent_unit
-            response = f"The most expensive vacant property in your portfolio is unit {unit['unit']} at {unit['property']}. "
-            response += f"This is a {unit['bedrooms']} bedroom, {unit['bathrooms']} bathroom unit with {unit['square_feet']:,} square feet. "
+        top = index.top_units('vacant_rent', 1)
+        if top:
+            unit = top[0]['unit']
+            response = f"The most expensive vacant property in your portfolio is unit {unit['number']} at {top[0]['property']}. "
+            response += f"This is a {unit['bedrooms']} bedroom, {unit['bathrooms']} bathroom unit with {int(to_number(unit['square_feet'])):,} square feet. "
             response += f"It could rent for ${unit['rent']:,.2f} per month. "
             response += "This unit is currently vacant and represents the highest rental value among your vacant units."
             return response
         else:
             return "Great news! You have no vacant units. All your properties are fully occupied."
     
-    def _list_vacant_units(self, property_data):
+    def _list_vacant_units(self, index):
         """List all vacant units"""
-        properties = property_data.get('properties', [])
-        if not properties:
+        if not index.properties:
             return "I don't have any property data to analyze vacant units right now."
         
-        vacant_units = []
-        for prop in properties:
-            for unit in prop.get('units', []):
-                if not unit.get('is_occupied'):
-                    vacant_units.append({
-                        'property': prop.get('name'),
-                        'unit': unit.get('number'),
-                        'rent': unit.get('rent', 0),
-                        'bedrooms': unit.get('bedrooms', 0),
-                        'bathrooms': unit.get('bathrooms', 0)
-                    })
-        
-        if not vacant_units:
+        vacant_count = index.vacant_count
+        
+        if vacant_count == 0:
             return "Great news! You have no vacant units. All your properties are fully occupied."
         
-        if len(vacant_units) == 1:
-            unit = vacant_units[0]
-            response = f"You have 1 vacant unit: unit {unit['unit']} at {unit['property']}. It's a {unit['bedrooms']} bedroom, {unit['bathrooms']} bathroom unit that could rent for ${unit['rent']:,.2f} per month."
+        # The highest-rent vacancies come straight off the ranking index
+        main_units = index.vacant_units(3)
+        
+        if vacant_count == 1:
+            prop_name, unit = main_units[0]['property'], main_units[0]['unit']
+            response = f"You have 1 vacant unit: unit {unit['number']} at {prop_name}. It's a {unit['bedrooms']} bedroom, {unit['bathrooms']} bathroom unit that could rent for ${unit['rent']:,.2f} per month."
         else:
-            response = f"You have {len(vacant_units)} vacant units. "
+            response = f"You have {vacant_count} vacant units. "
             
-            # List first few units conversationally
-            unit_descriptions = []
-            for i, unit in enumerate(vacant_units[:3]):  # Show first 3 units
-                unit_descriptions.append(f"unit {unit['unit']} at {unit['property']} (${unit['rent']:,.2f}/month)")
+            unit_descriptions = [f"unit {row['unit']['number']} at {row['property']} (${row['unit']['rent']:,.2f}/month)" for row in main_units]
             
-            if len(vacant_units) <= 3:
+            if vacant_count <= 3:
                 response += "They are: " + ", ".join(unit_descriptions) + "."
             else:
-                response += "The main ones are: " + ", ".join(unit_descriptions) + f", and {len(vacant_units) - 3} others."
+                response += "The main ones are: " + ", ".join(unit_descriptions) + f", and {vacant_count - 3} others."
         
-        potential_revenue = sum(unit['rent'] for unit in vacant_units)
-        response += f" If you fill all vacant units, you could add ${potential_revenue:,.2f} to your monthly revenue."
+        response += f" If you fill all vacant units, you could add ${index.vacant_rent_total:,.2f} to your monthly revenue."
         
         return response
     
-    def _analyze_property_performance(self, property_data):
+    def _analyze_property_performance(self, index):
         """Analyze which properties perform best"""
-        properties = property_data.get('properties', [])
-        if not properties:
+        if not index.properties:
             return "I don't have any property data to analyze performance right now."
         
-        property_performance = []
-        for prop in properties:
-            revenue = prop.get('monthly_revenue', 0)
-            occupancy = prop.get('occupancy_rate', 0)
-            units = prop.get('total_units', 0)
-            
-            property_performance.append({
-                'name': prop.get('name'),
-                'revenue': revenue,
-                'occupancy': occupancy,
-                'units': units,
-                'avg_rent': revenue / max(1, units) if units > 0 else 0
-            })
-        
-        # Sort by revenue (highest first)
-        property_performance.sort(key=lambda x: x['revenue'], reverse=True)
-        
-        if len(property_performance) == 1:
+        property_performance = index.top_properties(3)
+        
+        if len(index.properties) == 1:
             prop = property_performance[0]
-            return f"You have one property, {prop['name']}, which generates ${prop['revenue']:,.2f} per month with a {prop['occupancy']}% occupancy rate."
+            return f"You have one property, {prop['name']}, which generates ${prop['monthly_revenue']:,.2f} per month with a {prop['occupancy_rate']}% occupancy rate."
         
         best_property = property_performance[0]
-        response = f"Your top performing property is {best_property['name']}, generating ${best_property['revenue']:,.2f} monthly with {best_property['occupancy']}% occupancy."
+        response = f"Your top performing property is {best_property['name']}, generating ${best_property['monthly_revenue']:,.2f} monthly with {best_property['occupancy_rate']}% occupancy."
         
         if len(property_performance) >= 2:
             second_best = property_performance[1]
-            response += f" Your second best is {second_best['name']} at ${second_best['revenue']:,.2f} monthly."
+            response += f" Your second best is {second_best['name']} at ${second_best['monthly_revenue']:,.2f} monthly."
         
         if len(property_performance) >= 3:
             third_best = property_performance[2]
-            response += f" Third place goes to {third_best['name']} with ${third_best['revenue']:,.2f} monthly."
+            response += f" Third place goes to {third_best['name']} with ${third_best['monthly_revenue']:,.2f} monthly."
         
         return response
 
 # Initialize the analyzer
 analyzer = PropertyAnalyzer()
 
+class ChatRequestError(ValueError):
+    """A /chat request that can't be answered, with the HTTP status to report"""
+    
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+def parse_chat_request(data):
+    """Validate a /chat body into (user_message, record, properties).
+    
+    record is the stored portfolio when the body names a portfolio_id,
+    otherwise None and the answer comes from the properties payload.
+    """
+    if not data:
+        raise ChatRequestError('No data provided', 400)
+    
+    user_message = data.get('message', '')
+    portfolio_id = data.get('portfolio_id')
+    properties = data.get('properties', [])
+    
+    if not user_message:
+        raise ChatRequestError('No message provided', 400)
+    
+    logger.info(f"Received message: {user_message}")
+    
+    record = None
+    if portfolio_id:
+        try:
+            record = portfolio_store.get(portfolio_id)
+        except PortfolioNotFoundError:
+            raise ChatRequestError(f'Unknown portfolio_id: {portfolio_id}', 404)
+        logger.info(f"Using stored portfolio {portfolio_id} (version {record.version})")
+    else:
+        logger.info(f"Properties count: {len(properties)}")
+    
+    return user_message, record, properties
+
+def sse_event(payload, event=None):
+    """One server-sent event carrying a JSON payload"""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(payload)}\n\n"
+
+# Request counts and latency per route for /metrics
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        # The route pattern, not the path, so /portfolios/<portfolio_id> is one series
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        HTTP_REQUEST_SECONDS.labels(request.method, route).observe(time.perf_counter() - started)
+        HTTP_REQUESTS.labels(request.method, route, str(response.status_code)).inc()
+    return response
+
+# Opt-in profiling: X-Profile header or ?profile= on any request
+@app.before_request
+def start_request_profile():
+    mode = profiler.requested_mode(request.headers.get('X-Profile') or request.args.get('profile'))
+    if mode is not None:
+        g.profile = profiler.start('request', f"{request.method} {request.path}", mode)
+
+@app.after_request
+def finish_request_profile(response):
+    session = g.pop('profile', None)
+    if session is not None:
+        response.headers['X-Profile-Id'] = session.id
+        if response.is_streamed:
+            # Streamed answers are generated after this hook; profile until the response is closed
+            response.call_on_close(session.finish)
+        else:
+            session.finish()
+    return response
+
 @app.route('/chat', methods=['POST'])
 def chat():
     try:
-        data = request.get_json()
-        
-        if not data:
-            return jsonify({'error': 'No data provided'}), 400
-        
-        user_message = data.get('message', '')
-        properties = data.get('properties', [])
-        
-        if not user_message:
-            return jsonify({'error': 'No message provided'}), 400
-        
-        logger.info(f"Received message: {user_message}")
-        logger.info(f"Properties count: {len(properties)}")
+        with stage('parse'):
+            user_message, record, properties = parse_chat_request(request.get_json())
         
         # Generate response
-        if not properties:
-            response = "I don't see any property data yet. Please import your properties using the CSV upload feature, then I can help you analyze your portfolio!"
+        if record is not None:
+            response = analyzer.analyze_portfolio(record, user_message)
+        elif not properties:
+            response = NO_PROPERTIES_RESPONSE
         else:
             response = analyzer.analyze_properties(properties, user_message)
         
-        return jsonify({'response': response})
+        with span('serialize'):
+            return jsonify({'response': response})
         
+    except ChatRequestError as e:
+        return jsonify({'error': str(e)}), e.status
     except Exception as e:
         logger.error(f"Error in chat endpoint: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """Streaming /chat: the answer is sent as server-sent events while it is generated"""
+    try:
+        with stage('parse'):
+            user_message, record, properties = parse_chat_request(request.get_json())
+        
+        if record is not None:
+            pieces = analyzer.stream_portfolio(record, user_message)
+        elif not properties:
+            pieces = iter([NO_PROPERTIES_RESPONSE])
+        else:
+            pieces = analyzer.stream_properties(properties, user_message)
+        
+        return Response(
+            stream_with_context(_sse_events(pieces)),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+        
+    except ChatRequestError as e:
+        return jsonify({'error': str(e)}), e.status
+    except Exception as e:
+        logger.error(f"Error in chat stream endpoint: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+def _sse_events(pieces):
+    """Frame answer pieces as SSE: a 'delta' per piece, then 'done' with the full text.
+    
+    If the client disconnects, the WSGI server closes this generator, which
+    closes the analyzer's generator and with it the upstream OpenAI stream.
+    """
+    parts = []
+    try:
+        for piece in pieces:
+            parts.append(piece)
+            yield sse_event({'delta': piece})
+        yield sse_event({'response': ''.join(parts)}, 'done')
+    except Exception as e:
+        logger.error(f"Error while streaming chat response: {str(e)}")
+        yield sse_event({'error': 'Internal server error'}, 'error')
+    finally:
+        close = getattr(pieces, 'close', None)
+        if close:
+            close()
+
+# Portfolio Store Endpoints
+@app.route('/portfolios', methods=['POST'])
+def create_portfolio():
+    """Upload a full portfolio once so later chats can refer to it by ID"""
+    try:
+        data = request.get_json()
+        properties = data.get('properties') if data else None
+        
+        if not isinstance(properties, list):
+            return jsonify({
+                'success': False,
+                'error': 'A properties list is required'
+            }), 400
+        
+        record = portfolio_store.create(properties)
+        return jsonify({
+            'success': True,
+            'portfolio': record.describe()
+        }), 201
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        logger.error(f"Error creating portfolio: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/portfolios/import', methods=['POST'])
+def import_portfolio():
+    """Stream a CSV export into the store as a new portfolio, or over ?portfolio_id=<id>"""
+    portfolio_id = request.args.get('portfolio_id')
+    try:
+        # Either a multipart upload with a 'file' field or the raw CSV as the body
+        upload = request.files.get('file') if request.mimetype == 'multipart/form-data' else None
+        stream = upload.stream if upload is not None else request.stream
+        
+        record, report = csv_ingestor.ingest(stream, portfolio_id)
+        return jsonify({
+            'success': True,
+            'portfolio': record.describe(),
+            'import': report
+        }), 200 if portfolio_id else 201
+    except PortfolioNotFoundError:
+        return jsonify({
+            'success': False,
+            'error': f'Unknown portfolio_id: {portfolio_id}'
+        }), 404
+    except CSVImportError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'import': e.report
+        }), 400
+    except Exception as e:
+        logger.error(f"Error importing portfolio CSV: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/portfolios/<portfolio_id>', methods=['GET'])
+def get_portfolio(portfolio_id):
+    """Get the current version and size of a stored portfolio"""
+    try:
+        record = portfolio_store.get(portfolio_id)
+        return jsonify({
+            'success': True,
+            'portfolio': record.describe()
+        })
+    except PortfolioNotFoundError:
+        return jsonify({
+            'success': False,
+            'error': f'Unknown portfolio_id: {portfolio_id}'
+        }), 404
+
+@app.route('/portfolios/<portfolio_id>', methods=['PUT'])
+def replace_portfolio(portfolio_id):
+    """Replace the full contents of a stored portfolio"""
+    try:
+        data = request.get_json()
+        properties = data.get('properties') if data else None
+        
+        if not isinstance(properties, list):
+            return jsonify({
+                'success': False,
+                'error': 'A properties list is required'
+            }), 400
+        
+        record = portfolio_store.replace(portfolio_id, properties)
+        return jsonify({
+            'success': True,
+            'portfolio': record.describe()
+        })
+    except PortfolioNotFoundError:
+        return jsonify({
+            'success': False,
+            'error': f'Unknown portfolio_id: {portfolio_id}'
+        }), 404
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        logger.error(f"Error replacing portfolio: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/portfolios/<portfolio_id>', methods=['PATCH'])
+def update_portfolio(portfolio_id):
+    """Apply added/changed/removed units to a stored portfolio"""
+    try:
+        delta = request.get_json()
+        
+        if not delta:
+            return jsonify({
+                'success': False,
+                'error': 'No delta provided'
+            }), 400
+        
+        result = portfolio_store.apply_delta(portfolio_id, delta)
+        return jsonify({
+            'success': True,
+            'portfolio': result
+        })
+    except PortfolioNotFoundError:
+        return jsonify({
+            'success': False,
+            'error': f'Unknown portfolio_id: {portfolio_id}'
+        }), 404
+    except PortfolioVersionConflict as e:
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'current_version': e.current
+        }), 409
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        logger.error(f"Error updating portfolio: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """Hit/miss counters for the portfolio summary cache and the AI response cache"""
+    return jsonify({
+        'success': True,
+        'summary_cache': summary_cache.stats(),
+        'response_cache': response_cache.stats()
+    })
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Request, /chat stage, SMTP, scheduler and cache metrics in the Prometheus text format"""
+    if not metrics.enabled:
+        return jsonify({'success': False, 'error': 'Metrics are disabled (METRICS_ENABLED=false)'}), 404
+    return Response(metrics.render(), mimetype=None, content_type=CONTENT_TYPE)
+
+@metrics.collector
+def cache_metrics():
+    """Hit ratios of the caches in front of the hot paths, read from their own counters at scrape time"""
+    cache = summary_cache.stats()
+    answers = response_cache.stats()
+    pool = email_service.pool.stats()
+    # Plain counters, read without ledger.stats(), which counts the table and the filter's set bits
+    ledger = {'checks': notification_ledger.checks, 'bloom_negatives': notification_ledger.bloom_negatives}
+    return [
+        ('estateflow_summary_cache_hits_total', 'counter', 'Portfolio summary cache hits', [({}, cache['hits'])]),
+        ('estateflow_summary_cache_misses_total', 'counter', 'Portfolio summary cache misses', [({}, cache['misses'])]),
+        ('estateflow_summary_cache_hit_ratio', 'gauge', 'Share of summary cache lookups served from the cache',
+         [({}, ratio(cache['hits'], cache['hits'] + cache['misses']))]),
+        ('estateflow_summary_cache_entries', 'gauge', 'Snapshots held in the summary cache', [({}, cache['entries'])]),
+        ('estateflow_response_cache_hits_total', 'counter', 'AI answers served from the response cache, by match',
+         [({'match': 'exact'}, answers['exact_hits']), ({'match': 'reworded'}, answers['reworded_hits'])]),
+        ('estateflow_response_cache_misses_total', 'counter', 'Response cache lookups that went to OpenAI',
+         [({}, answers['misses'])]),
+        ('estateflow_response_cache_hit_ratio', 'gauge', 'Share of response cache lookups served from the cache',
+         [({}, answers['hit_ratio'])]),
+        ('estateflow_response_cache_entries', 'gauge', 'AI answers held in the response cache', [({}, answers['entries'])]),
+        ('estateflow_response_cache_seconds_saved_total', 'counter',
+         'Time the cached answers originally took to produce (prompt build, queue and OpenAI call)',
+         [({}, answers['seconds_saved'])]),
+        ('estateflow_response_cache_tokens_saved_total', 'counter', 'OpenAI tokens not spent thanks to cached answers',
+         [({}, answers['tokens_saved'])]),
+        ('estateflow_ledger_checks_total', 'counter', 'Notification ledger keys checked', [({}, ledger['checks'])]),
+        ('estateflow_ledger_bloom_negatives_total', 'counter',
+         'Ledger checks answered by the Bloom filter without a database lookup', [({}, ledger['bloom_negatives'])]),
+        ('estateflow_ledger_bloom_hit_ratio', 'gauge', 'Share of ledger checks answered by the Bloom filter',
+         [({}, ratio(ledger['bloom_negatives'], ledger['checks']))]),
+        ('estateflow_smtp_connections_opened_total', 'counter', 'SMTP sessions opened',
+         [({}, pool['connections_opened'])]),
+        ('estateflow_smtp_connections_reused_total', 'counter', 'Sends that reused a pooled SMTP session',
+         [({}, pool['connections_reused'])]),
+        ('estateflow_smtp_connection_reuse_ratio', 'gauge', 'Share of SMTP sends that reused a pooled session',
+         [({}, ratio(pool['connections_reused'], pool['connections_opened'] + pool['connections_reused']))]),
+    ]
+
+@metrics.collector
+def upstream_metrics():
+    """OpenAI governor state: calls in flight and queued, and the circuit breaker"""
+    stats = openai_governor.stats()
+    states = ('closed', 'half_open', 'open')
+    return [
+        ('estateflow_upstream_in_flight', 'gauge', 'Upstream calls in flight', [({'upstream': 'openai'}, stats['in_flight'])]),
+        ('estateflow_upstream_queued', 'gauge', 'Callers waiting for an upstream slot', [({'upstream': 'openai'}, stats['queued'])]),
+        ('estateflow_upstream_admitted_total', 'counter', 'Upstream calls let through', [({'upstream': 'openai'}, stats['admitted'])]),
+        ('estateflow_upstream_breaker_state', 'gauge', 'Circuit breaker state (1 for the current one)',
+         [({'upstream': 'openai', 'state': state}, int(stats['breaker_state'] == state)) for state in states]),
+        ('estateflow_upstream_breaker_opened_total', 'counter', 'Times the circuit breaker opened',
+         [({'upstream': 'openai'}, stats['breaker_opened'])]),
+    ]
+
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint"""
@@ -491,24 +1026,57 @@ def root():
         'version': '1.0.0',
         'endpoints': {
             '/chat': 'POST - Send messages to the AI assistant',
+            '/chat/stream': 'POST - Same as /chat, streamed as server-sent events',
+            '/portfolios': 'POST - Upload a portfolio to the server-side store',
+            '/portfolios/import': 'POST - Stream a CSV export into the server-side store',
+            '/portfolios/<id>': 'GET/PUT/PATCH - Inspect, replace or apply deltas to a stored portfolio',
+            '/cache/stats': 'GET - Portfolio summary and AI response cache statistics',
+            '/metrics': 'GET - Request, /chat stage, SMTP, scheduler and cache metrics (Prometheus format)',
             '/health': 'GET - Health check',
             '/scheduler/start': 'POST - Start automated rent scheduler',
             '/scheduler/stop': 'POST - Stop automated rent scheduler',
             '/scheduler/status': 'GET - Get scheduler status',
             '/scheduler/manual-check': 'POST - Manually trigger rent check',
-            '/email/test': 'POST - Send test email'
+            '/scheduler/run-all': 'POST - Run every landlord\'s rent checks across worker processes',
+            '/scheduler/runs/last': 'GET - Report of the most recent multi-landlord run',
+            '/email/test': 'POST - Queue a test email',
+            '/outbox/status': 'GET - Outbox queue depth, drain rate and dead letters',
+            '/outbox/messages/<id>': 'GET - Delivery status of a queued email',
+            '/outbox/dead-letters': 'GET - Emails that exhausted their retries',
+            '/outbox/retry': 'POST - Requeue dead letters (all, or the given ids)',
+            '/admin/profiles': 'GET - Stored profiles (profile any request with an X-Profile header or ?profile=1)',
+            '/admin/profiles/<id>': 'GET - Span tree and function profile of one profiled request or run',
+            '/admin/profiles/scheduler': 'POST - Profile the next scheduler run'
         }
     })
 
+def start_local_scheduler():
+    """Start this worker's scheduler; called once it holds the scheduler lease"""
+    if sharded_rent_runner.configured:
+        # Every landlord in LANDLORDS_FILE, sharded across worker processes
+        sharded_rent_runner.start()
+    else:
+        start_rent_scheduler()
+
+def stop_local_scheduler():
+    """Stop this worker's scheduler; called when it gives up or loses the scheduler lease"""
+    stop_rent_scheduler()
+    sharded_rent_runner.stop()
+
+# Only the worker holding the lease runs the scheduler; the others take over if it goes away
+scheduler_lease.on_acquired = start_local_scheduler
+scheduler_lease.on_lost = stop_local_scheduler
+
 # Email Scheduler Endpoints
 @app.route('/scheduler/start', methods=['POST'])
 def start_scheduler():
-    """Start the automated rent scheduler"""
+    """Start the automated rent scheduler on whichever worker holds the scheduler lease"""
     try:
-        start_rent_scheduler()
+        scheduler_lease.enable()
         return jsonify({
             'success': True,
-            'message': 'Rent scheduler started successfully'
+            'message': 'Rent scheduler started successfully',
+            'lease_holder': scheduler_lease.status()['holder']
         })
     except Exception as e:
         logger.error(f"Error starting scheduler: {str(e)}")
@@ -519,9 +1087,9 @@ def start_scheduler():
 
 @app.route('/scheduler/stop', methods=['POST'])
 def stop_scheduler():
-    """Stop the automated rent scheduler"""
+    """Stop the automated rent scheduler on every worker"""
     try:
-        stop_rent_scheduler()
+        scheduler_lease.disable()
         return jsonify({
             'success': True,
             'message': 'Rent scheduler stopped successfully'
@@ -538,6 +1106,8 @@ def scheduler_status():
     """Get current scheduler status"""
     try:
         status = get_scheduler_status()
+        status['sharded'] = sharded_rent_runner.status()
+        status['lease'] = scheduler_lease.status()
         return jsonify({
             'success': True,
             'status': status
@@ -553,10 +1123,13 @@ def scheduler_status():
 def manual_check():
     """Manually trigger a rent check"""
     try:
-        manual_rent_check()
+        data = request.get_json(silent=True) or {}
+        dry_run = bool(data.get('dry_run')) or request.args.get('dry_run', '').lower() in ('1', 'true', 'yes')
+        report = manual_rent_check(dry_run)
         return jsonify({
             'success': True,
-            'message': 'Manual rent check completed'
+            'message': 'Manual rent check completed' if not report.get('dry_run') else 'Dry run completed; nothing was sent',
+            'report': report
         })
     except Exception as e:
         logger.error(f"Error running manual check: {str(e)}")
@@ -565,6 +1138,75 @@ def manual_check():
             'error': str(e)
         }), 500
 
+@app.route('/scheduler/run-all', methods=['POST'])
+def run_all_landlords():
+    """Run the daily checks for every landlord in LANDLORDS_FILE (or the ids in the body) and return the run report"""
+    try:
+        if not sharded_rent_runner.configured:
+            return jsonify({
+                'success': False,
+                'error': f"Landlords file not found: {sharded_rent_runner.landlords_file}"
+            }), 404
+        
+        data = request.get_json(silent=True) or {}
+        report = sharded_rent_runner.run(data.get('landlords'), bool(data.get('dry_run')))
+        return jsonify({
+            'success': not report['failed'],
+            'report': report
+        }), 200 if not report['failed'] else 207
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except RuntimeError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 409
+    except Exception as e:
+        logger.error(f"Error running multi-landlord checks: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/scheduler/runs/last', methods=['GET'])
+def last_sharded_run():
+    """Report of the most recent multi-landlord run"""
+    if sharded_rent_runner.last_report is None:
+        return jsonify({
+            'success': False,
+            'error': 'No multi-landlord run yet'
+        }), 404
+    return jsonify({
+        'success': True,
+        'report': sharded_rent_runner.last_report
+    })
+
+def test_email_content():
+    """Subject and HTML body of the configuration test email"""
+    subject = "EstateFlow Email Test"
+    current_time = datetime.now().strftime('%B %d, %Y at %I:%M %p')
+    body = f"""
+    <html>
+    <body style="font-family: Arial, sans-serif; margin: 20px;">
+        <h2 style="color: #3498db;">Email Configuration Test</h2>
+        <p>Congratulations! Your EstateFlow email system is working correctly.</p>
+        <p>This test email confirms that:</p>
+        <ul>
+            <li>SMTP configuration is correct</li>
+            <li>Email credentials are valid</li>
+            <li>Email service is ready for automated notifications</li>
+        </ul>
+        <p style="color: #666; font-size: 12px; margin-top: 30px;">
+            Sent at: {current_time}
+        </p>
+    </body>
+    </html>
+    """
+    return subject, body
+
 @app.route('/email/test', methods=['POST'])
 def test_email():
     """Send a test email to verify email configuration"""
@@ -578,38 +1220,16 @@ def test_email():
                 'error': 'No email address provided and LANDLORD_EMAIL not configured'
             }), 400
         
-        subject = "EstateFlow Email Test"
-        current_time = datetime.now().strftime('%B %d, %Y at %I:%M %p')
-        body = f"""
-        <html>
-        <body style="font-family: Arial, sans-serif; margin: 20px;">
-            <h2 style="color: #3498db;">Email Configuration Test</h2>
-            <p>Congratulations! Your EstateFlow email system is working correctly.</p>
-            <p>This test email confirms that:</p>
-            <ul>
-                <li>SMTP configuration is correct</li>
-                <li>Email credentials are valid</li>
-                <li>Email service is ready for automated notifications</li>
-            </ul>
-            <p style="color: #666; font-size: 12px; margin-top: 30px;">
-                Sent at: {current_time}
-            </p>
-        </body>
-        </html>
-        """
+        subject, body = test_email_content()
         
-        success = email_service.send_email(test_email_address, subject, body, is_html=True)
+        # Delivered by the outbox dispatcher; poll /outbox/messages/<id> for the outcome
+        message_id = email_service.queue_email(OutgoingEmail(test_email_address, subject, body, is_html=True, key='test-email'))
         
-        if success:
-            return jsonify({
-                'success': True,
-                'message': f'Test email sent successfully to {test_email_address}'
-            })
-        else:
-            return jsonify({
-                'success': False,
-                'error': 'Failed to send test email'
-            }), 500
+        return jsonify({
+            'success': True,
+            'message': f'Test email queued for {test_email_address}',
+            'message_id': message_id
+        }), 202
             
     except Exception as e:
         logger.error(f"Error sending test email: {str(e)}")
@@ -618,9 +1238,115 @@ def test_email():
             'error': str(e)
         }), 500
 
+@app.route('/outbox/status', methods=['GET'])
+def outbox_status():
+    """Queue depth, drain rate and dead-letter count of the email outbox"""
+    try:
+        return jsonify({
+            'success': True,
+            'outbox': email_service.outbox.stats()
+        })
+    except Exception as e:
+        logger.error(f"Error getting outbox status: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/outbox/messages/<int:message_id>', methods=['GET'])
+def outbox_message(message_id):
+    """Delivery status of one queued email"""
+    message = email_service.outbox.get(message_id)
+    if message is None:
+        return jsonify({'success': False, 'error': 'Message not found'}), 404
+    message.pop('body', None)
+    return jsonify({'success': True, 'message': message})
+
+@app.route('/outbox/dead-letters', methods=['GET'])
+def outbox_dead_letters():
+    """Emails that used up their retries, most recent first"""
+    try:
+        limit = int(request.args.get('limit', 100))
+        messages = email_service.outbox.dead_letters(limit)
+        for message in messages:
+            message.pop('body', None)
+        return jsonify({
+            'success': True,
+            'dead_letters': messages
+        })
+    except ValueError:
+        return jsonify({'success': False, 'error': 'limit must be an integer'}), 400
+    except Exception as e:
+        logger.error(f"Error listing dead letters: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/outbox/retry', methods=['POST'])
+def outbox_retry():
+    """Requeue dead letters: every one, or the ids listed in the body"""
+    try:
+        data = request.get_json(silent=True) or {}
+        requeued = email_service.outbox.retry_dead(data.get('ids'))
+        return jsonify({
+            'success': True,
+            'requeued': requeued
+        })
+    except Exception as e:
+        logger.error(f"Error requeueing dead letters: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+# Profiling Endpoints
+PROFILING_DISABLED = {'success': False, 'error': 'Profiling is disabled (set PROFILING_ENABLED=true)'}
+
+@app.route('/admin/profiles', methods=['GET'])
+def list_profiles():
+    """Stored request and scheduler-run profiles, newest first"""
+    if not profiler.enabled:
+        return jsonify(PROFILING_DISABLED), 404
+    return jsonify({
+        'success': True,
+        'profiles': profiler.list(),
+        'armed': profiler.armed()
+    })
+
+@app.route('/admin/profiles/<profile_id>', methods=['GET'])
+def get_profile(profile_id):
+    """Span tree and function profile of one profiled request or run"""
+    if not profiler.enabled:
+        return jsonify(PROFILING_DISABLED), 404
+    profile = profiler.get(profile_id)
+    if profile is None:
+        return jsonify({'success': False, 'error': 'Profile not found'}), 404
+    return jsonify({'success': True, 'profile': profile})
+
+@app.route('/admin/profiles/scheduler', methods=['POST'])
+def arm_scheduler_profile():
+    """Profile the next scheduler run (scheduled, manual or multi-landlord)"""
+    try:
+        if not profiler.enabled:
+            return jsonify(PROFILING_DISABLED), 404
+        data = request.get_json(silent=True) or {}
+        return jsonify({
+            'success': True,
+            'armed': profiler.arm('scheduler', data.get('mode'))
+        })
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
 if __name__ == '__main__':
     # Check if OpenAI API key is set
     if not os.getenv('OPENAI_API_KEY'):
         logger.warning("OPENAI_API_KEY not found in environment variables. The chatbot will use fallback responses.")
     
+    # Deliver anything left in the outbox by a previous run
+    email_service.outbox.start()
+    
+    # Campaign for the scheduler lease (resumes the scheduler if it was left enabled)
+    scheduler_lease.start()
+    
     app.run(debug=True, host='0.0.0.0', port=5001) 
\ No newline at end of file
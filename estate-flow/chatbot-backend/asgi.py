@@ -0,0 +1,340 @@
+"""ASGI entry point: serve the chatbot backend from a single asyncio process.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5001
+
+/chat, /chat/stream and /email/test are handled natively on the event loop:
+OpenAI is awaited through the async client and email is handed to the
+outbox, whose dispatcher thread does the SMTP work, so hundreds of
+in-flight chats only cost a coroutine each. Every other route is passed through to the Flask app on a
+small thread pool, so all endpoints keep their paths and response shapes.
+
+Several workers (uvicorn --workers N) can share the same files: only the one
+holding the scheduler lease runs the rent scheduler.
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, unquote
+import logging
+from app import (app as flask_app, analyzer, parse_chat_request, ChatRequestError, sse_event,
+                 test_email_content, NO_PROPERTIES_RESPONSE)
+from email_service import email_service, OutgoingEmail
+from scheduler_lease import scheduler_lease
+from metrics import HTTP_REQUESTS, HTTP_REQUEST_SECONDS
+from profiling import profiler, stage
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Threads for the routes that still run through Flask
+_wsgi_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('WSGI_WORKERS', '16')),
+    thread_name_prefix='wsgi'
+)
+
+CORS_HEADERS = [(b'access-control-allow-origin', b'*')]
+
+
+async def _read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise ConnectionError("Client disconnected before sending the request body")
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def _spool_body(receive):
+    """Request body for a passthrough route, spilled to a temporary file past WSGI_SPOOL_BYTES.
+
+    Large uploads such as CSV imports are then read back by Flask a piece at
+    a time instead of sitting in memory whole.
+    """
+    body = tempfile.SpooledTemporaryFile(max_size=int(os.getenv('WSGI_SPOOL_BYTES', str(1024 * 1024))))
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            body.close()
+            raise ConnectionError("Client disconnected before sending the request body")
+        body.write(message.get('body', b''))
+        if not message.get('more_body'):
+            length = body.tell()
+            body.seek(0)
+            return body, length
+
+
+def _json_body(scope, body: bytes):
+    """Request JSON, with the same acceptance rules as Flask's request.get_json()"""
+    headers = dict(scope.get('headers', []))
+    content_type = headers.get(b'content-type', b'').decode('latin-1').lower()
+    if 'json' not in content_type:
+        raise ValueError("Did not attempt to load JSON data because the request Content-Type was not 'application/json'.")
+    return json.loads(body)
+
+
+async def _send_json(send, payload, status: int = 200):
+    body = json.dumps(payload).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())] + CORS_HEADERS
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _until_disconnect(receive, work):
+    """Run work, cancelling it if the client goes away first (which closes any upstream OpenAI call)"""
+    async def wait_for_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    work_task = asyncio.ensure_future(work)
+    disconnect_task = asyncio.ensure_future(wait_for_disconnect())
+    try:
+        await asyncio.wait({work_task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        disconnect_task.cancel()
+    if not work_task.done():
+        logger.info("Client disconnected, cancelling request")
+        work_task.cancel()
+        await asyncio.gather(work_task, return_exceptions=True)
+        return None
+    return work_task.result()
+
+
+async def chat(scope, receive, send, body: bytes):
+    try:
+        with stage('parse'):
+            user_message, record, properties = parse_chat_request(_json_body(scope, body))
+
+        if record is not None:
+            work = analyzer.analyze_portfolio_async(record, user_message)
+        elif not properties:
+            await _send_json(send, {'response': NO_PROPERTIES_RESPONSE})
+            return
+        else:
+            work = analyzer.analyze_properties_async(properties, user_message)
+
+        response = await _until_disconnect(receive, work)
+        if response is not None:
+            await _send_json(send, {'response': response})
+
+    except ChatRequestError as e:
+        await _send_json(send, {'error': str(e)}, e.status)
+    except Exception as e:
+        logger.error(f"Error in chat endpoint: {str(e)}")
+        await _send_json(send, {'error': 'Internal server error'}, 500)
+
+
+async def chat_stream(scope, receive, send, body: bytes):
+    try:
+        with stage('parse'):
+            user_message, record, properties = parse_chat_request(_json_body(scope, body))
+    except ChatRequestError as e:
+        await _send_json(send, {'error': str(e)}, e.status)
+        return
+    except Exception as e:
+        logger.error(f"Error in chat stream endpoint: {str(e)}")
+        await _send_json(send, {'error': 'Internal server error'}, 500)
+        return
+
+    if record is not None:
+        pieces = analyzer.stream_portfolio_async(record, user_message)
+    elif not properties:
+        pieces = None
+    else:
+        pieces = analyzer.stream_properties_async(properties, user_message)
+
+    async def stream_events():
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(b'content-type', b'text/event-stream; charset=utf-8'), (b'cache-control', b'no-cache'),
+                        (b'x-accel-buffering', b'no')] + CORS_HEADERS
+        })
+        parts = []
+        try:
+            if pieces is None:
+                parts.append(NO_PROPERTIES_RESPONSE)
+                await send({'type': 'http.response.body', 'body': sse_event({'delta': NO_PROPERTIES_RESPONSE}).encode(), 'more_body': True})
+            else:
+                async for piece in pieces:
+                    parts.append(piece)
+                    await send({'type': 'http.response.body', 'body': sse_event({'delta': piece}).encode(), 'more_body': True})
+            final = sse_event({'response': ''.join(parts)}, 'done')
+        except Exception as e:
+            logger.error(f"Error while streaming chat response: {str(e)}")
+            final = sse_event({'error': 'Internal server error'}, 'error')
+        await send({'type': 'http.response.body', 'body': final.encode()})
+
+    await _until_disconnect(receive, stream_events())
+
+
+async def test_email(scope, receive, send, body: bytes):
+    try:
+        data = _json_body(scope, body)
+        test_email_address = data.get('email', os.getenv('LANDLORD_EMAIL'))
+
+        if not test_email_address:
+            await _send_json(send, {
+                'success': False,
+                'error': 'No email address provided and LANDLORD_EMAIL not configured'
+            }, 400)
+            return
+
+        subject, html = test_email_content()
+        # A local SQLite insert; the outbox dispatcher does the SMTP work
+        message_id = email_service.queue_email(OutgoingEmail(test_email_address, subject, html, is_html=True, key='test-email'))
+
+        await _send_json(send, {
+            'success': True,
+            'message': f'Test email queued for {test_email_address}',
+            'message_id': message_id
+        }, 202)
+
+    except Exception as e:
+        logger.error(f"Error sending test email: {str(e)}")
+        await _send_json(send, {'success': False, 'error': str(e)}, 500)
+
+
+NATIVE_ROUTES = {
+    ('POST', '/chat'): chat,
+    ('POST', '/chat/stream'): chat_stream,
+    ('POST', '/email/test'): test_email,
+}
+
+
+def _profile_flag(scope):
+    """The X-Profile header or profile query value of a native request"""
+    for name, value in scope.get('headers', []):
+        if name == b'x-profile':
+            return value.decode('latin-1')
+    values = parse_qs(scope.get('query_string', b'').decode('latin-1')).get('profile')
+    return values[0] if values else None
+
+
+def _wsgi_environ(scope, body, length: int) -> dict:
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': unquote(scope['path']),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'CONTENT_LENGTH': str(length),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        key = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if key == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif key != 'CONTENT_LENGTH':
+            key = f'HTTP_{key}'
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def _call_wsgi(environ: dict):
+    """Run the Flask app for one request, buffering the response"""
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+    result = flask_app(environ, start_response)
+    try:
+        body = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return response['status'], response['headers'], body
+
+
+async def _wsgi_passthrough(scope, receive, send):
+    try:
+        body, length = await _spool_body(receive)
+    except ConnectionError:
+        return
+    loop = asyncio.get_running_loop()
+    try:
+        status, headers, response_body = await loop.run_in_executor(
+            _wsgi_executor, _call_wsgi, _wsgi_environ(scope, body, length)
+        )
+    finally:
+        body.close()
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': response_body})
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            email_service.outbox.start()
+            scheduler_lease.start()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if analyzer.async_client is not None:
+                await analyzer.async_client.close()
+            # Hand the scheduler lease to another worker straight away
+            scheduler_lease.stop()
+            email_service.outbox.stop()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    handler = NATIVE_ROUTES.get((scope['method'], scope['path']))
+    if handler is None:
+        await _wsgi_passthrough(scope, receive, send)
+        return
+
+    # Flask records the routes it serves; native ones are recorded here, with 499 if the client left first
+    started = time.perf_counter()
+    statuses = []
+    # Other coroutines run on this thread while the request awaits OpenAI, so they show up in its function profile
+    mode = profiler.requested_mode(_profile_flag(scope))
+    profile = profiler.start('request', f"{scope['method']} {scope['path']}", mode) if mode is not None else None
+
+    async def send_and_note_status(message):
+        if message['type'] == 'http.response.start':
+            statuses.append(message['status'])
+            if profile is not None:
+                message = dict(message, headers=list(message.get('headers', [])) + [(b'x-profile-id', profile.id.encode())])
+        await send(message)
+
+    try:
+        try:
+            body = await _read_body(receive)
+        except ConnectionError:
+            return
+        await handler(scope, receive, send_and_note_status, body)
+    finally:
+        if profile is not None:
+            profile.finish()
+        HTTP_REQUEST_SECONDS.labels(scope['method'], scope['path']).observe(time.perf_counter() - started)
+        HTTP_REQUESTS.labels(scope['method'], scope['path'], str(statuses[0]) if statuses else '499').inc()
@@ -0,0 +1,171 @@
+"""Benchmark: rendering rent reminders with compiled templates vs the old f-string path.
+
+    python benchmarks/bench_email_templates.py [--count 10000]
+
+The legacy functions below are the pre-template implementation (an f-string
+document per message, MIMEMultipart + MIMEText + as_string() per send, and
+the overdue report grown with +=), kept here as the baseline.
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from email_templates import (MimeSkeleton, REMINDER_HTML, OVERDUE_HEADER_HTML, OVERDUE_TENANT_HTML,  # noqa: E402
+                             OVERDUE_FOOTER_HTML)
+
+SENDER = 'landlord@example.com'
+
+
+def legacy_reminder(tenant_info):
+    return f"""
+        <html>
+        <head>
+            <style>
+                body {{ font-family: Arial, sans-serif; margin: 20px; line-height: 1.6; }}
+                .header {{ background-color: #3498db; color: white; padding: 20px; border-radius: 5px; }}
+                .content {{ padding: 20px; }}
+                .important {{ background-color: #fff3cd; border: 1px solid #ffeaa7; padding: 15px; border-radius: 5px; margin: 15px 0; }}
+                .footer {{ color: #666; font-size: 12px; margin-top: 30px; }}
+            </style>
+        </head>
+        <body>
+            <div class="header">
+                <h2>Rent Payment Reminder</h2>
+            </div>
+            
+            <div class="content">
+                <p>Dear {tenant_info.get('tenant_name', 'Tenant')},</p>
+                
+                <p>This is a friendly reminder that your rent payment is due.</p>
+                
+                <div class="important">
+                    <strong>Property Details:</strong><br>
+                    Property: {tenant_info.get('property_name', 'N/A')}<br>
+                    Unit: {tenant_info.get('unit_number', 'N/A')}<br>
+                    Monthly Rent: ${tenant_info.get('rent', 0):,.2f}<br>
+                    Due Date: {tenant_info.get('due_date', 'Check your lease')}
+                </div>
+                
+                <p>Please ensure your payment is submitted as soon as possible to avoid any late fees.</p>
+                
+                <p>If you have already made your payment, please disregard this message. If you have any questions or concerns, please contact us immediately.</p>
+                
+                <p>Thank you for your prompt attention to this matter.</p>
+                
+                <p>Best regards,<br>
+                Property Management Team</p>
+            </div>
+            
+            <div class="footer">
+                This is an automated reminder from your property management system.
+            </div>
+        </body>
+        </html>
+        """
+
+
+def legacy_overdue(overdue_tenants):
+    html_body = f"""
+        <html><body>
+            <p>The following tenants have overdue rent payments as of {datetime.now().strftime('%B %d, %Y')}</p>
+            <p><strong>Total Overdue Tenants:</strong> {len(overdue_tenants)}</p>
+            <h3>Overdue Tenants:</h3>
+        """
+    for tenant in overdue_tenants:
+        html_body += f"""
+            <div class="tenant-item">
+                <div class="property-name">{tenant.get('property_name', 'Unknown Property')} - Unit {tenant.get('unit_number', 'N/A')}</div>
+                <div class="tenant-details"><strong>Tenant:</strong> {tenant.get('tenant_name', 'Unknown')}</div>
+                <div class="tenant-details"><strong>Email:</strong> {tenant.get('tenant_email', 'Not provided')}</div>
+                <div class="tenant-details"><strong>Phone:</strong> {tenant.get('tenant_phone', 'Not provided')}</div>
+                <div class="tenant-details amount"><strong>Overdue Amount:</strong> ${tenant.get('rent', 0):,.2f}</div>
+                <div class="tenant-details"><strong>Days Overdue:</strong> {tenant.get('days_overdue', 'Unknown')}</div>
+            </div>
+            """
+    html_body += """
+        </body>
+        </html>
+        """
+    return html_body
+
+
+def legacy_mime(to_email, subject, body):
+    message = MIMEMultipart("alternative")
+    message["Subject"] = subject
+    message["From"] = SENDER
+    message["To"] = to_email
+    message.attach(MIMEText(body, "html"))
+    return message.as_string()
+
+
+def compiled_reminder(tenant_info):
+    return REMINDER_HTML.render(tenant_info)
+
+
+def compiled_overdue(overdue_tenants):
+    parts = []
+    OVERDUE_HEADER_HTML.render_into(parts, {
+        'report_date': datetime.now().strftime('%B %d, %Y'),
+        'tenant_count': len(overdue_tenants),
+        'total_overdue': sum(tenant.get('rent', 0) for tenant in overdue_tenants)
+    })
+    for tenant in overdue_tenants:
+        OVERDUE_TENANT_HTML.render_into(parts, tenant)
+    OVERDUE_FOOTER_HTML.render_into(parts, {})
+    return ''.join(parts)
+
+
+def tenants(count):
+    return [{
+        'tenant_name': f'Tenant {i}',
+        'tenant_email': f'tenant{i}@example.com',
+        'tenant_phone': f'555-{i:04d}',
+        'property_name': f'Property {i % 40}',
+        'unit_number': str(100 + i % 300),
+        'rent': 1200 + (i % 17) * 75.5,
+        'due_date': 'June 1, 2025',
+        'days_overdue': i % 30
+    } for i in range(count)]
+
+
+def timed(fn, repeat=3):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=10000, help='reminders to render (default: 10000)')
+    args = parser.parse_args()
+
+    rows = tenants(args.count)
+    skeleton = MimeSkeleton(SENDER)
+    subject = 'Rent Payment Reminder - Property 1'
+
+    results = [
+        ('reminder body', timed(lambda: [legacy_reminder(t) for t in rows]),
+         timed(lambda: [compiled_reminder(t) for t in rows])),
+        ('reminder body + MIME', timed(lambda: [legacy_mime(t['tenant_email'], subject, legacy_reminder(t)) for t in rows]),
+         timed(lambda: [skeleton.render(t['tenant_email'], subject, compiled_reminder(t), True) for t in rows])),
+        ('overdue report', timed(lambda: legacy_overdue(rows)), timed(lambda: compiled_overdue(rows))),
+    ]
+
+    print(f"{args.count} tenants, best of 3")
+    print(f"{'':24}{'legacy':>12}{'compiled':>12}{'speedup':>10}")
+    for name, legacy, compiled in results:
+        print(f"{name:24}{legacy * 1000:>10.1f}ms{compiled * 1000:>10.1f}ms{legacy / compiled:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
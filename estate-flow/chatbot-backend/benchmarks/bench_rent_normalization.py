@@ -0,0 +1,79 @@
+"""Benchmark: parsing a rent column with normalize_rents vs the old per-value path.
+
+    python benchmarks/bench_rent_normalization.py [--count 100000]
+
+legacy_parse_rent below is the pre-vectorization parse_rent (chained
+str.replace and float() per value, unreadable values silently 0.0), kept
+here as the baseline, fed through np.fromiter the way PortfolioFrame used it.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from portfolio_engine import normalize_rents  # noqa: E402
+
+
+def legacy_parse_rent(rent_value) -> float:
+    if isinstance(rent_value, (int, float)):
+        return float(rent_value)
+
+    if isinstance(rent_value, str):
+        cleaned = rent_value.replace('$', '').replace(',', '').replace(' ', '')
+        try:
+            return float(cleaned)
+        except ValueError:
+            return 0.0
+
+    return 0.0
+
+
+def legacy_column(values):
+    return np.fromiter((legacy_parse_rent(value) for value in values), dtype=np.float64, count=len(values))
+
+
+def columns(count):
+    numbers = [1200 + (i % 17) * 75.5 for i in range(count)]
+    formats = ('${:,.2f}', '{:.0f}', '$ {:,.0f}', '{:.2f}')
+    currency = [formats[i % len(formats)].format(rent) for i, rent in enumerate(numbers)]
+    european = [f"€{rent:,.2f}".replace(',', ' ').replace('.', ',').replace(' ', '.') for rent in numbers]
+    mixed = [
+        (rent, f"${rent:,.2f}", f"{rent / 1000:.1f}k", f"{rent:.2f}".replace('.', ','), None, 'TBD')[i % 6]
+        for i, rent in enumerate(numbers)
+    ]
+    return [('numbers', numbers), ('US currency text', currency), ('European text', european),
+            ('mixed (k, blanks, bad)', mixed)]
+
+
+def timed(fn, repeat=3):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=100000, help='rents per column (default: 100000)')
+    args = parser.parse_args()
+
+    print(f"{args.count} rents per column, best of 3")
+    print(f"{'':24}{'legacy':>12}{'vectorized':>12}{'speedup':>10}{'legacy 0.0':>12}{'flagged':>10}")
+    for name, values in columns(args.count):
+        legacy = timed(lambda: legacy_column(values))
+        vectorized = timed(lambda: normalize_rents(values))
+        legacy_zero = int((legacy_column(values) == 0).sum())
+        flagged = int(normalize_rents(values)[1].sum())
+        print(f"{name:24}{legacy * 1000:>10.1f}ms{vectorized * 1000:>10.1f}ms{legacy / vectorized:>9.1f}x"
+              f"{legacy_zero:>12}{flagged:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,472 @@
+"""Benchmark suite: the chatbot backend's hot paths on synthetic portfolios.
+
+    python benchmarks/run_benchmarks.py [--sizes 10,1000,10000,100000] [--only chat,manual_check]
+                                        [--output benchmarks/latest.json]
+                                        [--baseline benchmarks/baseline.json] [--threshold 0.25]
+
+Portfolios are generated from 10 to 100k units, shaped like the exports in
+sample_data/ (a mix of currency formats, vacancies, paid and unpaid rent,
+due days spread over the month). Each benchmark is timed for at least
+--min-time seconds and reports throughput (units per second at the median),
+p50/p99 latency and peak Python memory, measured in one extra run under
+tracemalloc so it doesn't skew the timings.
+
+OpenAI is replaced by the built-in stub (OPENAI_STUB) with no token delay,
+and email goes to an SMTP sink started on localhost, so /scheduler/manual-check
+runs end to end: query, render, queue, and deliver through the outbox. All
+databases and data files live in a temporary directory.
+
+Results are written as JSON. With --baseline, each benchmark's p50 and peak
+memory are compared with the baseline run, and the exit status is 1 if any
+of them grew by more than --threshold (0.25 = 25%). Sub-millisecond timings
+and tiny allocations are listed but never flagged.
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import random
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, BACKEND_DIR)
+
+BENCHMARKS = ('analyze_properties', 'fallback_response', 'overdue_tenants', 'email_render', 'chat', 'chat_cached',
+              'manual_check')
+
+# Goes past the local query engine to the (stub) OpenAI call, so /chat and
+# analyze_properties are timed through summary, prompt building and completion
+CHAT_QUESTION = "How can I improve my portfolio?"
+# A rephrasing of CHAT_QUESTION, answered from the response cache once CHAT_QUESTION has been asked
+CHAT_REPHRASED = "how could we improve the portfolio"
+
+# Questions across the keyword fallback's branches
+FALLBACK_QUESTIONS = (
+    "What's my occupancy rate?",
+    "Which unit has the highest rent?",
+    "Who pays the lowest rent?",
+    "What's the most expensive vacant unit?",
+    "Show me my vacant units",
+    "How many tenants do I have?",
+    "What is my total monthly revenue?",
+    "How can I improve my portfolio?",
+    "Which property performs best?",
+)
+
+# Modeled on sample_data/*.csv
+PROPERTY_NAMES = ('Sunset Gardens Apartments', 'Riverside Manor', 'Oceanview Heights', 'Pine Valley Estates',
+                  'Luxury Towers', 'Maple Court', 'Harbor Point', 'Cedar Ridge Lofts')
+STREETS = ('Oak Street', 'Maple Drive', 'Coast Highway', 'Forest Road', 'Elite Avenue', 'Main Street')
+CITIES = ('Beverly Hills CA 90210', 'Portland OR 97205', 'Malibu CA 90265', 'Denver CO 80203')
+FIRST_NAMES = ('Sarah', 'Mike', 'Jennifer', 'Victoria', 'Emma', 'Robert', 'David', 'Maria', 'James', 'Linda')
+LAST_NAMES = ('Johnson', 'Rodriguez', 'Walsh', 'Stone', 'Davis', 'Sterling', 'Chen', 'Garcia', 'Smith', 'Brown')
+RENT_FORMATS = ('{:.0f}', '${:.2f}', '${:,.0f}', '{:.2f}')
+
+
+def synthetic_portfolio(units: int, seed: int = 42):
+    """Properties list in the frontend's JSON shape with about `units` units"""
+    rng = random.Random(seed)
+    today = date.today()
+    per_property = max(1, min(60, units // 4 or 1))
+    properties = []
+    made = 0
+    while made < units:
+        index = len(properties)
+        count = min(per_property, units - made)
+        prop_units = []
+        for number in range(count):
+            bedrooms = rng.choice((0, 1, 1, 2, 2, 2, 3, 4))
+            rent = 900 + bedrooms * 650 + rng.randrange(0, 800)
+            unit = {
+                'number': f"{100 * (number // 20 + 1) + number % 20 + 1}",
+                'bedrooms': bedrooms,
+                'bathrooms': max(1, bedrooms - rng.choice((0, 1))),
+                'squareFeet': 450 + bedrooms * 350 + rng.randrange(0, 200),
+                'rent': RENT_FORMATS[rng.randrange(len(RENT_FORMATS))].format(rent),
+                'tenant': None,
+                'rentPaid': False
+            }
+            if rng.random() < 0.88:
+                first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+                start = today - timedelta(days=rng.randrange(30, 700))
+                unit['tenant'] = {
+                    'name': f"{first} {last}",
+                    'email': f"{first.lower()}.{last.lower()}{index}-{number}@example.com",
+                    'phone': f"555-{rng.randrange(10000):04d}",
+                    'leaseStart': start.isoformat(),
+                    'leaseEnd': (start + timedelta(days=365)).isoformat(),
+                    'rentDueDay': rng.randrange(1, 29)
+                }
+                unit['rentPaid'] = rng.random() < 0.7
+            prop_units.append(unit)
+        properties.append({
+            'name': f"{PROPERTY_NAMES[index % len(PROPERTY_NAMES)]} {index // len(PROPERTY_NAMES) + 1}",
+            'address': f"{rng.randrange(100, 9999)} {rng.choice(STREETS)} {rng.choice(CITIES)}",
+            'units': prop_units,
+            'numUnits': count
+        })
+        made += count
+    return properties
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """Just enough of an SMTP server to accept and count messages"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SMTPSinkHandler)
+        self.received = 0
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever, name='smtp-sink', daemon=True)
+        self.thread.start()
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    def reply(self, line: str):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        self.reply('220 localhost benchmark sink')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('ascii', 'replace').strip().upper()
+            if command.startswith(('EHLO', 'HELO')):
+                self.wfile.write(b'250-localhost\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME\r\n')
+            elif command.startswith('AUTH LOGIN'):
+                self.reply('334 ' + base64.b64encode(b'Username:').decode())
+                self.rfile.readline()
+                self.reply('334 ' + base64.b64encode(b'Password:').decode())
+                self.rfile.readline()
+                self.reply('235 Authentication successful')
+            elif command.startswith('AUTH'):
+                self.reply('235 Authentication successful')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b'.\n', b''):
+                    pass
+                with self.server.lock:
+                    self.server.received += 1
+                self.reply('250 OK queued')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                # MAIL, RCPT, NOOP, RSET
+                self.reply('250 OK')
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    rank = (len(ordered) - 1) * q / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def measure(name, size, run, setup=None, min_time=1.0, max_iterations=200, min_iterations=3):
+    """Time run() repeatedly after one warm-up call, then once more under tracemalloc for the memory peak"""
+    # The warm-up absorbs one-off work such as importing a changed data file into the store
+    if setup is not None:
+        setup()
+    run()
+
+    samples = []
+    started = time.perf_counter()
+    while len(samples) < min_iterations or (time.perf_counter() - started < min_time and len(samples) < max_iterations):
+        if setup is not None:
+            setup()
+        begin = time.perf_counter()
+        run()
+        samples.append(time.perf_counter() - begin)
+
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    p50 = percentile(samples, 50)
+    return {
+        'benchmark': name,
+        'units': size,
+        'iterations': len(samples),
+        'p50_ms': round(p50 * 1000, 3),
+        'p99_ms': round(percentile(samples, 99) * 1000, 3),
+        'mean_ms': round(sum(samples) / len(samples) * 1000, 3),
+        'units_per_second': round(size / p50) if p50 > 0 else None,
+        'peak_memory_mb': round(peak / 1024 / 1024, 3)
+    }
+
+
+class Suite:
+    """Runs each benchmark against one synthetic portfolio size"""
+
+    def __init__(self, workdir, smtp):
+        self.workdir = workdir
+        self.smtp = smtp
+        # Imported after the environment is pointed at the stubs and the work directory
+        import app as backend
+        from email_service import email_service
+        from notification_ledger import notification_ledger
+        from scheduler_service import RentScheduler, rent_scheduler
+        from summary_cache import summary_cache
+        from response_cache import response_cache
+        self.backend = backend
+        self.analyzer = backend.analyzer
+        self.client = backend.app.test_client()
+        self.email_service = email_service
+        self.ledger = notification_ledger
+        self.RentScheduler = RentScheduler
+        self.rent_scheduler = rent_scheduler
+        self.summary_cache = summary_cache
+        self.response_cache = response_cache
+
+    def clear_caches(self):
+        self.summary_cache.clear()
+        self.response_cache.clear()
+
+    def write_data_file(self, properties):
+        path = os.path.join(self.workdir, 'properties_data.json')
+        with open(path, 'w') as file:
+            json.dump(properties, file)
+        # Make sure the store sees a new modification time even within the same second
+        stamp = time.time() + 1
+        os.utime(path, (stamp, stamp))
+
+    def run(self, names, size, min_time):
+        properties = synthetic_portfolio(size)
+        self.write_data_file(properties)
+        results = []
+        for name in names:
+            result = getattr(self, f'bench_{name}')(properties, size, min_time)
+            print(f"  {name:20}{size:>8} units  p50 {result['p50_ms']:>10.2f}ms  p99 {result['p99_ms']:>10.2f}ms"
+                  f"  {result['units_per_second'] or 0:>12,} units/s  peak {result['peak_memory_mb']:>8.1f}MB", flush=True)
+            results.append(result)
+        return results
+
+    def bench_analyze_properties(self, properties, size, min_time):
+        # Cold: the caches are cleared, so each call aggregates the portfolio and asks the stub again
+        return measure('analyze_properties', size,
+                       lambda: self.analyzer.analyze_properties(properties, CHAT_QUESTION),
+                       setup=self.clear_caches, min_time=min_time)
+
+    def bench_fallback_response(self, properties, size, min_time):
+        self.summary_cache.clear()
+        summary = self.analyzer._properties_snapshot(properties).summary
+
+        def answer_all():
+            # Without a snapshot the ranking index is built per call, as for a portfolio's first question
+            for question in FALLBACK_QUESTIONS:
+                self.analyzer._generate_fallback_response(summary, question)
+
+        return measure('fallback_response', size, answer_all, min_time=min_time)
+
+    def bench_overdue_tenants(self, properties, size, min_time):
+        scheduler = self.RentScheduler(os.path.join(self.workdir, 'properties_data.json'),
+                                       db_path=os.path.join(self.workdir, 'bench_overdue.db'), job_set='bench')
+
+        def reset():
+            # Rebuild the due-date index each time, as after a data change
+            scheduler._due_index = None
+
+        return measure('overdue_tenants', size, scheduler.get_overdue_tenants, setup=reset, min_time=min_time)
+
+    def bench_email_render(self, properties, size, min_time):
+        scheduler = self.RentScheduler(os.path.join(self.workdir, 'properties_data.json'),
+                                       db_path=os.path.join(self.workdir, 'bench_overdue.db'), job_set='bench')
+        overdue = scheduler.get_overdue_tenants()
+
+        def render():
+            for tenant in overdue:
+                self.email_service.build_rent_reminder(tenant)
+            self.email_service.build_rent_overdue_notification(overdue)
+
+        return measure('email_render', size, render, min_time=min_time)
+
+    def chat(self, properties, message):
+        response = self.client.post('/chat', json={'message': message, 'properties': properties})
+        if response.status_code != 200:
+            raise RuntimeError(f"/chat returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+
+    def bench_chat(self, properties, size, min_time):
+        return measure('chat', size, lambda: self.chat(properties, CHAT_QUESTION), setup=self.clear_caches,
+                       min_time=min_time)
+
+    def bench_chat_cached(self, properties, size, min_time):
+        # Warm: the portfolio is summarized and CHAT_QUESTION answered once, then a rephrasing
+        # is served from the response cache (the payload is still hashed and parsed per request)
+        self.clear_caches()
+        self.chat(properties, CHAT_QUESTION)
+        hits = self.response_cache.stats()['hits']
+        result = measure('chat_cached', size, lambda: self.chat(properties, CHAT_REPHRASED), min_time=min_time)
+        if self.response_cache.stats()['hits'] == hits:
+            raise RuntimeError("chat_cached was not answered from the response cache")
+        return result
+
+    def bench_manual_check(self, properties, size, min_time):
+        outbox = self.email_service.outbox
+
+        def reset():
+            # Forget every recorded notice so each run sends the full set again
+            self.ledger.prune(today=date.max)
+
+        delivered = []
+
+        def manual_check():
+            before = self.smtp.received
+            response = self.client.post('/scheduler/manual-check', json={})
+            if response.status_code != 200:
+                raise RuntimeError(f"/scheduler/manual-check returned {response.status_code}")
+            # Until the outbox has delivered everything to the SMTP sink
+            deadline = time.monotonic() + 600
+            while time.monotonic() < deadline:
+                stats = outbox.stats()
+                if stats['depth'] == 0 and stats['in_flight'] == 0:
+                    delivered.append(self.smtp.received - before)
+                    return
+                time.sleep(0.005)
+            raise RuntimeError("Outbox did not drain within 10 minutes")
+
+        result = measure('manual_check', size, manual_check, setup=reset, min_time=min_time, max_iterations=20)
+        result['emails_per_run'] = delivered[-1]
+        return result
+
+
+# Baseline values below these are too small to compare reliably and are never flagged
+NOISE_FLOOR = {'p50_ms': 1.0, 'peak_memory_mb': 0.5}
+
+
+def compare(results, baseline, threshold):
+    """Rows of (key, metric, baseline, current, change, flagged) and whether any exceeded the threshold"""
+    previous = {f"{entry['benchmark']}@{entry['units']}": entry for entry in baseline.get('results', [])}
+    rows = []
+    regressed = False
+    for entry in results:
+        key = f"{entry['benchmark']}@{entry['units']}"
+        before = previous.get(key)
+        if before is None:
+            continue
+        for metric in ('p50_ms', 'peak_memory_mb'):
+            old, new = before.get(metric), entry.get(metric)
+            if not old or new is None:
+                continue
+            change = new / old - 1
+            flag = change > threshold and old >= NOISE_FLOOR[metric]
+            regressed = regressed or flag
+            rows.append((key, metric, old, new, change, flag))
+    return rows, regressed
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10,1000,10000,100000', help='portfolio sizes in units (default: 10,1000,10000,100000)')
+    parser.add_argument('--only', default=','.join(BENCHMARKS), help=f"benchmarks to run (default: all of {', '.join(BENCHMARKS)})")
+    parser.add_argument('--min-time', type=float, default=1.0, help='seconds to spend timing each benchmark (default: 1)')
+    parser.add_argument('--output', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'latest.json'),
+                        help='where to write the results (default: benchmarks/latest.json)')
+    parser.add_argument('--baseline', help='results JSON from an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed growth over the baseline (default: 0.25)')
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.only.split(',') if name.strip()]
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+    sizes = [int(size) for size in args.sizes.split(',')]
+    output = os.path.abspath(args.output)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+    smtp = SMTPSink()
+    workdir = tempfile.mkdtemp(prefix='estateflow-bench-')
+    os.chdir(workdir)
+    os.environ.update({
+        'OPENAI_STUB': 'true',
+        'OPENAI_STUB_TOKEN_DELAY': '0',
+        # The stub has no quota to protect, so don't pace calls to the default OpenAI limits
+        'OPENAI_RPM': '0',
+        'OPENAI_TPM': '0',
+        'SMTP_SERVER': '127.0.0.1',
+        'SMTP_PORT': str(smtp.port),
+        'SMTP_USE_TLS': 'false',
+        'SMTP_RATE_LIMIT': '0',
+        'SENDER_EMAIL': 'bench@example.com',
+        'SENDER_PASSWORD': 'bench',
+        'LANDLORD_EMAIL': 'landlord@example.com',
+        'LANDLORDS_FILE': os.path.join(workdir, 'landlords.json'),
+    })
+    # Keep per-request logging out of the timings
+    import logging
+    logging.disable(logging.WARNING)
+
+    suite = Suite(workdir, smtp)
+    print(f"Working directory {workdir}, SMTP sink on port {smtp.port}")
+    results = []
+    for size in sizes:
+        results.extend(suite.run(names, size, args.min_time))
+    suite.email_service.outbox.stop()
+
+    try:
+        import resource
+        max_rss_mb = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    except ImportError:
+        max_rss_mb = None
+    report = {
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'min_time_seconds': args.min_time,
+            'max_rss_mb': max_rss_mb
+        },
+        'results': results
+    }
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {output}")
+
+    if baseline is None:
+        return 0
+    rows, regressed = compare(results, baseline, args.threshold)
+    print(f"\nAgainst baseline {args.baseline} ({baseline.get('meta', {}).get('git_revision')}), "
+          f"threshold {args.threshold:.0%}")
+    for key, metric, old, new, change, flag in rows:
+        print(f"  {key:28}{metric:16}{old:>12.2f}{new:>12.2f}{change:>+9.1%}{'  REGRESSION' if flag else ''}")
+    print("Regressions found" if regressed else "No regressions")
+    return 1 if regressed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
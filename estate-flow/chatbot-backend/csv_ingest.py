@@ -0,0 +1,276 @@
+"""Streaming CSV import into the server-side portfolio store.
+
+Uploads are read a chunk of rows at a time straight off the request stream,
+so the raw file is never held in memory; only the parsed units are kept for
+the store. Column names are matched the same way the frontend's CSV upload
+matches them (exact names first, then partial matches), so every export in
+sample_data/ imports without a manual mapping. Rents are parsed to numbers
+here, a whole chunk per vectorized pass, and rows that can't be imported are
+reported by line number.
+"""
+import csv
+import io
+import os
+import time
+from collections import OrderedDict
+from itertools import islice
+from typing import IO, Dict, Iterator, List, Tuple
+import logging
+from portfolio_engine import normalize_rents
+from portfolio_store import portfolio_store, PortfolioRecord
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Exact header names per field, as in CSVUpload.js autoDetectMapping
+EXACT_HEADERS = OrderedDict([
+    ('propertyName', ('property name', 'property title', 'building name', 'complex name', 'property', 'building', 'complex')),
+    ('propertyAddress', ('property address', 'full address', 'street address', 'address', 'location')),
+    ('unitNumber', ('unit number', 'unit #', 'unit id', 'apt number', 'apt', 'apartment', 'unit')),
+    ('bedrooms', ('bedrooms', 'number of bedrooms', 'beds', 'br', 'bed')),
+    ('bathrooms', ('bathrooms', 'number of bathrooms', 'baths', 'ba', 'bath')),
+    ('squareFeet', ('square feet', 'square footage', 'sq ft', 'sqft', 'size', 'size (sq ft)')),
+    ('rent', ('monthly rent', 'monthly rental price', 'rent cost', 'rent', 'price', 'cost')),
+    ('tenantName', ('tenant name', 'tenant full name', 'renter name', 'occupant name', 'resident', 'tenant')),
+    ('tenantEmail', ('tenant email', 'email address', 'contact email', 'e-mail', 'email')),
+    ('tenantPhone', ('tenant phone', 'phone number', 'contact number', 'contact phone', 'tel', 'phone', 'mobile')),
+    ('leaseStart', ('lease start', 'lease start date', 'start date', 'move in date', 'tenancy start')),
+    ('leaseEnd', ('lease end', 'lease end date', 'end date', 'lease expires', 'tenancy end')),
+])
+
+# Partial matches tried in order for headers with no exact match:
+# (field, header contains any of, header must also contain)
+FALLBACK_HEADERS = (
+    ('propertyName', ('property', 'building', 'complex'), None),
+    ('propertyAddress', ('address',), None),
+    ('unitNumber', ('unit', 'apt', 'suite'), None),
+    ('bedrooms', ('bed',), None),
+    ('bathrooms', ('bath',), None),
+    ('squareFeet', ('sqft', 'sq', 'size'), None),
+    ('rent', ('rent', 'price', 'cost'), None),
+    ('tenantPhone', ('phone', 'tel', 'mobile'), None),
+    ('tenantEmail', ('email', 'mail'), None),
+    ('tenantName', ('tenant', 'renter', 'resident', 'occupant'), 'name'),
+    ('leaseStart', ('start',), None),
+    ('leaseEnd', ('end',), None),
+)
+
+_EXACT_LOOKUP = {name: field for field, names in EXACT_HEADERS.items() for name in names}
+
+
+def detect_mapping(headers: List[str]) -> Dict[str, int]:
+    """Map field name -> column index for a CSV header row"""
+    mapping = {}
+    for index, header in enumerate(headers):
+        normalized = header.strip().lower()
+        field = _EXACT_LOOKUP.get(normalized)
+        if field is not None:
+            mapping[field] = index
+            continue
+        for field, any_of, also in FALLBACK_HEADERS:
+            if field in mapping:
+                continue
+            if any(word in normalized for word in any_of) and (also is None or also in normalized):
+                mapping[field] = index
+                break
+    return mapping
+
+
+def _count(value: str, cast, default):
+    """Bedroom/bathroom counts, falling back like the frontend does on blank or odd values"""
+    try:
+        return cast(float(value)) if value else default
+    except ValueError:
+        return default
+
+
+class CSVImportError(ValueError):
+    """Raised when an upload can't be imported at all; carries the import report"""
+
+    def __init__(self, message: str, report: Dict = None):
+        super().__init__(message)
+        self.report = report or {}
+
+
+class ImportResult:
+    """Properties parsed from one upload plus counters for the import report"""
+
+    def __init__(self, max_errors: int):
+        self.max_errors = max_errors
+        self.properties = OrderedDict()
+        self.mapping = {}
+        self.unmapped_headers = []
+        self.rows = 0
+        self.imported = 0
+        self.blank_rows = 0
+        self.error_count = 0
+        self.errors = []
+        self.chunks = 0
+        self.parse_seconds = 0.0
+        self.store_seconds = 0.0
+
+    def add_error(self, line: int, error: str):
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'row': line, 'error': error})
+
+    def property_list(self) -> List[Dict]:
+        properties = []
+        for entry in self.properties.values():
+            units = list(entry['units'].values())
+            properties.append({'name': entry['name'], 'address': entry['address'], 'units': units,
+                               'numUnits': len(units)})
+        return properties
+
+    def report(self) -> Dict:
+        seconds = self.parse_seconds + self.store_seconds
+        return {
+            'rows': self.rows,
+            'imported': self.imported,
+            'blank_rows': self.blank_rows,
+            'error_count': self.error_count,
+            'errors': self.errors,
+            'errors_truncated': self.error_count > len(self.errors),
+            'properties': len(self.properties),
+            'mapping': self.mapping,
+            'unmapped_headers': self.unmapped_headers,
+            'chunks': self.chunks,
+            'parse_seconds': round(self.parse_seconds, 3),
+            'store_seconds': round(self.store_seconds, 3),
+            'rows_per_second': round(self.rows / seconds) if seconds > 0 else None
+        }
+
+
+class CSVIngestor:
+    """Parses CSV uploads chunk by chunk into the portfolio shape and stores them"""
+
+    def __init__(self, chunk_rows: int = None, max_errors: int = None):
+        self.chunk_rows = chunk_rows or int(os.getenv('INGEST_CHUNK_ROWS', '5000'))
+        self.max_errors = max_errors if max_errors is not None else int(os.getenv('INGEST_MAX_ERRORS', '100'))
+
+    def ingest(self, stream: IO[bytes], portfolio_id: str = None) -> Tuple[PortfolioRecord, Dict]:
+        """Parse an upload and store it as a new portfolio, or replace portfolio_id's contents"""
+        if portfolio_id:
+            # Fail before reading the upload if there is nothing to replace
+            portfolio_store.get(portfolio_id)
+        result = self.parse(stream)
+        if result.imported == 0:
+            raise CSVImportError('No rows could be imported', result.report())
+
+        started = time.perf_counter()
+        properties = result.property_list()
+        if portfolio_id:
+            record = portfolio_store.replace(portfolio_id, properties)
+        else:
+            record = portfolio_store.create(properties)
+        result.store_seconds = time.perf_counter() - started
+
+        report = result.report()
+        logger.info(f"Imported {result.imported} of {result.rows} CSV rows into portfolio {record.portfolio_id} "
+                    f"({report['rows_per_second']} rows/s, {result.error_count} errors)")
+        return record, report
+
+    def parse(self, stream: IO[bytes]) -> ImportResult:
+        """Parse a binary CSV stream without reading it all at once"""
+        started = time.perf_counter()
+        result = ImportResult(self.max_errors)
+        # utf-8-sig drops the byte order mark spreadsheet exports often start with
+        text = io.TextIOWrapper(stream, encoding='utf-8-sig', errors='replace', newline='')
+        try:
+            reader = csv.reader(text)
+            headers = next(reader, None)
+            if not headers or not any(header.strip() for header in headers):
+                raise CSVImportError('The CSV file is empty or has no header row')
+            mapping = detect_mapping(headers)
+            if not mapping:
+                raise CSVImportError('None of the CSV columns could be matched to property fields',
+                                     {'headers': headers})
+            result.mapping = {field: headers[index].strip() for field, index in mapping.items()}
+            mapped = set(mapping.values())
+            result.unmapped_headers = [header for index, header in enumerate(headers) if index not in mapped]
+
+            rows = self._rows(reader, result)
+            while True:
+                chunk = list(islice(rows, self.chunk_rows))
+                if not chunk:
+                    break
+                result.chunks += 1
+                self._add_chunk(chunk, mapping, result)
+        finally:
+            # Leave the underlying stream open; the web framework owns it
+            text.detach()
+        result.parse_seconds = time.perf_counter() - started
+        return result
+
+    def _rows(self, reader, result: ImportResult) -> Iterator[Tuple[int, List[str]]]:
+        """(line number, cells) for each non-blank data row"""
+        while True:
+            try:
+                row = next(reader)
+            except StopIteration:
+                return
+            except csv.Error as e:
+                result.rows += 1
+                result.add_error(reader.line_num, f'Malformed CSV row: {str(e)}')
+                continue
+            if not any(cell.strip() for cell in row):
+                result.blank_rows += 1
+                continue
+            result.rows += 1
+            yield reader.line_num, row
+
+    def _add_chunk(self, chunk: List[Tuple[int, List[str]]], mapping: Dict[str, int], result: ImportResult):
+        def column(field: str) -> List[str]:
+            index = mapping.get(field)
+            if index is None:
+                return [''] * len(chunk)
+            return [row[index].strip() if index < len(row) else '' for _, row in chunk]
+
+        raw_rents = column('rent')
+        rents, unparseable = normalize_rents(raw_rents)
+        rejected = (unparseable | (rents < 0)).tolist()
+        rents = rents.tolist()
+        lines = [line for line, _ in chunk]
+        fields = ('propertyName', 'propertyAddress', 'unitNumber', 'bedrooms', 'bathrooms', 'squareFeet',
+                  'tenantName', 'tenantEmail', 'tenantPhone', 'leaseStart', 'leaseEnd')
+
+        for line, rent, bad_rent, raw_rent, name, address, number, bedrooms, bathrooms, square_feet, tenant_name, \
+                email, phone, lease_start, lease_end in zip(lines, rents, rejected, raw_rents,
+                                                            *(column(field) for field in fields)):
+            if bad_rent:
+                result.add_error(line, f"Unreadable rent amount: {raw_rent!r}")
+                continue
+
+            name = name or 'Unknown Property'
+            entry = result.properties.get(name)
+            if entry is None:
+                entry = result.properties[name] = {'name': name, 'address': address, 'units': OrderedDict()}
+            number = number or str(len(entry['units']) + 1)
+            if number in entry['units']:
+                result.add_error(line, f"Duplicate unit {number} at {name}")
+                continue
+
+            tenant = None
+            if tenant_name:
+                tenant = {
+                    'name': tenant_name,
+                    'email': email,
+                    'phone': phone,
+                    'leaseStart': lease_start,
+                    'leaseEnd': lease_end
+                }
+            entry['units'][number] = {
+                'number': number,
+                'bedrooms': _count(bedrooms, int, 1),
+                'bathrooms': _count(bathrooms, float, 1.0),
+                'squareFeet': square_feet,
+                'rent': rent,
+                'tenant': tenant,
+                'rentPaid': False
+            }
+            result.imported += 1
+
+
+# Global CSV ingestor instance
+csv_ingestor = CSVIngestor()
@@ -0,0 +1,106 @@
+from bisect import bisect_left, bisect_right
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def period_due_date(as_of: date, due_day: int) -> date:
+    """The most recent due date on or before as_of for rent due on due_day of each month"""
+    if as_of.day >= due_day:
+        return as_of.replace(day=due_day)
+    last_month_end = as_of.replace(day=1) - timedelta(days=1)
+    return last_month_end.replace(day=due_day)
+
+
+def _as_date(value) -> Optional[date]:
+    if isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(str(value)[:10]) if value else None
+    except ValueError:
+        return None
+
+
+class DueDateIndex:
+    """Calendar index of tenant due dates, grace periods and lease ends.
+
+    Built in one pass over the tenants. Unpaid tenants are bucketed by
+    (due day, grace period), so "who is overdue as of D" computes the due
+    date and grace boundary once per bucket rather than once per tenant.
+    Unpaid tenants are also bucketed by due day, so a reminder offset is a
+    single lookup of the day it lands on. Lease ends are kept sorted for
+    range queries. Due days run from 1 to 28, so every month has each one.
+    Results keep the order the tenants were given in.
+    """
+
+    def __init__(self, default_grace_days: int = 3):
+        self.default_grace_days = default_grace_days
+        self.size = 0
+        self._overdue_buckets = {}
+        self._due_day_buckets = {}
+        self._lease_end_dates = []
+        self._lease_end_tenants = []
+
+    @classmethod
+    def build(cls, tenants: Iterable[Dict], default_grace_days: int = 3) -> 'DueDateIndex':
+        index = cls(default_grace_days)
+        lease_ends = []
+        for seq, tenant in enumerate(tenants):
+            index.size += 1
+            lease_end = _as_date(tenant.get('lease_end'))
+            if lease_end is not None:
+                lease_ends.append((lease_end, seq, tenant))
+            if tenant.get('rent_paid'):
+                continue
+            due_day = min(28, max(1, int(tenant.get('rent_due_day') or 1)))
+            grace = tenant.get('grace_period_days')
+            grace = default_grace_days if grace is None else int(grace)
+            index._overdue_buckets.setdefault((due_day, grace), []).append((seq, tenant))
+            index._due_day_buckets.setdefault(due_day, []).append((seq, tenant))
+        lease_ends.sort(key=lambda entry: (entry[0], entry[1]))
+        index._lease_end_dates = [entry[0] for entry in lease_ends]
+        index._lease_end_tenants = [entry[2] for entry in lease_ends]
+        return index
+
+    def overdue_as_of(self, as_of: date) -> List[Dict]:
+        """Unpaid tenants whose current period's due date plus grace period is on or before as_of.
+
+        Each result is the tenant dict plus due_date and days_overdue (days
+        since the grace period ended).
+        """
+        matches = []
+        for (due_day, grace), bucket in self._overdue_buckets.items():
+            due = period_due_date(as_of, due_day)
+            grace_end = due + timedelta(days=grace)
+            if as_of < grace_end:
+                continue
+            days_overdue = (as_of - grace_end).days
+            matches.extend((seq, dict(tenant, due_date=due, days_overdue=days_overdue)) for seq, tenant in bucket)
+        matches.sort(key=lambda entry: entry[0])
+        return [tenant for _, tenant in matches]
+
+    def reminders_on(self, on: date, offsets: Iterable[int]) -> List[Dict]:
+        """Unpaid tenants whose next due date is exactly one of the offsets (in days) after `on`.
+
+        Each result is the tenant dict plus due_date and days_before.
+        """
+        matches = []
+        for days_before in sorted(set(offsets), reverse=True):
+            due = on + timedelta(days=days_before)
+            for seq, tenant in self._due_day_buckets.get(due.day, []):
+                matches.append((seq, -days_before, dict(tenant, due_date=due, days_before=days_before)))
+        matches.sort(key=lambda entry: (entry[0], entry[1]))
+        return [tenant for _, _, tenant in matches]
+
+    def leases_expiring(self, as_of: date, within_days: int) -> List[Dict]:
+        """Tenants whose lease ends between as_of and as_of + within_days, soonest first"""
+        start = bisect_left(self._lease_end_dates, as_of)
+        end = bisect_right(self._lease_end_dates, as_of + timedelta(days=within_days))
+        return [
+            dict(tenant, lease_end=lease_end, days_left=(lease_end - as_of).days)
+            for lease_end, tenant in zip(self._lease_end_dates[start:end], self._lease_end_tenants[start:end])
+        ]
@@ -1,16 +1,31 @@
-import smtplib
-import ssl
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import os
-from typing import List, Dict
+from typing import List, Dict, NamedTuple, Optional
 import logging
+from smtp_pool import SMTPConnectionPool
+from rate_limit import server_limiter
+from outbox import EmailOutbox
+from metrics import SMTP_SEND_SECONDS, SMTP_SEND_FAILURES
+from email_templates import (MimeSkeleton, REMINDER_HTML, OVERDUE_HEADER_HTML, OVERDUE_TENANT_HTML,
+                             OVERDUE_FOOTER_HTML, MAINTENANCE_HTML)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class OutgoingEmail(NamedTuple):
+    """One rendered email, ready to send"""
+    to_email: str
+    subject: str
+    body: str
+    is_html: bool = False
+    # Caller's identifier for this message, echoed back in bulk-send results
+    key: Optional[str] = None
+
+
 class EmailService:
     def __init__(self):
         self.smtp_server = os.getenv('SMTP_SERVER', 'smtp.gmail.com')
@@ -18,6 +33,30 @@ class EmailService:
         self.sender_email = os.getenv('SENDER_EMAIL')
         self.sender_password = os.getenv('SENDER_PASSWORD')
         self.landlord_email = os.getenv('LANDLORD_EMAIL')
+        self.mime = MimeSkeleton(self.sender_email)
+        # Logged-in SMTP sessions reused across sends instead of one handshake per email
+        self.pool = SMTPConnectionPool(
+            self.smtp_server,
+            self.smtp_port,
+            self.sender_email,
+            self.sender_password,
+            use_tls=os.getenv('SMTP_USE_TLS', 'true').lower() != 'false'
+        )
+        # Bulk sends: parallel workers, and a send-rate budget shared by everyone using this server
+        self.bulk_concurrency = int(os.getenv('BULK_SEND_CONCURRENCY', str(self.pool.max_size)))
+        self.rate_limiter = server_limiter(
+            self.smtp_server,
+            self.smtp_port,
+            float(os.getenv('SMTP_RATE_LIMIT', '10')),
+            float(os.getenv('SMTP_RATE_BURST', '10'))
+        )
+        # Worker threads that run SMTP exchanges for the async helpers
+        self._executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv('EMAIL_WORKERS', '8')),
+            thread_name_prefix='email'
+        )
+        # Durable queue for notifications: callers enqueue and return, a dispatcher thread sends
+        self.outbox = EmailOutbox(self._send_outbox_batch)
         
         if not all([self.sender_email, self.sender_password, self.landlord_email]):
             logger.warning("Email credentials not fully configured. Please set SENDER_EMAIL, SENDER_PASSWORD, and LANDLORD_EMAIL environment variables.")
@@ -25,23 +64,7 @@ class EmailService:
     def send_email(self, to_email: str, subject: str, body: str, is_html: bool = False) -> bool:
         """Send an email using SMTP"""
         try:
-            # Create message
-            message = MIMEMultipart("alternative")
-            message["Subject"] = subject
-            message["From"] = self.sender_email
-            message["To"] = to_email
-            
-            # Add body to email
-            part = MIMEText(body, "html" if is_html else "plain")
-            message.attach(part)
-            
-            # Create secure connection and send email
-            context = ssl.create_default_context()
-            with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-                server.starttls(context=context)
-                server.login(self.sender_email, self.sender_password)
-                server.sendmail(self.sender_email, to_email, message.as_string())
-            
+            self._deliver(OutgoingEmail(to_email, subject, body, is_html))
             logger.info(f"Email sent successfully to {to_email}")
             return True
             
@@ -49,162 +72,163 @@ class EmailService:
             logger.error(f"Error sending email to {to_email}: {str(e)}")
             return False
     
+    def _deliver(self, email: OutgoingEmail):
+        """Render the MIME message and send it; raises on failure"""
+        # Same wire format as MIMEMultipart/MIMEText, from an envelope built once
+        message = self.mime.render(email.to_email, email.subject, email.body, email.is_html)
+        
+        # Send over a pooled, already authenticated connection
+        started = time.perf_counter()
+        try:
+            self.pool.send(self.sender_email, email.to_email, message)
+        except Exception as e:
+            SMTP_SEND_FAILURES.labels(type(e).__name__).inc()
+            raise
+        finally:
+            SMTP_SEND_SECONDS.observe(time.perf_counter() - started)
+    
+    def send_bulk(self, emails: List[OutgoingEmail], concurrency: int = None) -> Dict:
+        """Send a batch of emails in parallel, rate limited per SMTP server.
+        
+        Returns per-recipient results (in input order) and throughput stats.
+        Emails without an address are reported as skipped, not sent.
+        """
+        concurrency = max(1, concurrency or self.bulk_concurrency)
+        started = time.monotonic()
+        
+        def send_one(email: OutgoingEmail) -> Dict:
+            result = {'key': email.key, 'to_email': email.to_email, 'status': 'sent', 'error': None}
+            if not email.to_email:
+                result['status'] = 'skipped'
+                result['error'] = 'No email address'
+                return result
+            self.rate_limiter.acquire()
+            send_started = time.monotonic()
+            try:
+                self._deliver(email)
+            except Exception as e:
+                logger.error(f"Error sending email to {email.to_email}: {str(e)}")
+                result['status'] = 'failed'
+                result['error'] = str(e)
+            result['seconds'] = round(time.monotonic() - send_started, 4)
+            return result
+        
+        if len(emails) <= 1 or concurrency == 1:
+            results = [send_one(email) for email in emails]
+        else:
+            with ThreadPoolExecutor(max_workers=min(concurrency, len(emails)), thread_name_prefix='bulk-email') as executor:
+                results = list(executor.map(send_one, emails))
+        
+        elapsed = time.monotonic() - started
+        sent = sum(1 for result in results if result['status'] == 'sent')
+        failed = sum(1 for result in results if result['status'] == 'failed')
+        report = {
+            'total': len(results),
+            'sent': sent,
+            'failed': failed,
+            'skipped': len(results) - sent - failed,
+            'concurrency': concurrency,
+            'elapsed_seconds': round(elapsed, 3),
+            'emails_per_second': round(sent / elapsed, 2) if elapsed > 0 else 0.0,
+            'results': results
+        }
+        logger.info(f"Bulk send: {sent} sent, {failed} failed, {report['skipped']} skipped in {report['elapsed_seconds']}s ({report['emails_per_second']}/s)")
+        return report
+    
+    def queue_email(self, email: OutgoingEmail) -> int:
+        """Store an email in the outbox for background delivery; returns the outbox id"""
+        return self.outbox.enqueue(email.to_email, email.subject, email.body, email.is_html, email.key)
+    
+    def queue_bulk(self, emails: List[OutgoingEmail]) -> List[int]:
+        """Store a batch of emails in the outbox in one transaction"""
+        return self.outbox.enqueue_many([tuple(email) for email in emails])
+    
+    def _send_outbox_batch(self, messages: List[Dict]) -> List[Dict]:
+        """Outbox dispatcher hook: deliver claimed messages through the bulk sender"""
+        emails = [
+            OutgoingEmail(message['to_email'], message['subject'], message['body'], message['is_html'], message['message_key'])
+            for message in messages
+        ]
+        return self.send_bulk(emails)['results']
+    
+    async def send_email_async(self, to_email: str, subject: str, body: str, is_html: bool = False) -> bool:
+        """Non-blocking send_email for asyncio callers.
+        
+        smtplib is synchronous, so the SMTP exchange runs on the email worker
+        threads while the event loop keeps serving other requests.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.send_email, to_email, subject, body, is_html)
+    
+    def estimate_delivery_seconds(self, count: int) -> Optional[float]:
+        """Seconds to deliver count more emails after what is already queued; None if no send rate is known"""
+        # The SMTP rate limit, or the outbox's recent drain rate when sending is unlimited
+        stats = self.outbox.stats()
+        rate = self.rate_limiter.rate if self.rate_limiter.rate > 0 else stats['drain_rate_per_minute'] / 60
+        if rate <= 0:
+            return None
+        return round((stats['depth'] + count) / rate, 1)
+    
     def send_rent_overdue_notification(self, overdue_tenants: List[Dict]) -> bool:
-        """Send notification to landlord about overdue rent"""
+        """Queue notification to landlord about overdue rent"""
         if not overdue_tenants:
             return True
-            
-        subject = f"🚨 Rent Payment Alert - {len(overdue_tenants)} Overdue Tenants"
         
-        # Create HTML email body
-        html_body = f"""
-        <html>
-        <head>
-            <style>
-                body {{ font-family: Arial, sans-serif; margin: 20px; }}
-                .header {{ background-color: #f44336; color: white; padding: 20px; border-radius: 5px; }}
-                .tenant-item {{ background-color: #fff3cd; border: 1px solid #ffeaa7; padding: 15px; margin: 10px 0; border-radius: 5px; }}
-                .property-name {{ font-weight: bold; font-size: 16px; color: #2c3e50; }}
-                .tenant-details {{ margin: 5px 0; }}
-                .amount {{ font-weight: bold; color: #e74c3c; }}
-                .summary {{ background-color: #e8f5e8; padding: 15px; border-radius: 5px; margin: 20px 0; }}
-            </style>
-        </head>
-        <body>
-            <div class="header">
-                <h2>Rent Payment Alert</h2>
-                <p>The following tenants have overdue rent payments as of {datetime.now().strftime('%B %d, %Y')}</p>
-            </div>
-            
-            <div class="summary">
-                <h3>Summary</h3>
-                <p><strong>Total Overdue Tenants:</strong> {len(overdue_tenants)}</p>
-                <p><strong>Total Amount Overdue:</strong> ${sum(tenant.get('rent', 0) for tenant in overdue_tenants):,.2f}</p>
-            </div>
-            
-            <h3>Overdue Tenants:</h3>
-        """
+        self.queue_email(self.build_rent_overdue_notification(overdue_tenants))
+        return True
+    
+    def build_rent_overdue_notification(self, overdue_tenants: List[Dict], landlord_email: str = None) -> OutgoingEmail:
+        """Landlord summary of overdue rent, sent to landlord_email or LANDLORD_EMAIL"""
+        subject = f"🚨 Rent Payment Alert - {len(overdue_tenants)} Overdue Tenants"
         
+        # Rendered into one list and joined once, so long reports stay linear
+        parts = []
+        OVERDUE_HEADER_HTML.render_into(parts, {
+            'report_date': datetime.now().strftime('%B %d, %Y'),
+            'tenant_count': len(overdue_tenants),
+            'total_overdue': sum(tenant.get('rent', 0) for tenant in overdue_tenants)
+        })
         for tenant in overdue_tenants:
-            html_body += f"""
-            <div class="tenant-item">
-                <div class="property-name">{tenant.get('property_name', 'Unknown Property')} - Unit {tenant.get('unit_number', 'N/A')}</div>
-                <div class="tenant-details"><strong>Tenant:</strong> {tenant.get('tenant_name', 'Unknown')}</div>
-                <div class="tenant-details"><strong>Email:</strong> {tenant.get('tenant_email', 'Not provided')}</div>
-                <div class="tenant-details"><strong>Phone:</strong> {tenant.get('tenant_phone', 'Not provided')}</div>
-                <div class="tenant-details amount"><strong>Overdue Amount:</strong> ${tenant.get('rent', 0):,.2f}</div>
-                <div class="tenant-details"><strong>Days Overdue:</strong> {tenant.get('days_overdue', 'Unknown')}</div>
-            </div>
-            """
-        
-        html_body += """
-            <p style="margin-top: 30px;">
-                <strong>Next Steps:</strong><br>
-                • Contact tenants directly<br>
-                • Send formal notices if required<br>
-                • Review lease agreements for late fee policies<br>
-            </p>
-            
-            <p style="color: #666; font-size: 12px; margin-top: 30px;">
-                This is an automated message from your EstateFlow property management system.
-            </p>
-        </body>
-        </html>
-        """
+            OVERDUE_TENANT_HTML.render_into(parts, tenant)
+        OVERDUE_FOOTER_HTML.render_into(parts, {})
+        html_body = ''.join(parts)
         
-        return self.send_email(self.landlord_email, subject, html_body, is_html=True)
+        return OutgoingEmail(landlord_email or self.landlord_email, subject, html_body, is_html=True, key='overdue-summary')
     
     def send_rent_reminder_to_tenant(self, tenant_info: Dict) -> bool:
-        """Send rent reminder directly to tenant"""
+        """Queue rent reminder directly to tenant"""
         if not tenant_info.get('tenant_email'):
             logger.warning(f"No email address for tenant {tenant_info.get('tenant_name', 'Unknown')}")
             return False
-            
+        
+        self.queue_email(self.build_rent_reminder(tenant_info))
+        return True
+    
+    def build_rent_reminder(self, tenant_info: Dict) -> OutgoingEmail:
+        """Rent reminder addressed to the tenant"""
         subject = f"Rent Payment Reminder - {tenant_info.get('property_name', 'Your Unit')}"
         
-        html_body = f"""
-        <html>
-        <head>
-            <style>
-                body {{ font-family: Arial, sans-serif; margin: 20px; line-height: 1.6; }}
-                .header {{ background-color: #3498db; color: white; padding: 20px; border-radius: 5px; }}
-                .content {{ padding: 20px; }}
-                .important {{ background-color: #fff3cd; border: 1px solid #ffeaa7; padding: 15px; border-radius: 5px; margin: 15px 0; }}
-                .footer {{ color: #666; font-size: 12px; margin-top: 30px; }}
-            </style>
-        </head>
-        <body>
-            <div class="header">
-                <h2>Rent Payment Reminder</h2>
-            </div>
-            
-            <div class="content">
-                <p>Dear {tenant_info.get('tenant_name', 'Tenant')},</p>
-                
-                <p>This is a friendly reminder that your rent payment is due.</p>
-                
-                <div class="important">
-                    <strong>Property Details:</strong><br>
-                    Property: {tenant_info.get('property_name', 'N/A')}<br>
-                    Unit: {tenant_info.get('unit_number', 'N/A')}<br>
-                    Monthly Rent: ${tenant_info.get('rent', 0):,.2f}<br>
-                    Due Date: {tenant_info.get('due_date', 'Check your lease')}
-                </div>
-                
-                <p>Please ensure your payment is submitted as soon as possible to avoid any late fees.</p>
-                
-                <p>If you have already made your payment, please disregard this message. If you have any questions or concerns, please contact us immediately.</p>
-                
-                <p>Thank you for your prompt attention to this matter.</p>
-                
-                <p>Best regards,<br>
-                Property Management Team</p>
-            </div>
-            
-            <div class="footer">
-                This is an automated reminder from your property management system.
-            </div>
-        </body>
-        </html>
-        """
+        html_body = REMINDER_HTML.render(tenant_info)
         
-        return self.send_email(tenant_info['tenant_email'], subject, html_body, is_html=True)
+        key = f"reminder:{tenant_info.get('property_name')}:{tenant_info.get('unit_number')}"
+        return OutgoingEmail(tenant_info.get('tenant_email', ''), subject, html_body, is_html=True, key=key)
     
     def send_maintenance_request_notification(self, maintenance_request: Dict) -> bool:
-        """Send maintenance request notification to landlord"""
+        """Queue maintenance request notification to landlord"""
         subject = f"🔧 New Maintenance Request - {maintenance_request.get('property_name', 'Unknown Property')}"
         
-        html_body = f"""
-        <html>
-        <head>
-            <style>
-                body {{ font-family: Arial, sans-serif; margin: 20px; }}
-                .header {{ background-color: #f39c12; color: white; padding: 20px; border-radius: 5px; }}
-                .request-details {{ background-color: #f8f9fa; padding: 15px; border-radius: 5px; margin: 15px 0; }}
-            </style>
-        </head>
-        <body>
-            <div class="header">
-                <h2>New Maintenance Request</h2>
-                <p>Submitted on {datetime.now().strftime('%B %d, %Y at %I:%M %p')}</p>
-            </div>
-            
-            <div class="request-details">
-                <h3>Request Details</h3>
-                <p><strong>Property:</strong> {maintenance_request.get('property_name', 'N/A')}</p>
-                <p><strong>Unit:</strong> {maintenance_request.get('unit_number', 'N/A')}</p>
-                <p><strong>Tenant:</strong> {maintenance_request.get('tenant_name', 'N/A')}</p>
-                <p><strong>Contact:</strong> {maintenance_request.get('tenant_phone', 'N/A')}</p>
-                <p><strong>Issue:</strong> {maintenance_request.get('issue_description', 'No description provided')}</p>
-                <p><strong>Priority:</strong> {maintenance_request.get('priority', 'Normal')}</p>
-            </div>
-            
-            <p>Please address this maintenance request promptly.</p>
-        </body>
-        </html>
-        """
+        html_body = MAINTENANCE_HTML.render({
+            'submitted_at': datetime.now().strftime('%B %d, %Y at %I:%M %p'),
+            'property_name': maintenance_request.get('property_name', 'N/A'),
+            'unit_number': maintenance_request.get('unit_number', 'N/A'),
+            'tenant_name': maintenance_request.get('tenant_name', 'N/A'),
+            'tenant_phone': maintenance_request.get('tenant_phone', 'N/A'),
+            'issue_description': maintenance_request.get('issue_description', 'No description provided'),
+            'priority': maintenance_request.get('priority', 'Normal')
+        })
         
-        return self.send_email(self.landlord_email, subject, html_body, is_html=True)
+        self.queue_email(OutgoingEmail(self.landlord_email, subject, html_body, is_html=True, key='maintenance-request'))
+        return True
 
 # Email service instance
 email_service = EmailService() 
\ No newline at end of file
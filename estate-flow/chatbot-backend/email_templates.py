@@ -0,0 +1,244 @@
+import base64
+import secrets
+from email.errors import HeaderParseError
+from email.policy import compat32
+from string import Formatter
+from typing import Dict, List, Optional
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Header lines longer than this are folded, as RFC 5322 recommends
+MAX_HEADER_LENGTH = 78
+
+
+class CompiledTemplate:
+    """A str.format-style template compiled once into a render function.
+
+    The template is parsed a single time and turned into one f-string
+    expression, so the static markup and CSS become constants of the compiled
+    code and a render only formats the fields. Fields listed in defaults are
+    looked up with values.get(field, default), so records such as tenant
+    dicts can be rendered as they are. render_into appends to a caller's
+    list, for documents assembled from repeated sections.
+    """
+
+    def __init__(self, source: str, defaults: Optional[Dict] = None):
+        self.source = source
+        self.defaults = dict(defaults or {})
+        pieces = []
+        for literal, field, spec, conversion in Formatter().parse(source):
+            if literal:
+                pieces.append('f' + repr(literal.replace('{', '{{').replace('}', '}}')))
+            if field is not None:
+                if not field.isidentifier() or conversion or '{' in spec:
+                    raise ValueError(f"Email template fields must be plain names with a static format spec: {field!r}")
+                lookup = f"values.get({field!r}, defaults[{field!r}])" if field in self.defaults else f"values[{field!r}]"
+                pieces.append(f'f"{{{lookup}:{spec}}}"')
+        code = compile(f"lambda values, defaults=defaults: {' '.join(pieces) or repr('')}", '<email template>', 'eval')
+        self.render = eval(code, {'defaults': self.defaults})
+
+    def render_into(self, out: List[str], values: Dict):
+        out.append(self.render(values))
+
+
+class MimeSkeleton:
+    """Prebuilt multipart/alternative envelope for one sender.
+
+    Produces the wire format of building MIMEMultipart + MIMEText and calling
+    as_string(), but the part headers and boundary are assembled once,
+    leaving only Subject/To and the body encoding per message. Headers are
+    folded at 78 characters, and a line break in a header value raises
+    HeaderParseError rather than starting a header of its own. The envelope
+    never changes after construction, so one skeleton can render from many
+    threads.
+    """
+
+    def __init__(self, sender: Optional[str]):
+        self.sender = sender or ''
+        self.boundary = f"==============={secrets.randbelow(10 ** 19):019d}=="
+        self._head = f'Content-Type: multipart/alternative; boundary="{self.boundary}"\nMIME-Version: 1.0\n'
+        self._from = _header('From', self.sender)
+        self._parts = {
+            (subtype, charset): f'\n--{self.boundary}\nContent-Type: text/{subtype}; charset="{charset}"\n'
+                                f'MIME-Version: 1.0\n'
+                                f'Content-Transfer-Encoding: {"7bit" if charset == "us-ascii" else "base64"}\n\n'
+            for subtype in ('plain', 'html') for charset in ('us-ascii', 'utf-8')
+        }
+        self._tail = f"\n--{self.boundary}--\n"
+
+    def render(self, to_email: str, subject: str, body: str, is_html: bool = False) -> str:
+        if self.boundary in body:
+            # Practically impossible, but a body must never contain its boundary;
+            # a one-off envelope keeps this one unchanged for other threads
+            return MimeSkeleton(self.sender).render(to_email, subject, body, is_html)
+        subtype = 'html' if is_html else 'plain'
+        if body.isascii():
+            part = self._parts[(subtype, 'us-ascii')] + body
+        else:
+            part = self._parts[(subtype, 'utf-8')] + base64.encodebytes(body.encode('utf-8')).decode('ascii')
+        return ''.join((
+            self._head,
+            _header('Subject', subject),
+            self._from,
+            _header('To', to_email),
+            part,
+            self._tail
+        ))
+
+
+def _header(name: str, value: str) -> str:
+    """One header line, folded at 78 characters; non-ASCII values become RFC 2047 encoded words"""
+    if '\r' in value or '\n' in value:
+        # Otherwise data such as a property name could add headers ("Sunset\nBcc: ...")
+        raise HeaderParseError(f"{name} header value contains a line break: {value!r}")
+    if value.isascii() and len(name) + len(value) + 2 <= MAX_HEADER_LENGTH:
+        return f"{name}: {value}\n"
+    return compat32.fold(name, value)
+
+
+REMINDER_HTML = CompiledTemplate("""
+        <html>
+        <head>
+            <style>
+                body {{ font-family: Arial, sans-serif; margin: 20px; line-height: 1.6; }}
+                .header {{ background-color: #3498db; color: white; padding: 20px; border-radius: 5px; }}
+                .content {{ padding: 20px; }}
+                .important {{ background-color: #fff3cd; border: 1px solid #ffeaa7; padding: 15px; border-radius: 5px; margin: 15px 0; }}
+                .footer {{ color: #666; font-size: 12px; margin-top: 30px; }}
+            </style>
+        </head>
+        <body>
+            <div class="header">
+                <h2>Rent Payment Reminder</h2>
+            </div>
+            
+            <div class="content">
+                <p>Dear {tenant_name},</p>
+                
+                <p>This is a friendly reminder that your rent payment is due.</p>
+                
+                <div class="important">
+                    <strong>Property Details:</strong><br>
+                    Property: {property_name}<br>
+                    Unit: {unit_number}<br>
+                    Monthly Rent: ${rent:,.2f}<br>
+                    Due Date: {due_date}
+                </div>
+                
+                <p>Please ensure your payment is submitted as soon as possible to avoid any late fees.</p>
+                
+                <p>If you have already made your payment, please disregard this message. If you have any questions or concerns, please contact us immediately.</p>
+                
+                <p>Thank you for your prompt attention to this matter.</p>
+                
+                <p>Best regards,<br>
+                Property Management Team</p>
+            </div>
+            
+            <div class="footer">
+                This is an automated reminder from your property management system.
+            </div>
+        </body>
+        </html>
+        """, defaults={
+    'tenant_name': 'Tenant',
+    'property_name': 'N/A',
+    'unit_number': 'N/A',
+    'rent': 0,
+    'due_date': 'Check your lease'
+})
+
+OVERDUE_HEADER_HTML = CompiledTemplate("""
+        <html>
+        <head>
+            <style>
+                body {{ font-family: Arial, sans-serif; margin: 20px; }}
+                .header {{ background-color: #f44336; color: white; padding: 20px; border-radius: 5px; }}
+                .tenant-item {{ background-color: #fff3cd; border: 1px solid #ffeaa7; padding: 15px; margin: 10px 0; border-radius: 5px; }}
+                .property-name {{ font-weight: bold; font-size: 16px; color: #2c3e50; }}
+                .tenant-details {{ margin: 5px 0; }}
+                .amount {{ font-weight: bold; color: #e74c3c; }}
+                .summary {{ background-color: #e8f5e8; padding: 15px; border-radius: 5px; margin: 20px 0; }}
+            </style>
+        </head>
+        <body>
+            <div class="header">
+                <h2>Rent Payment Alert</h2>
+                <p>The following tenants have overdue rent payments as of {report_date}</p>
+            </div>
+            
+            <div class="summary">
+                <h3>Summary</h3>
+                <p><strong>Total Overdue Tenants:</strong> {tenant_count}</p>
+                <p><strong>Total Amount Overdue:</strong> ${total_overdue:,.2f}</p>
+            </div>
+            
+            <h3>Overdue Tenants:</h3>
+        """)
+
+OVERDUE_TENANT_HTML = CompiledTemplate("""
+            <div class="tenant-item">
+                <div class="property-name">{property_name} - Unit {unit_number}</div>
+                <div class="tenant-details"><strong>Tenant:</strong> {tenant_name}</div>
+                <div class="tenant-details"><strong>Email:</strong> {tenant_email}</div>
+                <div class="tenant-details"><strong>Phone:</strong> {tenant_phone}</div>
+                <div class="tenant-details amount"><strong>Overdue Amount:</strong> ${rent:,.2f}</div>
+                <div class="tenant-details"><strong>Days Overdue:</strong> {days_overdue}</div>
+            </div>
+            """, defaults={
+    'property_name': 'Unknown Property',
+    'unit_number': 'N/A',
+    'tenant_name': 'Unknown',
+    'tenant_email': 'Not provided',
+    'tenant_phone': 'Not provided',
+    'rent': 0,
+    'days_overdue': 'Unknown'
+})
+
+OVERDUE_FOOTER_HTML = CompiledTemplate("""
+            <p style="margin-top: 30px;">
+                <strong>Next Steps:</strong><br>
+                • Contact tenants directly<br>
+                • Send formal notices if required<br>
+                • Review lease agreements for late fee policies<br>
+            </p>
+            
+            <p style="color: #666; font-size: 12px; margin-top: 30px;">
+                This is an automated message from your EstateFlow property management system.
+            </p>
+        </body>
+        </html>
+        """)
+
+MAINTENANCE_HTML = CompiledTemplate("""
+        <html>
+        <head>
+            <style>
+                body {{ font-family: Arial, sans-serif; margin: 20px; }}
+                .header {{ background-color: #f39c12; color: white; padding: 20px; border-radius: 5px; }}
+                .request-details {{ background-color: #f8f9fa; padding: 15px; border-radius: 5px; margin: 15px 0; }}
+            </style>
+        </head>
+        <body>
+            <div class="header">
+                <h2>New Maintenance Request</h2>
+                <p>Submitted on {submitted_at}</p>
+            </div>
+            
+            <div class="request-details">
+                <h3>Request Details</h3>
+                <p><strong>Property:</strong> {property_name}</p>
+                <p><strong>Unit:</strong> {unit_number}</p>
+                <p><strong>Tenant:</strong> {tenant_name}</p>
+                <p><strong>Contact:</strong> {tenant_phone}</p>
+                <p><strong>Issue:</strong> {issue_description}</p>
+                <p><strong>Priority:</strong> {priority}</p>
+            </div>
+            
+            <p>Please address this maintenance request promptly.</p>
+        </body>
+        </html>
+        """)
@@ -0,0 +1,307 @@
+"""In-process metrics, served by GET /metrics in the Prometheus text format.
+
+Counters and histograms are plain Python objects: recording a value is a
+dict lookup for the label set, a bisect over the bucket bounds and an add
+under a per-series lock, about a microsecond, so collection stays on in
+production. Nothing is rendered until a scrape asks for it. Figures that
+other components already keep (cache hit/miss counters, SMTP pool stats)
+are read at scrape time by collectors instead of being counted twice.
+
+Each process keeps its own registry, so with several uvicorn workers each
+worker reports its own series. Set METRICS_ENABLED=false to stop recording.
+"""
+import math
+import os
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds in seconds, from sub-millisecond stages up to slow OpenAI calls and scheduler runs
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+# Prompt sizes in tokens; PROMPT_TOKEN_BUDGET defaults to 6000
+TOKEN_BUCKETS = (250, 500, 1000, 1500, 2000, 3000, 4000, 5000, 6000, 8000, 12000, 16000)
+
+# (name, type, help, [(labels, value), ...]) as produced by a collector
+Family = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+def _format_value(value) -> str:
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels.items()
+    )
+    return '{' + pairs + '}'
+
+
+class _Timer:
+    """Observes elapsed seconds into a histogram series, as a context manager or decorator"""
+
+    __slots__ = ('series', 'started')
+
+    def __init__(self, series):
+        self.series = series
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.series.observe(time.perf_counter() - self.started)
+        return False
+
+    def __call__(self, function: Callable) -> Callable:
+        series = self.series
+
+        @wraps(function)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                series.observe(time.perf_counter() - started)
+        return timed
+
+
+class _CounterSeries:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+
+class _HistogramSeries:
+    __slots__ = ('bounds', 'counts', 'sum', '_lock')
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = bounds
+        # One slot per bound plus the +Inf overflow; made cumulative when rendered
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self) -> _Timer:
+        return _Timer(self)
+
+    def snapshot(self) -> Tuple[List[int], float]:
+        with self._lock:
+            return list(self.counts), self.sum
+
+
+class _NullSeries:
+    """Stands in for every series while metrics are disabled"""
+
+    def inc(self, amount: float = 1):
+        pass
+
+    def observe(self, value: float):
+        pass
+
+    def time(self) -> _Timer:
+        return _Timer(self)
+
+
+_NULL_SERIES = _NullSeries()
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, registry: 'MetricsRegistry', name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values, **named):
+        """The series for one combination of label values, created on first use"""
+        if not self.registry.enabled:
+            return _NULL_SERIES
+        if named:
+            values = tuple(named[name] for name in self.labelnames)
+        series = self._series.get(values)
+        if series is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}, got {values}")
+            with self._lock:
+                series = self._series.get(values)
+                if series is None:
+                    series = self._series[values] = self._new_series()
+        return series
+
+    def _new_series(self):
+        raise NotImplementedError
+
+    def _items(self):
+        with self._lock:
+            return sorted(self._series.items())
+
+    def render(self, lines: List[str]):
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonic count, e.g. requests or failures"""
+
+    kind = 'counter'
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def _new_series(self):
+        return _CounterSeries()
+
+    def render(self, lines: List[str]):
+        for values, series in self._items():
+            labels = _format_labels(dict(zip(self.labelnames, values)))
+            lines.append(f"{self.name}{labels} {_format_value(series.value)}")
+
+
+class Histogram(_Metric):
+    """Distribution of observed values over fixed buckets"""
+
+    kind = 'histogram'
+
+    def __init__(self, registry: 'MetricsRegistry', name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(registry, name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def time(self) -> _Timer:
+        return self.labels().time()
+
+    def _new_series(self):
+        return _HistogramSeries(self.buckets)
+
+    def render(self, lines: List[str]):
+        for values, series in self._items():
+            labels = dict(zip(self.labelnames, values))
+            counts, total = series.snapshot()
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                bucket_labels = _format_labels(dict(labels, le=_format_value(float(bound))))
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+
+
+class MetricsRegistry:
+    """The process's metric families plus scrape-time collectors"""
+
+    def __init__(self, enabled: bool = None):
+        self.enabled = enabled if enabled is not None else os.getenv('METRICS_ENABLED', 'true').lower() != 'false'
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(self, name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(self, name, help_text, labelnames, buckets))
+
+    def collector(self, collect: Callable[[], Iterable[Family]]):
+        """Register a function called on every scrape for figures kept elsewhere"""
+        self._collectors.append(collect)
+        return collect
+
+    def render(self) -> str:
+        """All families in the Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            metric.render(lines)
+        for collect in self._collectors:
+            try:
+                families = list(collect())
+            except Exception as e:
+                logger.error(f"Metrics collector {getattr(collect, '__name__', collect)} failed: {str(e)}")
+                continue
+            for name, kind, help_text, samples in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+    def _register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+
+# Global metrics registry
+metrics = MetricsRegistry()
+
+# HTTP requests, by Flask route pattern (or native ASGI path) so label values stay bounded
+HTTP_REQUESTS = metrics.counter(
+    'estateflow_http_requests_total', 'HTTP requests handled', ('method', 'route', 'status'))
+HTTP_REQUEST_SECONDS = metrics.histogram(
+    'estateflow_http_request_duration_seconds', 'Time to handle an HTTP request', ('method', 'route'))
+
+# Where a /chat answer's time goes
+CHAT_STAGE_SECONDS = metrics.histogram(
+    'estateflow_chat_stage_duration_seconds',
+    'Time spent per /chat stage: parse, aggregate, local_query, response_cache, prompt_build, llm_queue, '
+    'llm_wait, llm_first_token (streams), fallback', ('stage',))
+PROMPT_TOKENS = metrics.histogram(
+    'estateflow_chat_prompt_tokens', 'System prompt size sent to OpenAI, in tokens', buckets=TOKEN_BUCKETS)
+
+UPSTREAM_REJECTIONS = metrics.counter(
+    'estateflow_upstream_rejections_total',
+    'Upstream calls answered from the fallback without calling: circuit_open, queue_full or queue_timeout',
+    ('upstream', 'reason'))
+
+SMTP_SEND_SECONDS = metrics.histogram(
+    'estateflow_smtp_send_duration_seconds', 'Time to hand one message to the SMTP server, including retries')
+SMTP_SEND_FAILURES = metrics.counter(
+    'estateflow_smtp_send_failures_total', 'Messages the SMTP server did not accept', ('error',))
+
+SCHEDULER_RUN_SECONDS = metrics.histogram(
+    'estateflow_scheduler_run_duration_seconds', 'Duration of a daily rent check run', ('runner',))
+SCHEDULER_RUNS = metrics.counter(
+    'estateflow_scheduler_runs_total', 'Daily rent check runs', ('runner', 'status'))
+SCHEDULER_TENANTS = metrics.counter(
+    'estateflow_scheduler_tenants_processed_total',
+    'Tenants handled by the daily rent checks: notified, or skipped as already notified this period',
+    ('check', 'outcome'))
+
+
+def ratio(numerator: float, denominator: float) -> float:
+    return numerator / denominator if denominator else 0.0
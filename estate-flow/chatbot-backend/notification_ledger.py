@@ -0,0 +1,261 @@
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, timedelta
+from typing import Dict, List, Tuple
+import logging
+import numpy as np
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sent_notifications (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    scope TEXT NOT NULL,
+    tenant TEXT NOT NULL,
+    unit TEXT NOT NULL,
+    period TEXT NOT NULL,
+    notification_type TEXT NOT NULL,
+    message_id INTEGER,
+    recorded_at REAL NOT NULL,
+    UNIQUE (scope, tenant, unit, period, notification_type)
+);
+
+CREATE INDEX IF NOT EXISTS idx_sent_notifications_period ON sent_notifications(period);
+"""
+
+# (scope, tenant, unit, period, notification type)
+LedgerKey = Tuple[str, str, str, str, str]
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings, checked and filled a batch at a time with numpy"""
+
+    def __init__(self, capacity: int, false_positive_rate: float = 0.001):
+        self.capacity = max(1, capacity)
+        self.false_positive_rate = false_positive_rate
+        self.size = max(64, int(-self.capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+        self.count = 0
+
+    def _positions(self, keys: List[str]) -> np.ndarray:
+        # Double hashing: position i is h1 + i * h2, from one 128-bit digest per key
+        digests = b''.join(hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest() for key in keys)
+        halves = np.frombuffer(digests, dtype=np.uint64).reshape(len(keys), 2)
+        steps = np.arange(self.hashes, dtype=np.uint64)
+        return (halves[:, :1] + steps * (halves[:, 1:] | np.uint64(1))) % np.uint64(self.size)
+
+    def add_many(self, keys: List[str]):
+        if not keys:
+            return
+        positions = self._positions(keys).ravel()
+        np.bitwise_or.at(self.bits, positions >> np.uint64(3), (1 << (positions & np.uint64(7))).astype(np.uint8))
+        self.count += len(keys)
+
+    def contains_many(self, keys: List[str]) -> np.ndarray:
+        """Boolean per key: False means definitely never added"""
+        if not keys:
+            return np.zeros(0, dtype=bool)
+        positions = self._positions(keys)
+        hits = self.bits[positions >> np.uint64(3)] & (1 << (positions & np.uint64(7))).astype(np.uint8)
+        return hits.all(axis=1)
+
+    def fill_ratio(self) -> float:
+        return float(np.unpackbits(self.bits).sum()) / self.size
+
+
+def _flat(key: LedgerKey) -> str:
+    return '\x1f'.join(key)
+
+
+class NotificationLedger:
+    """Record of which notifications went out, keyed by (scope, tenant, unit, period, type).
+
+    Rows live in SQLite; a Bloom filter in front answers "never sent" without
+    touching the database, which is the answer for nearly every key on a
+    normal run. Only keys the filter reports as present are looked up. Rows
+    written by other processes (shard workers, other web workers) are folded
+    into the filter by rowid before each check. claim() is the authoritative,
+    atomic step: a key can be claimed once, so two overlapping runs can't
+    both queue the same notice.
+
+    The ledger and the outbox are separate databases, so a claim is only
+    final once attach() has noted its outbox message. A claim still without
+    one after claim_timeout seconds belongs to a run that died in between;
+    it no longer counts as sent and the next claim takes it over. A run that
+    queued its message but died before attach() may send that notice twice,
+    which beats never sending it.
+    """
+
+    def __init__(self, path: str = None, capacity: int = None, false_positive_rate: float = None,
+                 retention_days: int = None, claim_timeout: float = None):
+        self.path = path or os.getenv('LEDGER_DB_PATH', 'notifications.db')
+        self.capacity = capacity or int(os.getenv('LEDGER_BLOOM_CAPACITY', '1000000'))
+        self.false_positive_rate = false_positive_rate or float(os.getenv('LEDGER_BLOOM_FP_RATE', '0.001'))
+        self.retention_days = retention_days if retention_days is not None else int(os.getenv('LEDGER_RETENTION_DAYS', '120'))
+        self.claim_timeout = claim_timeout if claim_timeout is not None else float(os.getenv('LEDGER_CLAIM_TIMEOUT', '300'))
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+        self.bloom = None
+        self._loaded_upto = 0
+        # Lookup counters since this process started
+        self.checks = 0
+        self.bloom_negatives = 0
+        self.database_lookups = 0
+        self.false_positives = 0
+        with self._lock:
+            self._rebuild_locked()
+
+    def already_sent(self, keys: List[LedgerKey]) -> List[bool]:
+        """For each key, whether a notification was already recorded for it"""
+        with self._lock:
+            self._refresh_locked()
+            maybe = self.bloom.contains_many([_flat(key) for key in keys])
+            candidates = [key for key, present in zip(keys, maybe) if present]
+            found = self._lookup_locked(candidates)
+            self.checks += len(keys)
+            self.bloom_negatives += len(keys) - len(candidates)
+            self.database_lookups += len(candidates)
+            self.false_positives += len(candidates) - len(found)
+        return [bool(present) and key in found for key, present in zip(keys, maybe)]
+
+    def claim(self, keys: List[LedgerKey]) -> List[bool]:
+        """Record keys as sent in one transaction; True for each key this call recorded, False if it already was.
+
+        An abandoned claim (no outbox message after claim_timeout) is taken over.
+        """
+        now = time.time()
+        claimed = []
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for key in keys:
+                    cursor = self._conn.execute(
+                        "INSERT OR IGNORE INTO sent_notifications (scope, tenant, unit, period, notification_type, recorded_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?)", (*key, now)
+                    )
+                    if cursor.rowcount != 1:
+                        cursor = self._conn.execute(
+                            "UPDATE sent_notifications SET recorded_at = ? WHERE scope = ? AND tenant = ? AND unit = ? "
+                            "AND period = ? AND notification_type = ? AND message_id IS NULL AND recorded_at < ?",
+                            (now, *key, now - self.claim_timeout)
+                        )
+                    claimed.append(cursor.rowcount == 1)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._refresh_locked()
+        return claimed
+
+    def attach(self, keys: List[LedgerKey], message_ids: List[int]):
+        """Note the outbox message each claimed key was queued as"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "UPDATE sent_notifications SET message_id = ? WHERE scope = ? AND tenant = ? AND unit = ? "
+                    "AND period = ? AND notification_type = ?",
+                    [(message_id, *key) for key, message_id in zip(keys, message_ids)]
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def release(self, keys: List[LedgerKey]):
+        """Forget claimed keys whose notices couldn't be queued, so the next run sends them.
+
+        The filter can't forget keys, so checks on these fall through to SQLite.
+        """
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM sent_notifications WHERE scope = ? AND tenant = ? AND unit = ? AND period = ? AND notification_type = ?",
+                keys
+            )
+
+    def prune(self, today: date = None) -> int:
+        """Delete entries for periods older than retention_days and rebuild the filter"""
+        cutoff = ((today or date.today()) - timedelta(days=self.retention_days)).isoformat()
+        with self._lock:
+            deleted = self._conn.execute("DELETE FROM sent_notifications WHERE period < ?", (cutoff,)).rowcount
+            if deleted:
+                self._rebuild_locked()
+        if deleted:
+            logger.info(f"Pruned {deleted} notification ledger entries before {cutoff}")
+        return deleted
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM sent_notifications").fetchone()[0]
+            return {
+                'entries': entries,
+                'bloom_capacity': self.bloom.capacity,
+                'bloom_bits': self.bloom.size,
+                'bloom_hashes': self.bloom.hashes,
+                'bloom_fill_ratio': round(self.bloom.fill_ratio(), 4),
+                'checks': self.checks,
+                'bloom_negatives': self.bloom_negatives,
+                'database_lookups': self.database_lookups,
+                'false_positives': self.false_positives,
+                'retention_days': self.retention_days
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _rebuild_locked(self):
+        entries = self._conn.execute("SELECT COUNT(*) FROM sent_notifications").fetchone()[0]
+        # Sized with headroom so the false-positive rate holds as the ledger grows
+        capacity = max(self.capacity, entries * 2)
+        self.bloom = BloomFilter(capacity, self.false_positive_rate)
+        self._loaded_upto = 0
+        self._refresh_locked()
+
+    def _refresh_locked(self):
+        """Fold rows recorded since the last refresh, by any process, into the filter"""
+        rows = self._conn.execute(
+            "SELECT id, scope, tenant, unit, period, notification_type FROM sent_notifications WHERE id > ? ORDER BY id",
+            (self._loaded_upto,)
+        ).fetchall()
+        if not rows:
+            return
+        self.bloom.add_many([_flat(tuple(row)[1:]) for row in rows])
+        self._loaded_upto = rows[-1]['id']
+        if self.bloom.count > self.bloom.capacity:
+            self._rebuild_locked()
+
+    def _lookup_locked(self, keys: List[LedgerKey]) -> set:
+        # Point lookups on the unique index; SQLite won't use it for a row-value IN list.
+        # Abandoned claims (see claim) don't count as sent
+        found = set()
+        abandoned_before = time.time() - self.claim_timeout
+        for key in keys:
+            if self._conn.execute(
+                "SELECT 1 FROM sent_notifications WHERE scope = ? AND tenant = ? AND unit = ? AND period = ? "
+                "AND notification_type = ? AND (message_id IS NOT NULL OR recorded_at >= ?)", (*key, abandoned_before)
+            ).fetchone() is not None:
+                found.add(key)
+        return found
+
+def ledger_key(scope: str, tenant: Dict, period, notification_type: str) -> LedgerKey:
+    """Ledger key for a notice about one tenant; the tenant is identified by email, or name if there is none"""
+    tenant_id = (tenant.get('tenant_email') or tenant.get('tenant_name') or '').strip().lower()
+    unit = f"{tenant.get('property_name', '')}/{tenant.get('unit_number', '')}"
+    period = period.isoformat() if isinstance(period, date) else str(period)
+    return scope, tenant_id, unit, period, notification_type
+
+
+# Global notification ledger instance
+notification_ledger = NotificationLedger()
@@ -0,0 +1,169 @@
+import asyncio
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r"\S+\s*")
+
+
+class _Namespace:
+    """Attribute bag shaped like the objects the OpenAI SDK returns"""
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class StubStream:
+    """Iterator of completion chunks, like openai.Stream.
+
+    Tracks whether it was closed before the last chunk was produced so
+    callers can check that an abandoned stream was cancelled upstream.
+    """
+
+    def __init__(self, pieces: List[str], delay: float):
+        self._pieces = iter(pieces)
+        self._delay = delay
+        self.closed = False
+        self.cancelled = False
+        self.chunks_sent = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._delay and not self.closed:
+            time.sleep(self._delay)
+        chunk = self._next_chunk()
+        if chunk is None:
+            raise StopIteration
+        return chunk
+
+    def close(self):
+        if not self.closed:
+            self.cancelled = True
+            self.closed = True
+
+    def _next_chunk(self):
+        if self.closed:
+            return None
+        piece = next(self._pieces, None)
+        if piece is None:
+            self.closed = True
+            return None
+        self.chunks_sent += 1
+        return _Namespace(choices=[_Namespace(delta=_Namespace(content=piece), finish_reason=None)])
+
+
+class AsyncStubStream(StubStream):
+    """Async iterator of completion chunks, like openai.AsyncStream"""
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._delay and not self.closed:
+            await asyncio.sleep(self._delay)
+        chunk = self._next_chunk()
+        if chunk is None:
+            raise StopAsyncIteration
+        return chunk
+
+    async def close(self):
+        StubStream.close(self)
+
+
+class StubCompletions:
+    stream_class = StubStream
+
+    def __init__(self, client: 'StubOpenAI'):
+        self._client = client
+
+    def create(self, model: str, messages: List[Dict], max_tokens: int = None,
+               temperature: float = None, stream: bool = False, **kwargs):
+        pieces = self._reply_pieces(model, messages, max_tokens, stream)
+        if stream:
+            return self._open_stream(pieces)
+        if self._client.token_delay:
+            time.sleep(self._client.token_delay * len(pieces))
+        return self._completion(pieces)
+
+    def _reply_pieces(self, model: str, messages: List[Dict], max_tokens: Optional[int], stream: bool) -> List[str]:
+        self._client.record_call(model, messages, stream)
+        pieces = _TOKEN_RE.findall(self._client.reply_for(messages))
+        return pieces[:max_tokens] if max_tokens else pieces
+
+    def _open_stream(self, pieces: List[str]):
+        stub_stream = self.stream_class(pieces, self._client.token_delay)
+        self._client.streams.append(stub_stream)
+        return stub_stream
+
+    def _completion(self, pieces: List[str]):
+        return _Namespace(choices=[_Namespace(message=_Namespace(content="".join(pieces)), finish_reason="stop")])
+
+
+class AsyncStubCompletions(StubCompletions):
+    stream_class = AsyncStubStream
+
+    async def create(self, model: str, messages: List[Dict], max_tokens: int = None,
+                     temperature: float = None, stream: bool = False, **kwargs):
+        pieces = self._reply_pieces(model, messages, max_tokens, stream)
+        if stream:
+            return self._open_stream(pieces)
+        if self._client.token_delay:
+            await asyncio.sleep(self._client.token_delay * len(pieces))
+        return self._completion(pieces)
+
+
+class StubOpenAI:
+    """Offline stand-in for openai.OpenAI covering client.chat.completions.create.
+
+    Replies are deterministic: a fixed reply if one is given, otherwise a short
+    sentence echoing the question and the portfolio overview from the system
+    prompt. With stream=True the reply is produced word by word, token_delay
+    seconds apart, so streaming and cancellation can be exercised without
+    network access or an API key.
+    """
+
+    def __init__(self, reply: Optional[str] = None, token_delay: float = None):
+        self.reply = reply
+        self.token_delay = token_delay if token_delay is not None else float(os.getenv('OPENAI_STUB_TOKEN_DELAY', '0.02'))
+        # Most recent calls and streams, for inspection in tests
+        self.calls = deque(maxlen=100)
+        self.streams = deque(maxlen=100)
+        self.chat = _Namespace(completions=StubCompletions(self))
+        self._lock = threading.Lock()
+
+    def reply_for(self, messages: List[Dict]) -> str:
+        if self.reply is not None:
+            return self.reply
+        system = next((message['content'] for message in messages if message['role'] == 'system'), '')
+        question = next((message['content'] for message in reversed(messages) if message['role'] == 'user'), '')
+        units = re.search(r"Total Units: (\d+)", system)
+        revenue = re.search(r"Monthly Revenue: (\$[\d,.]+)", system)
+        overview = ""
+        if units and revenue:
+            overview = f" Your portfolio has {units.group(1)} units bringing in {revenue.group(1)} a month."
+        return f"This is a stub response to \"{question}\".{overview} Set OPENAI_API_KEY to get real answers."
+
+    def record_call(self, model: str, messages: List[Dict], stream: bool):
+        with self._lock:
+            self.calls.append({'model': model, 'messages': messages, 'stream': stream})
+
+
+class AsyncStubOpenAI(StubOpenAI):
+    """Offline stand-in for openai.AsyncOpenAI; same replies as StubOpenAI, awaited"""
+
+    def __init__(self, reply: Optional[str] = None, token_delay: float = None):
+        super().__init__(reply, token_delay)
+        self.chat = _Namespace(completions=AsyncStubCompletions(self))
+
+    async def close(self):
+        pass
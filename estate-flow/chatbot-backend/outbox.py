@@ -0,0 +1,319 @@
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    message_key TEXT,
+    to_email TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    body TEXT NOT NULL,
+    is_html INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    sent_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_status_due ON outbox (status, next_attempt_at);
+"""
+
+# Message states: pending -> sending -> sent, or back to pending with a
+# later next_attempt_at after a failure, or dead once retries run out
+PENDING = 'pending'
+SENDING = 'sending'
+SENT = 'sent'
+DEAD = 'dead'
+
+MESSAGE_FIELDS = ('id', 'message_key', 'to_email', 'subject', 'body', 'is_html', 'status',
+                  'attempts', 'next_attempt_at', 'last_error', 'created_at', 'updated_at', 'sent_at')
+
+
+class EmailOutbox:
+    """Durable SQLite queue of outgoing email, drained by a background dispatcher.
+
+    enqueue() commits the message to disk and returns straight away. The
+    dispatcher claims due messages in batches, hands each batch to send_batch,
+    and records the outcome per message: sent, retried later with exponential
+    backoff (base_delay * 2^(attempts-1), capped at max_delay, with jitter),
+    or dead-lettered after max_attempts. Messages claimed by a process that
+    died mid-send are released again after claim_timeout seconds.
+
+    send_batch receives a list of message dicts and must return one result
+    dict per message, in order, with 'status' ('sent', 'failed' or 'skipped')
+    and 'error'. Skipped messages can never be delivered and are
+    dead-lettered immediately.
+    """
+
+    def __init__(self, send_batch: Callable[[List[Dict]], List[Dict]], path: str = None,
+                 batch_size: int = None, max_attempts: int = None, base_delay: float = None,
+                 max_delay: float = None, poll_interval: float = None, claim_timeout: float = None,
+                 retention_days: float = None):
+        self.send_batch = send_batch
+        self.path = path or os.getenv('OUTBOX_DB_PATH', 'outbox.db')
+        self.batch_size = batch_size or int(os.getenv('OUTBOX_BATCH_SIZE', '50'))
+        self.max_attempts = max_attempts or int(os.getenv('OUTBOX_MAX_ATTEMPTS', '6'))
+        self.base_delay = base_delay if base_delay is not None else float(os.getenv('OUTBOX_RETRY_BASE_SECONDS', '30'))
+        self.max_delay = max_delay if max_delay is not None else float(os.getenv('OUTBOX_RETRY_MAX_SECONDS', '3600'))
+        self.poll_interval = poll_interval if poll_interval is not None else float(os.getenv('OUTBOX_POLL_INTERVAL', '5'))
+        self.claim_timeout = claim_timeout if claim_timeout is not None else float(os.getenv('OUTBOX_CLAIM_TIMEOUT', '300'))
+        self.retention_days = retention_days if retention_days is not None else float(os.getenv('OUTBOX_RETENTION_DAYS', '7'))
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        # Start the dispatcher on enqueue; short-lived processes that only queue turn this off
+        self.autostart = True
+        self._last_purge = 0.0
+
+        # Dispatcher counters since this process started
+        self._sent_times = deque()
+        self.sent_since_start = 0
+        self.failed_attempts = 0
+        self.dead_lettered = 0
+        self.batches = 0
+        self.last_batch = None
+
+    def enqueue(self, to_email: str, subject: str, body: str, is_html: bool = False, key: Optional[str] = None) -> int:
+        """Persist one message for delivery; returns its outbox id"""
+        return self.enqueue_many([(to_email, subject, body, is_html, key)])[0]
+
+    def enqueue_many(self, messages: List[tuple]) -> List[int]:
+        """Persist (to_email, subject, body, is_html, key) tuples in one transaction"""
+        now = time.time()
+        ids = []
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for to_email, subject, body, is_html, key in messages:
+                    cursor = self._conn.execute(
+                        "INSERT INTO outbox (message_key, to_email, subject, body, is_html, next_attempt_at, created_at, updated_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (key, to_email or '', subject, body, int(bool(is_html)), now, now, now)
+                    )
+                    ids.append(cursor.lastrowid)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if ids and self.autostart:
+            self.start()
+            self._wake.set()
+        return ids
+
+    def start(self):
+        """Start the dispatcher thread if it isn't running"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='outbox-dispatcher', daemon=True)
+            self._thread.start()
+        logger.info(f"Outbox dispatcher started ({self.path})")
+
+    def stop(self, timeout: float = 10):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+
+    def dispatch_once(self) -> int:
+        """Claim and send one batch of due messages; returns how many were attempted"""
+        messages = self._claim_batch()
+        if not messages:
+            return 0
+
+        started = time.monotonic()
+        try:
+            results = self.send_batch(messages)
+        except Exception as e:
+            logger.error(f"Outbox batch failed: {str(e)}")
+            results = [{'status': 'failed', 'error': str(e)} for _ in messages]
+
+        now = time.time()
+        sent = failed = dead = 0
+        updates = []
+        for message, result in zip(messages, results):
+            attempts = message['attempts'] + 1
+            if result['status'] == 'sent':
+                sent += 1
+                updates.append((SENT, attempts, message['next_attempt_at'], None, now, now, message['id']))
+            elif result['status'] == 'skipped' or attempts >= self.max_attempts:
+                dead += 1
+                logger.error(f"Outbox message {message['id']} to {message['to_email']} dead-lettered after {attempts} attempt(s): {result.get('error')}")
+                updates.append((DEAD, attempts, message['next_attempt_at'], result.get('error'), now, None, message['id']))
+            else:
+                failed += 1
+                updates.append((PENDING, attempts, now + self.backoff(attempts), result.get('error'), now, None, message['id']))
+
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.executemany(
+                "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?, updated_at = ?, sent_at = ? WHERE id = ?",
+                updates
+            )
+            self._conn.execute("COMMIT")
+            self._sent_times.extend([now] * sent)
+            self.sent_since_start += sent
+            self.failed_attempts += failed
+            self.dead_lettered += dead
+            self.batches += 1
+            self.last_batch = {
+                'size': len(messages),
+                'sent': sent,
+                'retrying': failed,
+                'dead_lettered': dead,
+                'elapsed_seconds': round(time.monotonic() - started, 3),
+                'finished_at': now
+            }
+        return len(messages)
+
+    def backoff(self, attempts: int) -> float:
+        """Seconds to wait before the next try after `attempts` failures"""
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempts - 1)))
+        # Jitter so messages that failed together don't all retry together
+        return delay * random.uniform(0.8, 1.2)
+
+    def get(self, message_id: int) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM outbox WHERE id = ?", (message_id,)).fetchone()
+        return self._message(row) if row else None
+
+    def dead_letters(self, limit: int = 100) -> List[Dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM outbox WHERE status = ? ORDER BY updated_at DESC LIMIT ?", (DEAD, limit)
+            ).fetchall()
+        return [self._message(row) for row in rows]
+
+    def retry_dead(self, message_ids: Optional[List[int]] = None) -> int:
+        """Move dead letters (all, or the given ids) back to pending with a fresh retry budget"""
+        now = time.time()
+        with self._lock:
+            if message_ids is None:
+                cursor = self._conn.execute(
+                    "UPDATE outbox SET status = ?, attempts = 0, next_attempt_at = ?, updated_at = ? WHERE status = ?",
+                    (PENDING, now, now, DEAD)
+                )
+            else:
+                cursor = self._conn.executemany(
+                    "UPDATE outbox SET status = ?, attempts = 0, next_attempt_at = ?, updated_at = ? WHERE status = ? AND id = ?",
+                    [(PENDING, now, now, DEAD, message_id) for message_id in message_ids]
+                )
+            requeued = cursor.rowcount
+        if requeued and self.autostart:
+            self.start()
+            self._wake.set()
+        return requeued
+
+    def stats(self) -> Dict:
+        now = time.time()
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+            due, oldest = self._conn.execute(
+                "SELECT SUM(next_attempt_at <= ?), MIN(created_at) FROM outbox WHERE status = ?", (now, PENDING)
+            ).fetchone()
+            while self._sent_times and self._sent_times[0] < now - 60:
+                self._sent_times.popleft()
+            sent_last_minute = len(self._sent_times)
+            return {
+                'depth': counts.get(PENDING, 0),
+                'due': due or 0,
+                'in_flight': counts.get(SENDING, 0),
+                'sent': counts.get(SENT, 0),
+                'dead_letters': counts.get(DEAD, 0),
+                'oldest_pending_seconds': round(now - oldest, 1) if oldest else None,
+                'drain_rate_per_minute': sent_last_minute,
+                'sent_since_start': self.sent_since_start,
+                'failed_attempts_since_start': self.failed_attempts,
+                'dead_lettered_since_start': self.dead_lettered,
+                'batches_since_start': self.batches,
+                'last_batch': self.last_batch,
+                'dispatcher_running': self._thread is not None and self._thread.is_alive(),
+                'batch_size': self.batch_size,
+                'max_attempts': self.max_attempts
+            }
+
+    def _claim_batch(self) -> List[Dict]:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Release messages claimed by a dispatcher that never reported back
+                self._conn.execute(
+                    "UPDATE outbox SET status = ?, updated_at = ? WHERE status = ? AND updated_at < ?",
+                    (PENDING, now, SENDING, now - self.claim_timeout)
+                )
+                rows = self._conn.execute(
+                    "SELECT * FROM outbox WHERE status = ? AND next_attempt_at <= ? ORDER BY next_attempt_at, id LIMIT ?",
+                    (PENDING, now, self.batch_size)
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE outbox SET status = ?, updated_at = ? WHERE id = ?",
+                    [(SENDING, now, row['id']) for row in rows]
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [self._message(row) for row in rows]
+
+    def _seconds_until_due(self) -> float:
+        with self._lock:
+            next_due = self._conn.execute(
+                "SELECT MIN(next_attempt_at) FROM outbox WHERE status = ?", (PENDING,)
+            ).fetchone()[0]
+        if next_due is None:
+            return self.poll_interval
+        return max(0.0, min(self.poll_interval, next_due - time.time()))
+
+    def _purge_sent(self):
+        """Drop delivered messages older than the retention window, at most once an hour"""
+        now = time.time()
+        if self.retention_days <= 0 or now - self._last_purge < 3600:
+            return
+        self._last_purge = now
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM outbox WHERE status = ? AND sent_at < ?", (SENT, now - self.retention_days * 86400)
+            )
+        if cursor.rowcount:
+            logger.info(f"Purged {cursor.rowcount} delivered messages from the outbox")
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._purge_sent()
+                if self.dispatch_once():
+                    continue
+                wait = self._seconds_until_due()
+            except Exception as e:
+                logger.error(f"Outbox dispatcher error: {str(e)}")
+                wait = self.poll_interval
+            self._wake.wait(wait)
+            self._wake.clear()
+        logger.info("Outbox dispatcher stopped")
+
+    @staticmethod
+    def _message(row: sqlite3.Row) -> Dict:
+        message = {field: row[field] for field in MESSAGE_FIELDS}
+        message['is_html'] = bool(message['is_html'])
+        return message
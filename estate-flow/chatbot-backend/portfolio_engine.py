@@ -0,0 +1,398 @@
+import math
+import re
+import numpy as np
+from typing import List, Dict, Sequence, Tuple
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+# Stripped from rent text before parsing: currency signs and codes, and the
+# spaces/apostrophes some locales group thousands with
+RENT_NOISE = ('$', '€', '£', '¥', '₹', 'usd', 'eur', 'gbp', 'cad', 'aud', 'chf', '\u00a0', ' ', '\t', "'")
+
+# A comma that isn't grouping thousands, as in "3200,50" or "1.234,56"
+DECIMAL_COMMA = re.compile(r',(?!\d{3}(?:[.,k\n]|$))')
+BLANK_RENT = re.compile(r'^(?:none)?$', re.MULTILINE)
+# Anything but digits, separators, signs and the k suffix once the noise is gone.
+# float() would also take exponents, underscores, "nan" and "inf"
+NOT_RENT_TEXT = re.compile(r'[^0-9.,+\-k\n]')
+# Text float() reads the same way normalize_rents does
+PLAIN_RENT = re.compile(r'[+-]?\d+(?:\.\d*)?')
+
+
+def normalize_rents(values: Sequence) -> Tuple[np.ndarray, np.ndarray]:
+    """Parse a whole rent column at once.
+
+    Accepts ints, floats and text such as "$2,500.00", "€1.234,56",
+    "3200,50" or "2.5k". When a value has both separators the last one is
+    the decimal point; a lone comma followed by exactly three digits groups
+    thousands, any other lone comma is a decimal comma. Returns the rents as
+    float64 and a mask of the entries that couldn't be read, which are 0 in
+    the rents. Blank and missing values are 0 and not flagged. Booleans,
+    non-finite numbers and text float() would take but isn't a rent
+    ("1e3", "1_000", "nan", "inf") are flagged. Each value parses the same
+    whatever else is in the column.
+    """
+    n = len(values)
+    kinds = set(map(type, values))
+    rents = None
+    if not any(issubclass(kind, (str, bool, np.bool_)) or kind is type(None) for kind in kinds):
+        try:
+            # Plain numbers convert directly
+            rents = np.asarray(values, dtype=np.float64).reshape(n)
+        except (TypeError, ValueError):
+            rents = None
+    if rents is None:
+        rents = _normalize_rent_column(values, kinds)
+    unparseable = ~np.isfinite(rents)
+    rents[unparseable] = 0.0
+    return rents, unparseable
+
+
+def _normalize_rent_column(values: Sequence, kinds: set) -> np.ndarray:
+    """Rents for a column with text in it; unreadable entries come back as NaN"""
+    n = len(values)
+    # Clean the column as one string so each step is a single C-level pass
+    text = None
+    numbers = {}
+    if kinds and all(issubclass(kind, str) for kind in kinds):
+        text = '\n'.join(values)
+    if text is None or text.count('\n') != n - 1:
+        # Mixed types, or cells with line breaks of their own. Numbers are set
+        # afterwards rather than printed, since str() may use an exponent
+        cells = []
+        for position, value in enumerate(values):
+            if isinstance(value, (int, float, np.number)) and not isinstance(value, (bool, np.bool_)):
+                numbers[position] = float(value)
+                cells.append('')
+            else:
+                cells.append('' if value is None else str(value).replace('\n', ' '))
+        text = '\n'.join(cells)
+    if text != text.lower():
+        text = text.lower()
+    for noise in RENT_NOISE:
+        if noise in text:
+            text = text.replace(noise, '')
+    if not text or 'none' in text or '\n\n' in text or text[0] == '\n' or text[-1] == '\n':
+        text = BLANK_RENT.sub('0', text)
+    try:
+        if ',' in text and DECIMAL_COMMA.search(text):
+            raise ValueError('decimal commas')
+        if NOT_RENT_TEXT.search(text):
+            raise ValueError('exponents, underscores, nan, inf or other text')
+        rents = np.array(text.replace(',', '').split('\n'), dtype=np.float64)
+    except ValueError:
+        # Decimal commas, k suffixes, dotted thousands or unreadable values
+        rents, unparseable = _normalize_rent_text(np.asarray(text.split('\n'), dtype=str))
+        rents[unparseable] = np.nan
+    for position, value in numbers.items():
+        rents[position] = value
+    return rents
+
+
+def _normalize_rent_text(text: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Separator-aware parse of cleaned rent strings, with vectorized string ops"""
+    negative = np.char.startswith(text, '-')
+    text = np.char.lstrip(text, '+-')
+    thousands = np.char.endswith(text, 'k')
+    text = np.char.rstrip(text, 'k')
+
+    commas = np.char.count(text, ',')
+    dots = np.char.count(text, '.')
+    last_comma = np.char.rfind(text, ',')
+    digits_after_comma = np.char.str_len(text) - last_comma - 1
+    decimal_comma = (commas > 0) & np.where(dots > 0, last_comma > np.char.rfind(text, '.'),
+                                            (commas == 1) & (digits_after_comma != 3))
+    # Decimal comma, or dots only used to group thousands ("1.234.567")
+    european = decimal_comma | ((commas == 0) & (dots > 1))
+    if european.any():
+        text = np.where(european,
+                        np.char.replace(np.char.replace(text, '.', ''), ',', '.'),
+                        np.char.replace(text, ',', ''))
+    else:
+        text = np.char.replace(text, ',', '')
+
+    valid = np.char.isdecimal(np.char.replace(text, '.', '', 1)) & (np.char.count(text, '.') <= 1)
+    rents = np.zeros(len(text), dtype=np.float64)
+    rents[valid] = np.array(text[valid].tolist(), dtype=np.float64)
+    rents *= np.where(thousands, 1000.0, 1.0) * np.where(negative, -1.0, 1.0)
+    return rents, ~valid
+
+
+def parse_rent(rent_value) -> float:
+    """Parse one rent value to float (see normalize_rents); unreadable values are 0.0"""
+    if isinstance(rent_value, bool):
+        return 0.0
+
+    if isinstance(rent_value, (int, float)):
+        rent = float(rent_value)
+        return rent if math.isfinite(rent) else 0.0
+
+    if isinstance(rent_value, str) and PLAIN_RENT.fullmatch(rent_value):
+        return float(rent_value)
+
+    return float(normalize_rents([rent_value])[0][0])
+
+
+def _is_occupied(tenant) -> bool:
+    """A unit counts as occupied when it has a tenant with a name"""
+    return bool(tenant and isinstance(tenant, dict) and tenant.get('name'))
+
+
+def to_number(value) -> float:
+    """Best-effort numeric conversion for bedroom/bathroom/size columns"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).replace(',', '').strip())
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _numeric_column(values: List) -> np.ndarray:
+    """Convert a column in one shot, only falling back per value on odd input"""
+    try:
+        column = np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        column = np.fromiter((to_number(value) for value in values), dtype=np.float64, count=len(values))
+    return np.nan_to_num(column, nan=0.0, posinf=0.0, neginf=0.0)
+
+
+def normalize_unit(unit: Dict) -> Dict:
+    """Single-unit counterpart of PortfolioFrame.unit_infos, used for incremental updates"""
+    tenant = unit.get('tenant')
+    return {
+        "number": unit.get('number', 'Unknown'),
+        "bedrooms": unit.get('bedrooms', 0),
+        "bathrooms": unit.get('bathrooms', 0),
+        "square_feet": unit.get('squareFeet', 0),
+        "rent": parse_rent(unit.get('rent', 0)),
+        "is_occupied": _is_occupied(tenant),
+        "tenant_name": tenant.get('name') if tenant and isinstance(tenant, dict) else None
+    }
+
+
+class PortfolioFrame:
+    """Column-oriented view of a property portfolio.
+
+    Every unit of every property occupies one row. Numeric columns are NumPy
+    arrays so totals and per-property rollups are computed with vectorized
+    group-by reductions instead of Python loops. The original per-unit values
+    are kept alongside so the summary can echo them back unchanged.
+    """
+
+    def __init__(self, names: List[str], addresses: List[str], unit_counts: np.ndarray,
+                 rent: np.ndarray, bedrooms: np.ndarray, bathrooms: np.ndarray,
+                 sqft: np.ndarray, occupied: np.ndarray, property_index: np.ndarray,
+                 unit_numbers: List, tenant_names: List, raw_bedrooms: List,
+                 raw_bathrooms: List, raw_sqft: List, rent_unparseable: np.ndarray = None):
+        self.names = names
+        self.addresses = addresses
+        self.unit_counts = unit_counts
+        self.rent = rent
+        self.bedrooms = bedrooms
+        self.bathrooms = bathrooms
+        self.sqft = sqft
+        self.occupied = occupied
+        self.property_index = property_index
+        self.unit_numbers = unit_numbers
+        self.tenant_names = tenant_names
+        self.raw_bedrooms = raw_bedrooms
+        self.raw_bathrooms = raw_bathrooms
+        self.raw_sqft = raw_sqft
+        # Units whose rent couldn't be read and counts as 0
+        self.rent_unparseable = rent_unparseable if rent_unparseable is not None else np.zeros(len(rent), dtype=bool)
+
+    @classmethod
+    def from_properties(cls, properties: List[Dict]) -> 'PortfolioFrame':
+        """Build the columnar representation in a single pass over the units"""
+        names = []
+        addresses = []
+        unit_counts = []
+        raw_rents = []
+        bedrooms = []
+        bathrooms = []
+        sqft = []
+        occupied = []
+        property_index = []
+        unit_numbers = []
+        tenant_names = []
+
+        for prop in properties:
+            if not isinstance(prop, dict):
+                continue
+
+            prop_idx = len(names)
+            names.append(prop.get('name', 'Unknown'))
+            addresses.append(prop.get('address', 'Unknown'))
+            units = [unit for unit in (prop.get('units') or []) if isinstance(unit, dict)]
+            unit_counts.append(len(units))
+
+            for unit in units:
+                tenant = unit.get('tenant')
+                raw_rents.append(unit.get('rent', 0))
+                bedrooms.append(unit.get('bedrooms', 0))
+                bathrooms.append(unit.get('bathrooms', 0))
+                sqft.append(unit.get('squareFeet', 0))
+                occupied.append(_is_occupied(tenant))
+                property_index.append(prop_idx)
+                unit_numbers.append(unit.get('number', 'Unknown'))
+                tenant_names.append(tenant.get('name') if tenant and isinstance(tenant, dict) else None)
+
+        rent, rent_unparseable = normalize_rents(raw_rents)
+        if rent_unparseable.any():
+            logger.warning(f"{int(rent_unparseable.sum())} unit rents could not be read and count as 0")
+        return cls(
+            names=names,
+            addresses=addresses,
+            unit_counts=np.asarray(unit_counts, dtype=np.int64),
+            rent=rent,
+            bedrooms=_numeric_column(bedrooms),
+            bathrooms=_numeric_column(bathrooms),
+            sqft=_numeric_column(sqft),
+            occupied=np.asarray(occupied, dtype=bool),
+            property_index=np.asarray(property_index, dtype=np.int64),
+            unit_numbers=unit_numbers,
+            tenant_names=tenant_names,
+            raw_bedrooms=bedrooms,
+            raw_bathrooms=bathrooms,
+            raw_sqft=sqft,
+            rent_unparseable=rent_unparseable,
+        )
+
+    @classmethod
+    def from_summary(cls, property_summary: Dict) -> 'PortfolioFrame':
+        """Rebuild the columns from an existing property_summary (units already normalized)"""
+        names = []
+        addresses = []
+        unit_counts = []
+        rents = []
+        bedrooms = []
+        bathrooms = []
+        sqft = []
+        occupied = []
+        property_index = []
+        unit_numbers = []
+        tenant_names = []
+
+        for prop_idx, prop in enumerate(property_summary.get('properties', [])):
+            names.append(prop.get('name', 'Unknown'))
+            addresses.append(prop.get('address', 'Unknown'))
+            units = prop.get('units', [])
+            unit_counts.append(len(units))
+            for unit in units:
+                rents.append(unit.get('rent', 0))
+                bedrooms.append(unit.get('bedrooms', 0))
+                bathrooms.append(unit.get('bathrooms', 0))
+                sqft.append(unit.get('square_feet', 0))
+                occupied.append(bool(unit.get('is_occupied')))
+                property_index.append(prop_idx)
+                unit_numbers.append(unit.get('number', 'Unknown'))
+                tenant_names.append(unit.get('tenant_name'))
+
+        return cls(
+            names=names,
+            addresses=addresses,
+            unit_counts=np.asarray(unit_counts, dtype=np.int64),
+            rent=np.asarray(rents, dtype=np.float64),
+            bedrooms=_numeric_column(bedrooms),
+            bathrooms=_numeric_column(bathrooms),
+            sqft=_numeric_column(sqft),
+            occupied=np.asarray(occupied, dtype=bool),
+            property_index=np.asarray(property_index, dtype=np.int64),
+            unit_numbers=unit_numbers,
+            tenant_names=tenant_names,
+            raw_bedrooms=bedrooms,
+            raw_bathrooms=bathrooms,
+            raw_sqft=sqft,
+        )
+
+    @property
+    def total_properties(self) -> int:
+        return len(self.names)
+
+    @property
+    def total_units(self) -> int:
+        return int(self.rent.shape[0])
+
+    def occupied_rent(self) -> np.ndarray:
+        """Rent column with vacant units zeroed out"""
+        return np.where(self.occupied, self.rent, 0.0)
+
+    def property_revenue(self) -> np.ndarray:
+        """Monthly revenue per property (group-by sum over occupied rent)"""
+        return np.bincount(self.property_index, weights=self.occupied_rent(),
+                           minlength=self.total_properties)
+
+    def property_occupied(self) -> np.ndarray:
+        """Occupied unit count per property"""
+        return np.bincount(self.property_index, weights=self.occupied,
+                           minlength=self.total_properties).astype(np.int64)
+
+    def property_occupancy_rates(self) -> np.ndarray:
+        """Occupancy percentage per property, 0 for properties without units"""
+        occupied = self.property_occupied()
+        rates = np.zeros(self.total_properties, dtype=np.float64)
+        has_units = self.unit_counts > 0
+        rates[has_units] = occupied[has_units] / self.unit_counts[has_units] * 100
+        return rates
+
+    def unit_infos(self) -> List[Dict]:
+        """Per-unit dicts in the shape the prompt and fallback helpers expect"""
+        rents = self.rent.tolist()
+        occupied = self.occupied.tolist()
+        return [
+            {
+                "number": number,
+                "bedrooms": bedrooms,
+                "bathrooms": bathrooms,
+                "square_feet": sqft,
+                "rent": rent,
+                "is_occupied": is_occupied,
+                "tenant_name": tenant_name
+            }
+            for number, bedrooms, bathrooms, sqft, rent, is_occupied, tenant_name
+            in zip(self.unit_numbers, self.raw_bedrooms, self.raw_bathrooms, self.raw_sqft,
+                   rents, occupied, self.tenant_names)
+        ]
+
+    def summary(self) -> Dict:
+        """Aggregate the portfolio into the property_summary structure"""
+        total_units = self.total_units
+        occupied_count = int(np.count_nonzero(self.occupied))
+        total_revenue = float(self.occupied_rent().sum())
+        occupancy_rate = (occupied_count / total_units * 100) if total_units > 0 else 0
+
+        property_summary = {
+            "total_properties": self.total_properties,
+            "total_units": total_units,
+            "occupied_units": occupied_count,
+            "vacant_units": total_units - occupied_count,
+            "occupancy_rate": round(occupancy_rate, 1),
+            "monthly_revenue": total_revenue,
+            "annual_revenue": total_revenue * 12,
+            "properties": []
+        }
+
+        revenue = self.property_revenue().tolist()
+        rates = self.property_occupancy_rates().tolist()
+        unit_counts = self.unit_counts.tolist()
+        offsets = np.concatenate(([0], np.cumsum(self.unit_counts))).tolist()
+        unit_infos = self.unit_infos()
+
+        for prop_idx, name in enumerate(self.names):
+            property_info = {
+                "name": name,
+                "address": self.addresses[prop_idx],
+                "total_units": unit_counts[prop_idx],
+                "units": unit_infos[offsets[prop_idx]:offsets[prop_idx + 1]]
+            }
+            property_info["monthly_revenue"] = revenue[prop_idx]
+            property_info["occupancy_rate"] = round(rates[prop_idx], 1)
+            property_summary["properties"].append(property_info)
+
+        return property_summary
+
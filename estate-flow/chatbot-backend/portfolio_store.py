@@ -0,0 +1,332 @@
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import List, Dict, Optional
+import logging
+from portfolio_engine import PortfolioFrame, normalize_unit
+from ranking_index import PortfolioIndex
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class PortfolioNotFoundError(KeyError):
+    """Raised when a portfolio ID is unknown (never uploaded or evicted)"""
+
+
+class PortfolioVersionConflict(ValueError):
+    """Raised when a delta was computed against a version that is no longer current"""
+
+    def __init__(self, portfolio_id: str, expected: int, current: int):
+        super().__init__(f"Portfolio {portfolio_id} is at version {current}, delta was based on version {expected}")
+        self.portfolio_id = portfolio_id
+        self.expected = expected
+        self.current = current
+
+
+def _unit_key(unit: Dict) -> str:
+    return str(unit.get('number', 'Unknown'))
+
+
+class PortfolioRecord:
+    """A stored portfolio with its derived summary maintained incrementally.
+
+    Units are kept already normalized (rent parsed, occupancy resolved) and
+    grouped by property. Each property carries its own revenue/occupancy
+    aggregates; a delta only recomputes the aggregates of the properties it
+    touches, and portfolio totals are re-derived from the per-property ones.
+    """
+
+    def __init__(self, portfolio_id: str):
+        self.portfolio_id = portfolio_id
+        self.version = 0
+        self.created_at = datetime.now()
+        self.updated_at = self.created_at
+        self.properties = OrderedDict()
+        self._summary = None
+        self._ranking_index = None
+        self._lock = threading.RLock()
+
+    def load(self, properties: List[Dict]):
+        """Replace the whole portfolio, aggregating it through the columnar engine.
+
+        Properties are keyed by name and units by number, so a repeated
+        property name or unit number raises ValueError (as a CSV import
+        reports it) instead of silently merging, and the portfolio is left
+        as it was.
+        """
+        frame = PortfolioFrame.from_properties(properties)
+        revenue = frame.property_revenue().tolist()
+        occupied = frame.property_occupied().tolist()
+        unit_infos = frame.unit_infos()
+
+        loaded = OrderedDict()
+        offset = 0
+        for prop_idx, name in enumerate(frame.names):
+            if name in loaded:
+                raise ValueError(f"Duplicate property {name}")
+            count = int(frame.unit_counts[prop_idx])
+            entry = loaded[name] = self._property_entry(name, frame.addresses[prop_idx])
+            for unit_info in unit_infos[offset:offset + count]:
+                number = str(unit_info["number"])
+                if number in entry["units"]:
+                    raise ValueError(f"Duplicate unit {number} at {name}")
+                entry["units"][number] = unit_info
+            offset += count
+            entry["monthly_revenue"] = revenue[prop_idx]
+            entry["occupied"] = occupied[prop_idx]
+
+        with self._lock:
+            self.properties = loaded
+            self._ranking_index = None
+            self._bump_version()
+
+    def apply_delta(self, added: List[Dict], changed: List[Dict], removed: List[Dict],
+                    removed_properties: Optional[List[str]] = None) -> Dict:
+        """Apply unit-level changes and refresh only the affected property aggregates"""
+        with self._lock:
+            return self._apply_delta(added, changed, removed, removed_properties)
+
+    def _apply_delta(self, added: List[Dict], changed: List[Dict], removed: List[Dict],
+                     removed_properties: Optional[List[str]]) -> Dict:
+        # Validate and normalize everything first, so a bad entry rejects the whole
+        # delta instead of leaving part of it applied under the old version
+        upserts = self._validate_delta(added, changed, removed, removed_properties)
+        touched = set()
+        # Updated in place: readers go through ranking_index_at, which holds this lock
+        # and stops handing the index out once the version moves on
+        index = self._ranking_index
+
+        for change, unit_info in upserts:
+            name = change['property']
+            entry = self.properties.get(name)
+            if entry is None:
+                entry = self._property_entry(name, change.get('address', 'Unknown'))
+                self.properties[name] = entry
+            elif change.get('address'):
+                entry["address"] = change['address']
+            entry["units"][_unit_key(change['unit'])] = unit_info
+            if index is not None:
+                index.upsert_unit(name, unit_info)
+            touched.add(name)
+
+        for removal in removed:
+            name = removal.get('property')
+            entry = self.properties.get(name)
+            if entry is None:
+                continue
+            number = str(removal.get('number', 'Unknown'))
+            entry["units"].pop(number, None)
+            if index is not None:
+                index.remove_unit(name, number)
+            touched.add(name)
+
+        for name in removed_properties or []:
+            self.properties.pop(name, None)
+            if index is not None:
+                index.remove_property(name)
+            touched.discard(name)
+
+        for name in touched:
+            entry = self.properties[name]
+            self._refresh_property(entry)
+            if index is not None:
+                index.update_property(self._property_rollup(entry))
+
+        self._bump_version()
+        return {
+            "upserted": len(added) + len(changed),
+            "removed": len(removed),
+            "properties_refreshed": len(touched)
+        }
+
+    def _validate_delta(self, added: List[Dict], changed: List[Dict], removed: List[Dict],
+                        removed_properties: Optional[List[str]]) -> List:
+        """(change, normalized unit) pairs for the upserts; raises ValueError before anything is changed"""
+        for name, entries in (('added', added), ('changed', changed), ('removed', removed),
+                              ('removed_properties', removed_properties or [])):
+            if not isinstance(entries, list):
+                raise ValueError(f"'{name}' must be a list")
+        upserts = []
+        for change in list(added) + list(changed):
+            if not isinstance(change, dict) or not change.get('property') or not isinstance(change.get('unit'), dict):
+                raise ValueError("Each added/changed entry needs a 'property' name and a 'unit' object")
+            upserts.append((change, normalize_unit(change['unit'])))
+        if not all(isinstance(removal, dict) for removal in removed):
+            raise ValueError("Each removed entry needs a 'property' name and a unit 'number'")
+        if not all(isinstance(name, str) for name in removed_properties or []):
+            raise ValueError("'removed_properties' must be a list of property names")
+        return upserts
+
+    def summary(self) -> Dict:
+        """Current property_summary, rebuilt from the per-property aggregates when stale"""
+        with self._lock:
+            if self._summary is None:
+                self._summary = self._build_summary()
+            return self._summary
+
+    def ranking_index(self, version: Optional[int] = None) -> Optional[PortfolioIndex]:
+        """Ranking index over the current units, built on first use and then carried forward by deltas.
+
+        With a version, None once that version has been superseded, so callers
+        never pair an older summary with a newer index.
+        """
+        with self._lock:
+            if version is not None and version != self.version:
+                return None
+            if self._ranking_index is None:
+                self._ranking_index = PortfolioIndex.from_summary(self.summary())
+            return self._ranking_index
+
+    @contextmanager
+    def ranking_index_at(self, version: int):
+        """The ranking index while it still matches version, or None once superseded.
+
+        The record stays locked until the block exits, so no delta can change
+        the index while the caller reads it.
+        """
+        with self._lock:
+            yield self.ranking_index(version)
+
+    def versioned_summary(self):
+        """(version, summary) read together so callers can key caches on the version"""
+        with self._lock:
+            return self.version, self.summary()
+
+    def _build_summary(self) -> Dict:
+        total_units = sum(len(entry["units"]) for entry in self.properties.values())
+        occupied_units = sum(entry["occupied"] for entry in self.properties.values())
+        total_revenue = float(sum(entry["monthly_revenue"] for entry in self.properties.values()))
+        occupancy_rate = (occupied_units / total_units * 100) if total_units > 0 else 0
+
+        property_summary = {
+            "total_properties": len(self.properties),
+            "total_units": total_units,
+            "occupied_units": occupied_units,
+            "vacant_units": total_units - occupied_units,
+            "occupancy_rate": round(occupancy_rate, 1),
+            "monthly_revenue": total_revenue,
+            "annual_revenue": total_revenue * 12,
+            "properties": []
+        }
+
+        for entry in self.properties.values():
+            unit_count = len(entry["units"])
+            property_summary["properties"].append({
+                "name": entry["name"],
+                "address": entry["address"],
+                "total_units": unit_count,
+                "units": list(entry["units"].values()),
+                "monthly_revenue": entry["monthly_revenue"],
+                "occupancy_rate": round((entry["occupied"] / unit_count * 100) if unit_count > 0 else 0, 1)
+            })
+
+        return property_summary
+
+    def describe(self) -> Dict:
+        """Lightweight metadata for API responses"""
+        summary = self.summary()
+        return {
+            "portfolio_id": self.portfolio_id,
+            "version": self.version,
+            "total_properties": summary["total_properties"],
+            "total_units": summary["total_units"],
+            "updated_at": self.updated_at.isoformat()
+        }
+
+    def _property_entry(self, name: str, address: str) -> Dict:
+        return {
+            "name": name,
+            "address": address,
+            "units": OrderedDict(),
+            "monthly_revenue": 0.0,
+            "occupied": 0
+        }
+
+    def _property_rollup(self, entry: Dict) -> Dict:
+        """Property fields the ranking index reports, without the unit list"""
+        unit_count = len(entry["units"])
+        return {
+            "name": entry["name"],
+            "address": entry["address"],
+            "total_units": unit_count,
+            "monthly_revenue": entry["monthly_revenue"],
+            "occupancy_rate": round((entry["occupied"] / unit_count * 100) if unit_count > 0 else 0, 1)
+        }
+
+    def _refresh_property(self, entry: Dict):
+        occupied = [unit for unit in entry["units"].values() if unit["is_occupied"]]
+        entry["occupied"] = len(occupied)
+        entry["monthly_revenue"] = float(sum(unit["rent"] for unit in occupied))
+
+    def _bump_version(self):
+        self.version += 1
+        self.updated_at = datetime.now()
+        self._summary = None
+
+
+class PortfolioStore:
+    """In-process portfolio registry keyed by portfolio ID.
+
+    Bounded by max_portfolios; the least recently used portfolio is evicted
+    first, and clients re-upload when they get a not-found error.
+    """
+
+    def __init__(self, max_portfolios: int = None):
+        self.max_portfolios = max_portfolios or int(os.getenv('PORTFOLIO_STORE_MAX', '100'))
+        self._records = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, properties: List[Dict]) -> PortfolioRecord:
+        """Upload a full portfolio and return its record (version 1)"""
+        record = PortfolioRecord(uuid.uuid4().hex)
+        record.load(properties)
+        with self._lock:
+            self._records[record.portfolio_id] = record
+            while len(self._records) > self.max_portfolios:
+                evicted_id, _ = self._records.popitem(last=False)
+                logger.info(f"Evicted portfolio {evicted_id} from store")
+        logger.info(f"Stored portfolio {record.portfolio_id} with {record.summary()['total_units']} units")
+        return record
+
+    def get(self, portfolio_id: str) -> PortfolioRecord:
+        with self._lock:
+            record = self._records.get(portfolio_id)
+            if record is None:
+                raise PortfolioNotFoundError(portfolio_id)
+            self._records.move_to_end(portfolio_id)
+            return record
+
+    def replace(self, portfolio_id: str, properties: List[Dict]) -> PortfolioRecord:
+        """Replace the full contents of an existing portfolio"""
+        record = self.get(portfolio_id)
+        record.load(properties)
+        return record
+
+    def apply_delta(self, portfolio_id: str, delta: Dict) -> Dict:
+        """Apply a unit-level delta, rejecting it if it was based on a stale version"""
+        record = self.get(portfolio_id)
+        with record._lock:
+            base_version = delta.get('base_version')
+            if base_version is not None and int(base_version) != record.version:
+                raise PortfolioVersionConflict(portfolio_id, int(base_version), record.version)
+            result = record.apply_delta(
+                delta.get('added', []),
+                delta.get('changed', []),
+                delta.get('removed', []),
+                delta.get('removed_properties', [])
+            )
+            result.update(record.describe())
+        return result
+
+    def delete(self, portfolio_id: str) -> bool:
+        with self._lock:
+            return self._records.pop(portfolio_id, None) is not None
+
+
+# Global portfolio store instance
+portfolio_store = PortfolioStore()
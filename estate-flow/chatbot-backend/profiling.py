@@ -0,0 +1,398 @@
+"""Opt-in profiling of single requests and scheduler runs.
+
+A request is profiled when it carries an `X-Profile` header or a `profile`
+query parameter (`1`/`true` for the default mode, or `deterministic` /
+`sample`). The next scheduler run is profiled after it is armed with
+POST /admin/profiles/scheduler. A profile has two parts:
+
+- a span tree: the run's pipeline stages with their start offsets and
+  durations, from the `span()`/`stage()` markers in the code paths
+- a function profile: cProfile for the whole run ("deterministic"), or a
+  stack sampler that looks at the profiled thread every
+  PROFILE_SAMPLE_INTERVAL seconds ("sample"; much cheaper, approximate)
+
+Finished profiles are kept in memory (the last PROFILE_STORE_SIZE) and read
+back by ID from /admin/profiles/<id>. Unprofiled work pays one context-variable
+lookup per marker. A thread can only run one cProfile at a time, so a second
+deterministic profile on the same thread (concurrent async requests share the
+event loop thread) records spans only, and says so in its notes.
+"""
+import contextvars
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from datetime import datetime
+from functools import wraps
+from typing import Callable, Dict, List, Optional
+import logging
+from metrics import CHAT_STAGE_SECONDS
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MODES = ('deterministic', 'sample')
+_ENABLE_VALUES = ('1', 'true', 'yes', 'on')
+
+# The span new spans nest under; None whenever nothing is being profiled
+_current_span = contextvars.ContextVar('profile_span', default=None)
+
+# Threads running a cProfile, which can't take a second one
+_profiled_threads = set()
+_profiled_threads_lock = threading.Lock()
+
+
+def _describe(filename: str, line: int, function: str) -> str:
+    return f"{function} ({os.path.basename(filename)}:{line})" if line else function
+
+
+class Span:
+    """One timed stage of a profiled run"""
+
+    __slots__ = ('session', 'name', 'started', 'ended', 'children')
+
+    def __init__(self, session: 'ProfileSession', name: str):
+        self.session = session
+        self.name = name
+        self.started = time.perf_counter()
+        self.ended = None
+        self.children = []
+
+    def to_dict(self, origin: float) -> Dict:
+        ended = self.ended if self.ended is not None else time.perf_counter()
+        span = {
+            'name': self.name,
+            'start_ms': round((self.started - origin) * 1000, 3),
+            'duration_ms': round((ended - self.started) * 1000, 3),
+        }
+        if self.ended is None:
+            span['unfinished'] = True
+        if self.children:
+            span['children'] = [child.to_dict(origin) for child in self.children]
+        return span
+
+
+class _SpanTimer:
+    """Context manager (or decorator) adding a span under the current one, if any"""
+
+    __slots__ = ('name', 'span', 'token')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.span = None
+        self.token = None
+
+    def __enter__(self):
+        parent = _current_span.get()
+        if parent is not None:
+            self.span = parent.session.open_span(self.name, parent)
+            self.token = _current_span.set(self.span)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.span is not None:
+            self.span.ended = time.perf_counter()
+            try:
+                _current_span.reset(self.token)
+            except ValueError:
+                # A generator closed from another context; that context never saw this span
+                pass
+        return False
+
+    def __call__(self, function: Callable) -> Callable:
+        factory, name = type(self), self.name
+
+        @wraps(function)
+        def spanned(*args, **kwargs):
+            with factory(name):
+                return function(*args, **kwargs)
+        return spanned
+
+
+class _StageTimer(_SpanTimer):
+    """A span that is also recorded in the /chat stage histogram, profiled or not"""
+
+    __slots__ = ('started',)
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return super().__enter__()
+
+    def __exit__(self, *exc_info):
+        super().__exit__(*exc_info)
+        CHAT_STAGE_SECONDS.labels(self.name).observe(time.perf_counter() - self.started)
+        return False
+
+
+def span(name: str) -> _SpanTimer:
+    """Mark a stage for profiles: `with span('claim'):` or `@span('claim')`"""
+    return _SpanTimer(name)
+
+
+def stage(name: str) -> _StageTimer:
+    """Mark a /chat stage: timed into /metrics on every request, and a span when profiled"""
+    return _StageTimer(name)
+
+
+class StackSampler(threading.Thread):
+    """Samples one thread's Python stack at a fixed interval"""
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(name='profile-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(_describe(code.co_filename, code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+            self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def report(self, top: int) -> Dict:
+        own = Counter()
+        inclusive = Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for function in set(stack):
+                inclusive[function] += count
+        return {
+            'samples': self.samples,
+            'interval_ms': round(self.interval * 1000, 3),
+            'functions': [
+                {'function': function, 'own_samples': own[function], 'samples': count}
+                for function, count in inclusive.most_common(top)
+            ],
+            # Collapsed stacks ("outer;inner count"), the input format of flame graph tools
+            'stacks': [f"{';'.join(stack)} {count}" for stack, count in self.stacks.most_common(top)]
+        }
+
+
+class ProfileSession:
+    """One profiled request or scheduler run, from start() to finish()"""
+
+    def __init__(self, profiler: 'Profiler', kind: str, name: str, mode: str):
+        self.profiler = profiler
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.name = name
+        self.mode = mode
+        self.started_at = datetime.now()
+        self.thread_id = threading.get_ident()
+        self.notes = []
+        self.finished = False
+        self._lock = threading.Lock()
+        self._profile = None
+        self._sampler = None
+        self._token = None
+        self.root = None
+
+    def open_span(self, name: str, parent: Span) -> Span:
+        child = Span(self, name)
+        # Spans from worker threads (asyncio.to_thread) attach to the same tree
+        with self._lock:
+            parent.children.append(child)
+        return child
+
+    def start(self) -> 'ProfileSession':
+        self.root = Span(self, self.name)
+        if self.mode == 'deterministic':
+            self._start_cprofile()
+        elif self.mode == 'sample':
+            self._sampler = StackSampler(self.thread_id, self.profiler.sample_interval)
+            self._sampler.start()
+        self._token = _current_span.set(self.root)
+        return self
+
+    def finish(self) -> Optional[Dict]:
+        """Stop profiling and store the result; later calls do nothing"""
+        if self.finished:
+            return None
+        self.finished = True
+        self.root.ended = time.perf_counter()
+        if self._profile is not None:
+            self._profile.disable()
+            with _profiled_threads_lock:
+                _profiled_threads.discard(self.thread_id)
+        if self._sampler is not None:
+            self._sampler.stop()
+        try:
+            _current_span.reset(self._token)
+        except (ValueError, RuntimeError):
+            # Finished from another context (a closing response); just stop nesting under this run
+            _current_span.set(None)
+        result = self.result()
+        self.profiler.store(result)
+        return result
+
+    def result(self) -> Dict:
+        result = {
+            'id': self.id,
+            'kind': self.kind,
+            'name': self.name,
+            'mode': self.mode,
+            'started_at': self.started_at.isoformat(timespec='milliseconds'),
+            'duration_ms': round((self.root.ended - self.root.started) * 1000, 3),
+            'spans': self.root.to_dict(self.root.started),
+            'notes': self.notes
+        }
+        top = self.profiler.top_functions
+        if self._profile is not None:
+            result['functions'] = self._cprofile_functions(top)
+        if self._sampler is not None:
+            result['samples'] = self._sampler.report(top)
+        return result
+
+    def _start_cprofile(self):
+        with _profiled_threads_lock:
+            busy = self.thread_id in _profiled_threads
+            if not busy:
+                _profiled_threads.add(self.thread_id)
+        if busy:
+            self._spans_only("another profile is already running cProfile on this thread")
+            return
+        self._profile = cProfile.Profile()
+        try:
+            self._profile.enable()
+        except ValueError as e:
+            # Python 3.12+ allows one profiler per interpreter
+            self._profile = None
+            with _profiled_threads_lock:
+                _profiled_threads.discard(self.thread_id)
+            self._spans_only(str(e))
+
+    def _spans_only(self, reason: str):
+        self.mode = 'spans'
+        self.notes.append(f"No function profile: {reason}")
+
+    def _cprofile_functions(self, top: int) -> List[Dict]:
+        stats = pstats.Stats(self._profile).stats
+        # (file, line, function) -> (primitive calls, calls, own time, cumulative time, callers)
+        ranked = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:top]
+        return [
+            {
+                'function': _describe(*key),
+                'calls': calls,
+                'own_ms': round(own * 1000, 3),
+                'cumulative_ms': round(cumulative * 1000, 3)
+            }
+            for key, (_, calls, own, cumulative, _) in ranked
+        ]
+
+
+class _ScheduledRun:
+    """Context manager for a scheduler run: profiles it if armed, adds a span if already profiled"""
+
+    def __init__(self, profiler: 'Profiler', name: str):
+        self.profiler = profiler
+        self.name = name
+        self.session = None
+        self.span = None
+
+    def __enter__(self) -> Optional[ProfileSession]:
+        mode = self.profiler.take_armed('scheduler')
+        if mode is not None:
+            self.session = self.profiler.start('scheduler', self.name, mode)
+        else:
+            self.span = span(self.name).__enter__()
+        return self.session
+
+    def __exit__(self, *exc_info):
+        if self.session is not None:
+            self.session.finish()
+            logger.info(f"Profiled scheduler run {self.name}: profile {self.session.id}")
+        else:
+            self.span.__exit__(*exc_info)
+        return False
+
+
+class Profiler:
+    """Starts profile sessions on request and keeps the most recent results"""
+
+    def __init__(self, enabled: bool = None, max_entries: int = None, default_mode: str = None,
+                 sample_interval: float = None, top_functions: int = None):
+        self.enabled = enabled if enabled is not None else os.getenv('PROFILING_ENABLED', 'false').lower() == 'true'
+        self.max_entries = max_entries or int(os.getenv('PROFILE_STORE_SIZE', '50'))
+        self.default_mode = default_mode or os.getenv('PROFILE_MODE', 'deterministic')
+        if self.default_mode not in MODES:
+            raise ValueError(f"PROFILE_MODE must be one of {', '.join(MODES)}")
+        self.sample_interval = sample_interval or float(os.getenv('PROFILE_SAMPLE_INTERVAL', '0.005'))
+        self.top_functions = top_functions or int(os.getenv('PROFILE_TOP_FUNCTIONS', '40'))
+        self._profiles = OrderedDict()
+        self._armed = {}
+        self._lock = threading.Lock()
+
+    def requested_mode(self, value: Optional[str]) -> Optional[str]:
+        """Mode asked for by an X-Profile header or profile query value; None means don't profile"""
+        if not self.enabled or not value:
+            return None
+        value = value.strip().lower()
+        if value in MODES:
+            return value
+        return self.default_mode if value in _ENABLE_VALUES else None
+
+    def start(self, kind: str, name: str, mode: str = None) -> ProfileSession:
+        return ProfileSession(self, kind, name, mode or self.default_mode).start()
+
+    def arm(self, kind: str, mode: str = None) -> Dict:
+        """Profile the next run of kind (only 'scheduler' runs are armed this way)"""
+        mode = mode or self.default_mode
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {', '.join(MODES)}")
+        with self._lock:
+            self._armed[kind] = mode
+        return {'kind': kind, 'mode': mode}
+
+    def take_armed(self, kind: str) -> Optional[str]:
+        if not self._armed:
+            return None
+        with self._lock:
+            return self._armed.pop(kind, None)
+
+    def armed(self) -> Dict[str, str]:
+        with self._lock:
+            return dict(self._armed)
+
+    def scheduler_run(self, name: str) -> _ScheduledRun:
+        return _ScheduledRun(self, name)
+
+    def store(self, result: Dict):
+        with self._lock:
+            self._profiles[result['id']] = result
+            while len(self._profiles) > self.max_entries:
+                self._profiles.popitem(last=False)
+
+    def get(self, profile_id: str) -> Optional[Dict]:
+        with self._lock:
+            return self._profiles.get(profile_id)
+
+    def list(self) -> List[Dict]:
+        """Summaries of the stored profiles, newest first"""
+        with self._lock:
+            profiles = list(self._profiles.values())
+        return [
+            {key: profile[key] for key in ('id', 'kind', 'name', 'mode', 'started_at', 'duration_ms')}
+            for profile in reversed(profiles)
+        ]
+
+
+# Global profiler instance
+profiler = Profiler()
@@ -0,0 +1,260 @@
+import math
+import os
+import re
+from typing import List, Dict, NamedTuple
+import logging
+
+try:
+    import tiktoken
+except ImportError:  # Optional: exact token counts when installed, estimate otherwise
+    tiktoken = None
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PROMPT_INTRO = "You are a friendly, knowledgeable property management assistant. You speak naturally and conversationally, like you're chatting with a friend who owns rental properties."
+
+FORMATTING_RULES = """IMPORTANT FORMATTING RULES:
+- Write responses in a natural, conversational tone
+- NO markdown formatting (no **, *, #, or - symbols)
+- NO bullet points or numbered lists
+- Use plain text only, like you're having a conversation
+- Make responses feel personal and friendly
+- Use "you" and "your" to keep it conversational
+- When mentioning specific numbers, work them naturally into sentences
+- Keep responses concise but informative
+- If listing multiple items, use commas or write them in paragraph form
+
+Example good response: "Looking at your portfolio, I can see you have 3 vacant units right now. The most expensive one is unit PH2 at Luxury Towers, which could bring in $8,500 per month once rented. That's a 4-bedroom, 4-bathroom penthouse with 3,500 square feet. It's definitely your premium unit!"
+
+Answer questions directly based on the data and provide helpful insights in a conversational way. The data above only lists units in detail where they are relevant to the question; use the property rollups for everything else."""
+
+VACANCY_WORDS = ('vacant', 'empty', 'available', 'unoccupied', 'unrented')
+HIGH_RENT_WORDS = ('highest', 'most expensive', 'pays the most', 'top', 'premium', 'expensive')
+LOW_RENT_WORDS = ('lowest', 'cheapest', 'least', 'pays the least', 'bottom')
+TENANT_WORDS = ('tenant', 'tenants', 'renter', 'renters', 'resident', 'residents', 'who')
+
+_WORD_RE = re.compile(r"[a-z0-9\-]+")
+_UNIT_REF_RE = re.compile(r"(?:unit|apt|apartment|suite|#)\s*#?\s*([a-z0-9\-]+)")
+_encoder = None
+
+
+def _mentions(message: str, words: set, keywords) -> bool:
+    """Single-word keywords must match a whole word, phrases match as substrings"""
+    return any((keyword in message) if ' ' in keyword else (keyword in words) for keyword in keywords)
+
+
+def estimate_tokens(text: str) -> int:
+    """Token count for text: exact with tiktoken, otherwise ~4 characters per token"""
+    global _encoder
+    if tiktoken is not None:
+        if _encoder is None:
+            _encoder = tiktoken.get_encoding("cl100k_base")
+        return len(_encoder.encode(text))
+    return math.ceil(len(text) / 4)
+
+
+def _fmt(value) -> str:
+    """Compact number rendering: 1850 instead of 1850.0, two decimals otherwise"""
+    if isinstance(value, float):
+        return str(int(value)) if value.is_integer() else f"{value:.2f}"
+    return str(value)
+
+
+class BuiltPrompt(NamedTuple):
+    text: str
+    token_count: int
+    token_budget: int
+    detailed_properties: int
+    detailed_units: int
+    truncated: bool
+
+
+class PromptBuilder:
+    """Builds the system prompt within a token budget.
+
+    The prompt always carries the portfolio overview and a one-line rollup per
+    property in a dense pipe-separated table. Full unit rows are only added for
+    what the question points at (named properties, unit numbers, tenants,
+    vacancies, rent extremes), highest priority first, until the budget is used.
+    Small portfolios that fit entirely are included in full.
+    """
+
+    def __init__(self, token_budget: int = None):
+        self.token_budget = token_budget or int(os.getenv('PROMPT_TOKEN_BUDGET', '6000'))
+
+    def build(self, snapshot, user_message: str) -> BuiltPrompt:
+        property_data = snapshot.summary
+        base = snapshot.memo('prompt_base', lambda: self._render_base(property_data))
+        remaining = self.token_budget - base['tokens']
+
+        sections = self._select_sections(snapshot, user_message)
+        detail_lines = []
+        detailed_properties = set()
+        detailed_units = 0
+        truncated = base['truncated']
+
+        for title, rows in sections:
+            if not rows:
+                continue
+            header = f"\n{title} (property | unit | bed | bath | sqft | rent | tenant or VACANT):"
+            header_tokens = estimate_tokens(header)
+            if header_tokens >= remaining:
+                truncated = True
+                break
+            section_lines = [header]
+            section_tokens = header_tokens
+            added = 0
+            for prop_name, unit in rows:
+                line = self._unit_row(prop_name, unit)
+                line_tokens = estimate_tokens(line) + 1
+                if section_tokens + line_tokens > remaining:
+                    truncated = True
+                    break
+                section_lines.append(line)
+                section_tokens += line_tokens
+                detailed_properties.add(prop_name)
+                added += 1
+            if added < len(rows):
+                note = f"({len(rows) - added} more units not shown)"
+                section_lines.append(note)
+                section_tokens += estimate_tokens(note)
+            if added:
+                detail_lines.extend(section_lines)
+                detailed_units += added
+                remaining -= section_tokens
+            if remaining <= 0:
+                break
+
+        text = "\n".join([base['text']] + detail_lines + ["", FORMATTING_RULES])
+        token_count = estimate_tokens(text)
+        logger.info(f"Built prompt with {token_count} tokens (budget {self.token_budget}, {detailed_units} unit rows)")
+        return BuiltPrompt(
+            text=text,
+            token_count=token_count,
+            token_budget=self.token_budget,
+            detailed_properties=len(detailed_properties),
+            detailed_units=detailed_units,
+            truncated=truncated
+        )
+
+    def _render_base(self, property_data: Dict) -> Dict:
+        """Overview plus per-property rollups; independent of the question"""
+        lines = [
+            PROMPT_INTRO,
+            "",
+            "Current Portfolio Overview:",
+            f"- Total Properties: {property_data['total_properties']}",
+            f"- Total Units: {property_data['total_units']}",
+            f"- Occupied Units: {property_data['occupied_units']}",
+            f"- Vacant Units: {property_data['vacant_units']}",
+            f"- Occupancy Rate: {property_data['occupancy_rate']}%",
+            f"- Monthly Revenue: ${property_data['monthly_revenue']:,.2f}",
+            f"- Annual Revenue: ${property_data['annual_revenue']:,.2f}",
+            "",
+            "Property rollups (name | address | units | occupied | occupancy % | monthly revenue):"
+        ]
+        reserved = estimate_tokens(FORMATTING_RULES)
+        tokens = estimate_tokens("\n".join(lines)) + reserved
+        # Rollups get at most half the budget so there is room left for unit detail
+        rollup_budget = self.token_budget // 2
+
+        properties = sorted(property_data.get('properties', []),
+                            key=lambda prop: prop.get('monthly_revenue', 0), reverse=True)
+        used = 0
+        shown = 0
+        for prop in properties:
+            occupied = round(prop.get('occupancy_rate', 0) * prop.get('total_units', 0) / 100)
+            line = " | ".join([
+                str(prop.get('name')),
+                str(prop.get('address')),
+                str(prop.get('total_units', 0)),
+                str(occupied),
+                _fmt(prop.get('occupancy_rate', 0)),
+                _fmt(float(prop.get('monthly_revenue', 0)))
+            ])
+            line_tokens = estimate_tokens(line) + 1
+            if used + line_tokens > rollup_budget:
+                break
+            lines.append(line)
+            used += line_tokens
+            shown += 1
+
+        truncated = shown < len(properties)
+        if truncated:
+            hidden = properties[shown:]
+            hidden_revenue = sum(prop.get('monthly_revenue', 0) for prop in hidden)
+            hidden_units = sum(prop.get('total_units', 0) for prop in hidden)
+            line = f"... and {len(hidden)} smaller properties with {hidden_units} units and ${hidden_revenue:,.2f} monthly revenue"
+            lines.append(line)
+            used += estimate_tokens(line)
+
+        text = "\n".join(lines)
+        return {'text': text, 'tokens': tokens + used, 'truncated': truncated}
+
+    def _select_sections(self, snapshot, user_message: str):
+        """Yield unit detail sections in priority order for this question"""
+        property_data = snapshot.summary
+        properties = property_data.get('properties', [])
+        message = user_message.lower()
+        words = set(_WORD_RE.findall(message))
+        unit_refs = set(_UNIT_REF_RE.findall(message))
+        seen = set()
+
+        def fresh(rows):
+            rows = [(name, unit) for name, unit in rows if (name, str(unit.get('number'))) not in seen]
+            seen.update((name, str(unit.get('number'))) for name, unit in rows)
+            return rows
+
+        named_properties = [prop for prop in properties
+                            if prop.get('name') and str(prop.get('name')).lower() in message]
+
+        # Units or tenants named explicitly; unit numbers repeat across buildings,
+        # so when the question names a property only look for the unit there
+        named_units = []
+        for prop in named_properties or properties:
+            for unit in prop.get('units', []):
+                number = str(unit.get('number', '')).lower()
+                tenant = (unit.get('tenant_name') or '').lower()
+                if number in unit_refs or (tenant and tenant in message):
+                    named_units.append((prop.get('name'), unit))
+        yield "Units mentioned in the question", fresh(named_units)
+
+        # Properties named explicitly
+        for prop in named_properties:
+            yield f"Units at {prop.get('name')}", fresh([(prop.get('name'), unit) for unit in prop.get('units', [])])
+
+        units_by_rent = snapshot.memo('units_by_rent', lambda: self._units_by_rent(properties))
+        if _mentions(message, words, VACANCY_WORDS):
+            yield "Vacant units by rent", fresh([row for row in units_by_rent if not row[1].get('is_occupied')])
+        if _mentions(message, words, HIGH_RENT_WORDS):
+            yield "Highest-rent units", fresh(units_by_rent[:25])
+        if _mentions(message, words, LOW_RENT_WORDS):
+            yield "Lowest-rent units", fresh([row for row in reversed(units_by_rent) if row[1].get('rent', 0) > 0][:25])
+        if _mentions(message, words, TENANT_WORDS):
+            yield "Occupied units by rent", fresh([row for row in units_by_rent if row[1].get('is_occupied')])
+
+        # Whatever is left, property by property, for as long as the budget lasts
+        for prop in properties:
+            yield f"Units at {prop.get('name')}", fresh([(prop.get('name'), unit) for unit in prop.get('units', [])])
+
+    def _units_by_rent(self, properties: List[Dict]) -> List:
+        rows = [(prop.get('name'), unit) for prop in properties for unit in prop.get('units', [])]
+        rows.sort(key=lambda row: row[1].get('rent', 0), reverse=True)
+        return rows
+
+    def _unit_row(self, prop_name: str, unit: Dict) -> str:
+        return " | ".join([
+            str(prop_name),
+            str(unit.get('number')),
+            _fmt(unit.get('bedrooms', 0)),
+            _fmt(unit.get('bathrooms', 0)),
+            _fmt(unit.get('square_feet', 0)),
+            _fmt(unit.get('rent', 0)),
+            unit.get('tenant_name') or 'VACANT'
+        ])
+
+
+# Global prompt builder instance
+prompt_builder = PromptBuilder()
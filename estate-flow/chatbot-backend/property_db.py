@@ -0,0 +1,269 @@
+"""Indexed SQLite store of properties, units and tenants for the rent scheduler.
+
+The tables mirror database_setup.sql. Tenants also carry rent_due_day
+(default 1, the day of the month rent is due) and an optional
+grace_period_days override, because the Supabase schema has no due date. The scheduler's
+due-date index is loaded with one select that reads only unpaid tenants,
+through (rent_paid, rent_due_day), and leases that haven't ended yet,
+through a range scan on lease_end, rather than every tenant.
+
+Convert an existing properties_data.json with:
+
+    python property_db.py import properties_data.json [--db properties.db]
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+from datetime import date, datetime
+from typing import Dict, List, Optional
+import logging
+from portfolio_engine import parse_rent, to_number
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS properties (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    address TEXT NOT NULL DEFAULT '',
+    num_units INTEGER DEFAULT 1,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS units (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    property_id INTEGER REFERENCES properties(id) ON DELETE CASCADE,
+    unit_number TEXT NOT NULL,
+    bedrooms INTEGER DEFAULT 1,
+    bathrooms INTEGER DEFAULT 1,
+    square_feet INTEGER,
+    rent_amount REAL,
+    is_occupied INTEGER DEFAULT 0,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS tenants (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    unit_id INTEGER REFERENCES units(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    email TEXT,
+    phone TEXT,
+    lease_start TEXT,
+    lease_end TEXT,
+    rent_paid INTEGER DEFAULT 0,
+    rent_due_day INTEGER NOT NULL DEFAULT 1 CHECK (rent_due_day BETWEEN 1 AND 28),
+    grace_period_days INTEGER,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS store_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_units_property_id ON units(property_id);
+CREATE INDEX IF NOT EXISTS idx_tenants_unit_id ON tenants(unit_id);
+CREATE INDEX IF NOT EXISTS idx_properties_created_at ON properties(created_at);
+CREATE INDEX IF NOT EXISTS idx_units_is_occupied ON units(is_occupied);
+CREATE INDEX IF NOT EXISTS idx_tenants_rent_paid_due_day ON tenants(rent_paid, rent_due_day);
+CREATE INDEX IF NOT EXISTS idx_tenants_lease_end ON tenants(lease_end);
+"""
+
+# Tenant rows joined with their unit and property, in the shape the scheduler and email templates use
+TENANT_SELECT = """
+SELECT p.name AS property_name, u.unit_number, t.name AS tenant_name, t.email AS tenant_email,
+       t.phone AS tenant_phone, u.rent_amount AS rent, t.rent_due_day, t.grace_period_days,
+       t.lease_end, t.rent_paid
+FROM tenants t
+JOIN units u ON u.id = t.unit_id
+JOIN properties p ON p.id = u.property_id
+"""
+
+DATE_FORMATS = ('%Y-%m-%d', '%m/%d/%Y', '%m/%d/%y', '%Y/%m/%d', '%d.%m.%Y')
+
+
+def _iso_date(value) -> Optional[str]:
+    """Lease dates as YYYY-MM-DD so they sort and range-scan correctly; None if unparseable"""
+    if not value:
+        return None
+    text = str(value).strip().split('T')[0]
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, date_format).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+def _grace_days(*candidates) -> Optional[int]:
+    for value in candidates:
+        if value not in (None, ''):
+            return max(0, int(to_number(value)))
+    return None
+
+
+def _due_day(*candidates) -> int:
+    for value in candidates:
+        day = int(to_number(value)) if value not in (None, '') else 0
+        if day:
+            return min(28, max(1, day))
+    return 1
+
+
+class PropertyDatabase:
+    """SQLite-backed properties/units/tenants store with the scheduler's lookups indexed"""
+
+    def __init__(self, path: str = None):
+        self.path = path or os.getenv('PROPERTY_DB_PATH', 'properties.db')
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(SCHEMA)
+        # Stores created before per-tenant grace periods existed
+        columns = {row['name'] for row in self._conn.execute("PRAGMA table_info(tenants)")}
+        if 'grace_period_days' not in columns:
+            self._conn.execute("ALTER TABLE tenants ADD COLUMN grace_period_days INTEGER")
+        self._writes = 0
+
+    def import_properties(self, properties: List[Dict]) -> Dict:
+        """Replace the store's contents with a properties list in the frontend's JSON shape"""
+        counts = {'properties': 0, 'units': 0, 'tenants': 0}
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM tenants")
+                self._conn.execute("DELETE FROM units")
+                self._conn.execute("DELETE FROM properties")
+                for prop in properties:
+                    units = prop.get('units', []) or []
+                    property_id = self._conn.execute(
+                        "INSERT INTO properties (name, address, num_units) VALUES (?, ?, ?)",
+                        (prop.get('name', 'Unknown Property'), prop.get('address', '') or '', len(units) or 1)
+                    ).lastrowid
+                    counts['properties'] += 1
+                    for unit in units:
+                        tenant = unit.get('tenant') if isinstance(unit.get('tenant'), dict) else None
+                        unit_id = self._conn.execute(
+                            "INSERT INTO units (property_id, unit_number, bedrooms, bathrooms, square_feet, rent_amount, is_occupied) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            (property_id, str(unit.get('number', 'N/A')), int(to_number(unit.get('bedrooms', 1))),
+                             int(to_number(unit.get('bathrooms', 1))),
+                             int(to_number(unit.get('squareFeet', unit.get('square_feet', 0)))) or None,
+                             parse_rent(unit.get('rent', 0)), int(bool(tenant and tenant.get('name'))))
+                        ).lastrowid
+                        counts['units'] += 1
+                        if not tenant:
+                            continue
+                        self._conn.execute(
+                            "INSERT INTO tenants (unit_id, name, email, phone, lease_start, lease_end, rent_paid, rent_due_day, grace_period_days) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            (unit_id, tenant.get('name') or 'Unknown', tenant.get('email', ''), tenant.get('phone', ''),
+                             _iso_date(tenant.get('leaseStart', tenant.get('lease_start'))),
+                             _iso_date(tenant.get('leaseEnd', tenant.get('lease_end'))),
+                             int(bool(unit.get('rentPaid', False) or tenant.get('rentPaid', False))),
+                             _due_day(tenant.get('rentDueDay'), unit.get('rentDueDay')),
+                             _grace_days(tenant.get('gracePeriodDays'), unit.get('gracePeriodDays')))
+                        )
+                        counts['tenants'] += 1
+                self._conn.execute("COMMIT")
+                self._writes += 1
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        logger.info(f"Imported {counts['properties']} properties, {counts['units']} units, {counts['tenants']} tenants into {self.path}")
+        return counts
+
+    def import_json(self, json_path: str) -> Dict:
+        with open(json_path, 'r') as file:
+            counts = self.import_properties(json.load(file))
+        self.set_meta(f"imported_mtime:{os.path.abspath(json_path)}", str(os.path.getmtime(json_path)))
+        return counts
+
+    def sync_from_json(self, json_path: str) -> bool:
+        """Re-import json_path if it changed since the last import; True if it was imported"""
+        if not os.path.exists(json_path):
+            return False
+        mtime = str(os.path.getmtime(json_path))
+        if self.get_meta(f"imported_mtime:{os.path.abspath(json_path)}") == mtime:
+            return False
+        self.import_json(json_path)
+        return True
+
+    def scheduled_tenants(self, lease_end_from: date) -> List[Dict]:
+        """Tenants a rent check can be about: unpaid, or with a lease ending on or after lease_end_from.
+
+        In insertion order. Each half is an indexed select, so paid tenants
+        with past or unknown lease ends are never read.
+        """
+        return self._tenants(
+            "WHERE t.id IN (SELECT id FROM tenants WHERE rent_paid = 0 "
+            "UNION ALL SELECT id FROM tenants WHERE lease_end >= ?) ORDER BY t.id",
+            (lease_end_from.isoformat(),)
+        )
+
+    def revision(self) -> tuple:
+        """Changes whenever the tenant data may have changed, in this process or another"""
+        with self._lock:
+            return self._writes, self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def mark_rent_paid(self, property_name: str, unit_number: str, paid: bool = True) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE tenants SET rent_paid = ?, updated_at = CURRENT_TIMESTAMP WHERE unit_id IN ("
+                "SELECT u.id FROM units u JOIN properties p ON p.id = u.property_id WHERE p.name = ? AND u.unit_number = ?)",
+                (int(paid), property_name, str(unit_number))
+            )
+            self._writes += 1
+            return cursor.rowcount
+
+    def counts(self) -> Dict:
+        with self._lock:
+            return {
+                table: self._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ('properties', 'units', 'tenants')
+            }
+
+    def get_meta(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM store_meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO store_meta (key, value) VALUES (?, ?)", (key, value))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _tenants(self, where: str, params: tuple) -> List[Dict]:
+        with self._lock:
+            rows = self._conn.execute(f"{TENANT_SELECT} {where}", params).fetchall()
+        return [dict(row) for row in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the scheduler's SQLite property store")
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    import_parser = subcommands.add_parser('import', help='Replace the store with the contents of a properties JSON file')
+    import_parser.add_argument('json_path', nargs='?', default='properties_data.json')
+    import_parser.add_argument('--db', default=None, help='SQLite file (default: PROPERTY_DB_PATH or properties.db)')
+    args = parser.parse_args()
+
+    if args.command == 'import':
+        database = PropertyDatabase(args.db)
+        counts = database.import_json(args.json_path)
+        print(f"Imported {counts['properties']} properties, {counts['units']} units and {counts['tenants']} tenants into {database.path}")
+
+
+if __name__ == '__main__':
+    main()
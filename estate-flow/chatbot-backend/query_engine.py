@@ -0,0 +1,517 @@
+import re
+from typing import List, Optional, NamedTuple
+import numpy as np
+import logging
+from ranking_index import PortfolioIndex, ordering_name
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Intent phrases, checked in order; the first match wins
+INTENT_PHRASES = [
+    ('most_expensive_vacant', ['most expensive vacant', 'highest rent vacant', 'expensive vacant',
+                               'priciest vacant', 'most expensive empty', 'most expensive available']),
+    ('highest_rent_tenant', ['highest rent', 'most rent', 'pays the most', 'highest paying']),
+    ('lowest_rent_tenant', ['lowest rent', 'least rent', 'pays the least', 'cheapest', 'lowest paying']),
+    ('average_rent', ['average rent', 'avg rent', 'mean rent', 'typical rent']),
+    ('list_vacant', ['vacant units', 'empty units', 'available units', 'units are vacant',
+                     'units are empty', 'units are available', 'vacancies', 'list vacant', 'which vacant']),
+    ('best_property', ['which property', 'best property', 'most revenue property', 'top property',
+                       'best performing', 'top performing', 'property makes the most', 'property earns the most']),
+    ('occupancy', ['occupancy', 'occupied', 'how many vacant', 'how full']),
+    ('revenue', ['revenue', 'income', 'how much money', 'how much do i make', 'how much rent do i collect']),
+    ('count_units', ['how many units', 'how many properties', 'how many tenants', 'number of units',
+                     'number of tenants', 'unit count']),
+]
+
+# Wording that signals an open-ended question the LLM should handle
+OPEN_ENDED_MARKERS = ['improve', 'should', 'why', 'suggest', 'recommend', 'advice', 'strategy',
+                      'how can', 'how do i', 'what if', 'compare', 'market', 'raise', 'increase',
+                      'optimize', 'explain', 'predict', 'forecast', 'worth', 'trend', 'tips']
+
+_AMOUNT = r"\$?\s*(\d[\d,]*(?:\.\d+)?)\s*(k)?"
+_BETWEEN_RE = re.compile(r"between\s+" + _AMOUNT + r"\s+(?:and|to|-)\s+" + _AMOUNT)
+_RANGE_RE = re.compile(r"\$\s*(\d[\d,]*(?:\.\d+)?)\s*(k)?\s*(?:-|to)\s*" + _AMOUNT)
+_MAX_RE = re.compile(r"(?:under|below|less than|cheaper than|at most|up to|<)\s*" + _AMOUNT)
+_MIN_RE = re.compile(r"(?:over|above|more than|greater than|at least|>)\s*" + _AMOUNT)
+# An amount only bounds the rent with a $ or when the question is about rent or price,
+# and never when it is followed by another unit ("over 1000 square feet", "above 90%")
+_RENT_WORD_RE = re.compile(r"\b(?:rents?|renting|rented for|price[ds]?|pricing|costs?|per month|a month|monthly)\b|/\s*mo")
+_OTHER_UNIT_RE = re.compile(r"\s*(?:%|percent|sq|square|ft|feet|foot|bed|br\b|bd\b|bath|units?\b|tenants?\b|"
+                            r"propert|years?\b|months?\b|days?\b)")
+_BEDROOM_RE = re.compile(r"(?:\b(more than|over|above|greater than|at least|under|below|less than|fewer than|"
+                         r"at most|up to)\s+)?\b(\d+)\s*(\+|or more|or fewer|or less)?\s*(?:-|\s)?\s*"
+                         r"(?:bed(?:room)?s?|br|bd)\b(\s+or\s+(?:more|fewer|less))?")
+_STUDIO_RE = re.compile(r"\bstudios?\b")
+# Left over once every recognized part of the question is taken out, these mean it
+# qualifies or compares something the planner doesn't model
+_UNPARSED_RE = re.compile(r"\d|\b(?:more|less|fewer|than|over|under|above|below|at least|at most|between|"
+                          r"versus|vs|compared?|bigger|smaller|larger|older|newer)\b")
+_SUPERLATIVE_WORDS = {'most', 'least', 'fewest', 'highest', 'lowest', 'best', 'worst', 'top', 'bottom',
+                      'cheapest', 'priciest', 'biggest', 'largest', 'smallest'}
+_PROPERTY_SUBJECT_RE = re.compile(r"\b(?:which|what)\s+(?:property|properties|building|buildings)\b")
+_PERFORMANCE_WORDS = {'best', 'top', 'perform', 'performs', 'performing', 'performance', 'revenue', 'income',
+                      'earns', 'makes', 'money'}
+_UNIT_METRIC_WORDS = {'units', 'tenants', 'bedrooms', 'bedroom', 'occupancy', 'occupied', 'vacancies', 'worst',
+                      'least', 'lowest', 'fewest', 'rent', 'rents'}
+
+# "top 10 ...", "5 cheapest ...": ranked unit listings need an explicit count
+_RANKED_RE = re.compile(r"\b(?:(top|bottom|highest|lowest|cheapest|most expensive|priciest|least expensive)\s+(\d+)"
+                        r"|(\d+)\s+(top|bottom|highest|lowest|cheapest|most expensive|priciest|least expensive))\b")
+_RANKED_NOUN_RE = re.compile(r"\b(?:units?|apartments?|rentals?|listings?|tenants?|renters?)\b")
+_RANK_RE = re.compile(r"\b(?:rank|ranks|ranked|ranking)\b")
+_UNIT_REF_RE = re.compile(r"(?:\b(?:unit|apt|apartment|suite)\b|#)\s*#?\s*([a-z\-]*\d[a-z0-9\-]*)")
+_PER_SQFT_RE = re.compile(r"per\s+(?:square\s+(?:foot|feet)|sq\.?\s*ft|sqft|foot)|/\s*sq\.?\s*ft|\bpsf\b")
+_VACANT_WORDS = {'vacant', 'empty', 'available', 'unoccupied', 'unrented'}
+_OCCUPIED_WORDS = {'occupied', 'rented', 'leased', 'tenant', 'tenants', 'renter', 'renters'}
+_ASCENDING_WORDS = {'bottom', 'lowest', 'cheapest', 'least expensive'}
+
+# Intents answered from the ranking index rather than the frame columns
+RANKED_INTENTS = ('ranked_units', 'unit_rank')
+MAX_RANKED_UNITS = 25
+
+
+def _amount(number: str, thousands: Optional[str]) -> float:
+    value = float(number.replace(',', ''))
+    return value * 1000 if thousands else value
+
+
+class StructuredQuery(NamedTuple):
+    intent: str
+    property_names: List[str]
+    min_bedrooms: Optional[int]
+    max_bedrooms: Optional[int]
+    min_rent: Optional[float]
+    max_rent: Optional[float]
+    limit: Optional[int] = None
+    metric: str = 'rent'
+    descending: bool = True
+    status: Optional[str] = None
+    unit_number: Optional[str] = None
+
+    def has_filters(self) -> bool:
+        return bool(self.property_names) or self.min_bedrooms is not None or self.max_bedrooms is not None \
+            or self.min_rent is not None or self.max_rent is not None
+
+
+def _bedroom_bounds(match) -> tuple:
+    """(min, max) bedrooms for "2 bedroom", "more than 2 bedrooms", "2+ beds", "3 bedrooms or fewer"""
+    comparator, count, suffix, trailing = match.group(1), int(match.group(2)), match.group(3), match.group(4)
+    direction = (suffix or trailing or '').strip()
+    if comparator in ('more than', 'over', 'above', 'greater than'):
+        return count + 1, None
+    if comparator == 'at least' or direction in ('+', 'or more'):
+        return count, None
+    if comparator in ('under', 'below', 'less than', 'fewer than'):
+        return None, count - 1
+    if comparator in ('at most', 'up to') or direction.endswith(('fewer', 'less')):
+        return None, count
+    return count, count
+
+
+def _blank(text: str, match) -> str:
+    """text with the match replaced by spaces, so positions stay put"""
+    return text[:match.start()] + ' ' * (match.end() - match.start()) + text[match.end():]
+
+
+class QueryPlanner:
+    """Turns common analytic questions into structured aggregate queries.
+
+    Only questions with an exact, data-derived answer are planned; anything
+    that reads as open-ended (advice, comparisons with the market, "why")
+    returns None so it can go to the LLM. So does anything only partly
+    understood: a number or comparison the planner can't place, a question
+    about one particular unit, or a comparison across properties other than
+    by revenue.
+    """
+
+    def plan(self, user_message: str, property_names: List[str]) -> Optional[StructuredQuery]:
+        message = user_message.lower()
+
+        if any(marker in message for marker in OPEN_ENDED_MARKERS):
+            return None
+
+        # Recognized parts are blanked out of `rest`; whatever qualifier is left wasn't understood
+        rest = message
+        intent = None
+        limit = unit_number = None
+        ranked = _RANKED_RE.search(message)
+        unit_ref = _UNIT_REF_RE.search(message)
+        if _RANK_RE.search(message) and unit_ref:
+            intent, unit_number = 'unit_rank', unit_ref.group(1)
+            rest = _blank(rest, unit_ref)
+        elif unit_ref:
+            # "Is unit 101 occupied?" asks about one unit, not the portfolio
+            return None
+        elif ranked and _RANKED_NOUN_RE.search(message):
+            intent = 'ranked_units'
+            limit = min(int(ranked.group(2) or ranked.group(3)), MAX_RANKED_UNITS)
+            rest = _blank(rest, ranked)
+        else:
+            for candidate, phrases in INTENT_PHRASES:
+                if any(phrase in message for phrase in phrases):
+                    intent = candidate
+                    break
+        if intent is None:
+            return None
+
+        mentioned = [name for name in property_names if name and name.lower() in message]
+        # Prefer the longest names so "Oak Court" doesn't also match inside "Oak Court East"
+        mentioned.sort(key=len, reverse=True)
+        named = []
+        for name in mentioned:
+            if not any(name.lower() in other.lower() for other in named):
+                named.append(name)
+        named.sort(key=lambda name: message.index(name.lower()))
+        for name in named:
+            rest = rest.replace(name.lower(), ' ' * len(name))
+
+        min_bedrooms = max_bedrooms = None
+        bedroom_match = _BEDROOM_RE.search(rest)
+        if bedroom_match:
+            min_bedrooms, max_bedrooms = _bedroom_bounds(bedroom_match)
+            rest = _blank(rest, bedroom_match)
+        elif _STUDIO_RE.search(rest):
+            min_bedrooms = max_bedrooms = 0
+
+        min_rent = max_rent = None
+        about_rent = bool(_RENT_WORD_RE.search(message))
+        between = _BETWEEN_RE.search(rest) or _RANGE_RE.search(rest)
+        if between and self._bounds_rent(between, rest, about_rent):
+            low = _amount(between.group(1), between.group(2))
+            high = _amount(between.group(3), between.group(4))
+            min_rent, max_rent = min(low, high), max(low, high)
+            rest = _blank(rest, between)
+        else:
+            upper = _MAX_RE.search(rest)
+            if upper and self._bounds_rent(upper, rest, about_rent):
+                max_rent = _amount(upper.group(1), upper.group(2))
+                rest = _blank(rest, upper)
+            lower = _MIN_RE.search(rest)
+            if lower and self._bounds_rent(lower, rest, about_rent):
+                min_rent = _amount(lower.group(1), lower.group(2))
+                rest = _blank(rest, lower)
+
+        if _UNPARSED_RE.search(rest):
+            return None
+
+        words = set(re.findall(r"[a-z]+", message))
+        # Superlatives are read from what's left, so "at least 3 bedrooms" isn't one
+        if not self._answers_the_question(intent, message, set(re.findall(r"[a-z]+", rest))):
+            return None
+
+        status = None
+        if words & _VACANT_WORDS:
+            status = 'vacant'
+        elif words & _OCCUPIED_WORDS:
+            status = 'occupied'
+
+        # "Cheapest vacant unit" is about listings, not what tenants pay
+        if status == 'vacant' and intent == 'highest_rent_tenant':
+            intent = 'most_expensive_vacant'
+        elif status == 'vacant' and intent == 'lowest_rent_tenant':
+            intent = 'cheapest_vacant'
+
+        return StructuredQuery(
+            intent, named, min_bedrooms, max_bedrooms, min_rent, max_rent,
+            limit=limit,
+            metric='rent_per_sqft' if _PER_SQFT_RE.search(message) else 'rent',
+            descending=not (ranked and (ranked.group(1) or ranked.group(4)) in _ASCENDING_WORDS),
+            status=status,
+            unit_number=unit_number
+        )
+
+    def _bounds_rent(self, match, text: str, about_rent: bool) -> bool:
+        """Whether a matched amount is a rent bound rather than a count, size or percentage"""
+        if _OTHER_UNIT_RE.match(text, match.end()):
+            return False
+        return '$' in match.group(0) or about_rent
+
+    def _answers_the_question(self, intent: str, message: str, words: set) -> bool:
+        """False when the intent's answer would miss what a superlative or comparison asks for"""
+        if intent == 'best_property':
+            # Ranked by revenue, so only when the question is about performance
+            return bool(words & _PERFORMANCE_WORDS) and not (words & (_UNIT_METRIC_WORDS | _VACANT_WORDS))
+        if _PROPERTY_SUBJECT_RE.search(message):
+            # "Which property has the most vacant units?" compares properties on something else
+            return False
+        if intent in ('list_vacant', 'occupancy', 'revenue', 'count_units', 'average_rent'):
+            return not (words & _SUPERLATIVE_WORDS)
+        return True
+
+
+class QueryEngine:
+    """Executes structured queries directly on a PortfolioFrame's columns.
+
+    Ranked-unit questions without filters read straight off the portfolio's
+    ranking index (O(log n + k)); filtered ones rank the masked columns.
+    """
+
+    def execute(self, query: StructuredQuery, frame, index=None) -> str:
+        handler = getattr(self, f"_{query.intent}")
+        if query.intent in RANKED_INTENTS:
+            return handler(frame, index, query)
+        return handler(frame, self._mask(query, frame), query)
+
+    def _mask(self, query: StructuredQuery, frame) -> np.ndarray:
+        mask = np.ones(frame.total_units, dtype=bool)
+        if query.property_names:
+            wanted = [idx for idx, name in enumerate(frame.names) if name in query.property_names]
+            mask &= np.isin(frame.property_index, wanted)
+        if query.min_bedrooms is not None:
+            mask &= frame.bedrooms >= query.min_bedrooms
+        if query.max_bedrooms is not None:
+            mask &= frame.bedrooms <= query.max_bedrooms
+        if query.min_rent is not None:
+            mask &= frame.rent >= query.min_rent
+        if query.max_rent is not None:
+            mask &= frame.rent <= query.max_rent
+        return mask
+
+    def _units_phrase(self, query: StructuredQuery, adjective: str = "", plural: bool = True) -> str:
+        """Filters rendered as a noun phrase, e.g. 'vacant 2 bedroom units at Oak Court'"""
+        words = [adjective] if adjective else []
+        low, high = query.min_bedrooms, query.max_bedrooms
+        if low is not None and low == high:
+            words.append("studio" if low == 0 else f"{low} bedroom")
+        words.append("units" if plural else "unit")
+        if low != high:
+            if high is None:
+                words.append(f"with {low} or more bedrooms")
+            elif low is None:
+                words.append("with no bedrooms" if high <= 0 else f"with at most {high} bedrooms")
+            else:
+                words.append(f"with {low} to {high} bedrooms")
+        if query.property_names:
+            words.append("at " + " and ".join(query.property_names))
+        if query.min_rent is not None and query.max_rent is not None:
+            words.append(f"renting between ${query.min_rent:,.0f} and ${query.max_rent:,.0f}")
+        elif query.min_rent is not None:
+            words.append(f"renting for at least ${query.min_rent:,.0f}")
+        elif query.max_rent is not None:
+            words.append(f"renting for at most ${query.max_rent:,.0f}")
+        return " ".join(words)
+
+    def _among(self, query: StructuredQuery) -> str:
+        return f" among {self._units_phrase(query)}" if query.has_filters() else ""
+
+    def _unit_label(self, frame, row: int) -> str:
+        return f"unit {frame.unit_numbers[row]} at {frame.names[frame.property_index[row]]}"
+
+    def _highest_rent_tenant(self, frame, mask, query) -> str:
+        candidates = np.flatnonzero(mask & frame.occupied & (frame.rent > 0))
+        if candidates.size == 0:
+            return f"I couldn't find any occupied units with tenant information to compare rents{self._among(query)}."
+        row = candidates[np.argmax(frame.rent[candidates])]
+        return f"The tenant who pays the most rent{self._among(query)} is {frame.tenant_names[row]} in {self._unit_label(frame, row)}. They pay ${frame.rent[row]:,.2f} per month."
+
+    def _lowest_rent_tenant(self, frame, mask, query) -> str:
+        candidates = np.flatnonzero(mask & frame.occupied & (frame.rent > 0))
+        if candidates.size == 0:
+            return f"I couldn't find any occupied units with tenant information to compare rents{self._among(query)}."
+        row = candidates[np.argmin(frame.rent[candidates])]
+        return f"The tenant who pays the least rent{self._among(query)} is {frame.tenant_names[row]} in {self._unit_label(frame, row)}. They pay ${frame.rent[row]:,.2f} per month."
+
+    def _no_vacancies(self, query) -> str:
+        if query.has_filters():
+            return f"You don't have any {self._units_phrase(query, 'vacant')} right now."
+        return "Great news! You have no vacant units. All your properties are fully occupied."
+
+    def _most_expensive_vacant(self, frame, mask, query) -> str:
+        candidates = np.flatnonzero(mask & ~frame.occupied & (frame.rent > 0))
+        if candidates.size == 0:
+            return self._no_vacancies(query)
+        row = candidates[np.argmax(frame.rent[candidates])]
+        response = f"The most expensive vacant unit{self._among(query)} is {self._unit_label(frame, row)}. "
+        response += f"This is a {frame.raw_bedrooms[row]} bedroom, {frame.raw_bathrooms[row]} bathroom unit with {int(frame.sqft[row]):,} square feet. "
+        response += f"It could rent for ${frame.rent[row]:,.2f} per month."
+        return response
+
+    def _cheapest_vacant(self, frame, mask, query) -> str:
+        candidates = np.flatnonzero(mask & ~frame.occupied & (frame.rent > 0))
+        if candidates.size == 0:
+            return self._no_vacancies(query)
+        row = candidates[np.argmin(frame.rent[candidates])]
+        response = f"The least expensive vacant unit{self._among(query)} is {self._unit_label(frame, row)}. "
+        response += f"This is a {frame.raw_bedrooms[row]} bedroom, {frame.raw_bathrooms[row]} bathroom unit with {int(frame.sqft[row]):,} square feet. "
+        response += f"It's listed at ${frame.rent[row]:,.2f} per month."
+        return response
+
+    def _list_vacant(self, frame, mask, query) -> str:
+        rows = np.flatnonzero(mask & ~frame.occupied)
+        if rows.size == 0:
+            return self._no_vacancies(query)
+
+        if rows.size == 1:
+            row = rows[0]
+            response = f"You have 1 {self._units_phrase(query, 'vacant', plural=False)}: {self._unit_label(frame, row)}. It's a {frame.raw_bedrooms[row]} bedroom, {frame.raw_bathrooms[row]} bathroom unit that could rent for ${frame.rent[row]:,.2f} per month."
+        else:
+            response = f"You have {rows.size} {self._units_phrase(query, 'vacant')}. "
+            descriptions = [f"{self._unit_label(frame, row)} (${frame.rent[row]:,.2f}/month)" for row in rows[:3]]
+            if rows.size <= 3:
+                response += "They are: " + ", ".join(descriptions) + "."
+            else:
+                response += "The main ones are: " + ", ".join(descriptions) + f", and {rows.size - 3} others."
+
+        potential_revenue = float(frame.rent[rows].sum())
+        response += f" If you fill them all, you could add ${potential_revenue:,.2f} to your monthly revenue."
+        return response
+
+    def _best_property(self, frame, mask, query) -> str:
+        if frame.total_properties == 0:
+            return "I don't have any property data to analyze performance right now."
+        revenue = np.bincount(frame.property_index, weights=np.where(mask & frame.occupied, frame.rent, 0.0),
+                              minlength=frame.total_properties)
+        rates = frame.property_occupancy_rates()
+        order = np.argsort(-revenue, kind='stable').tolist()
+        if query.property_names:
+            order = [idx for idx in order if frame.names[idx] in query.property_names]
+        counting = f", counting only {self._units_phrase(query)}," if query.has_filters() else ""
+
+        if len(order) == 1:
+            idx = order[0]
+            source = f" from {self._units_phrase(query)}" if query.has_filters() else ""
+            return f"You have one property, {frame.names[idx]}, which generates ${revenue[idx]:,.2f} per month{source} with a {round(rates[idx], 1)}% occupancy rate."
+
+        best = order[0]
+        response = f"Your top performing property{counting} is {frame.names[best]}, generating ${revenue[best]:,.2f} monthly with {round(rates[best], 1)}% occupancy."
+        if len(order) >= 2:
+            second = order[1]
+            response += f" Your second best is {frame.names[second]} at ${revenue[second]:,.2f} monthly."
+        if len(order) >= 3:
+            third = order[2]
+            response += f" Third place goes to {frame.names[third]} with ${revenue[third]:,.2f} monthly."
+        return response
+
+    def _occupancy(self, frame, mask, query) -> str:
+        total = int(np.count_nonzero(mask))
+        occupied = int(np.count_nonzero(mask & frame.occupied))
+        rate = round(occupied / total * 100, 1) if total else 0
+        if query.has_filters():
+            return f"Your occupancy rate for {self._units_phrase(query)} is {rate}%. {total - occupied} of those {total} units are vacant."
+        response = f"Your current occupancy rate is {rate}%. You have {total - occupied} vacant units out of {total} total units."
+        if rate >= 95:
+            response += " That's excellent! Your properties are performing really well."
+        else:
+            response += " You might want to focus on marketing strategies to fill those empty units."
+        return response
+
+    def _revenue(self, frame, mask, query) -> str:
+        occupied_mask = mask & frame.occupied
+        occupied = int(np.count_nonzero(occupied_mask))
+        monthly = float(frame.rent[occupied_mask].sum())
+        subject = f"Your {self._units_phrase(query)} generate" if query.has_filters() else "Your portfolio generates"
+        if occupied > 0:
+            avg_rent = monthly / occupied
+            return f"{subject} ${monthly:,.2f} in monthly revenue and ${monthly * 12:,.2f} annually. With {occupied} occupied units, that works out to an average of ${avg_rent:,.2f} per unit per month."
+        if query.has_filters():
+            return f"None of your {self._units_phrase(query)} are bringing in rent right now."
+        return f"Your portfolio could generate revenue once you have tenants. You currently have {frame.total_units} units available for rent."
+
+    def _count_units(self, frame, mask, query) -> str:
+        total = int(np.count_nonzero(mask))
+        occupied = int(np.count_nonzero(mask & frame.occupied))
+        if query.has_filters():
+            return f"You have {total} {self._units_phrase(query)}, {occupied} of them occupied and {total - occupied} vacant."
+        return f"You have {frame.total_properties} properties with a total of {total} units. {occupied} of them have tenants and {total - occupied} are vacant."
+
+    def _average_rent(self, frame, mask, query) -> str:
+        occupied_mask = mask & frame.occupied & (frame.rent > 0)
+        vacant_mask = mask & ~frame.occupied & (frame.rent > 0)
+        if not occupied_mask.any() and not vacant_mask.any():
+            return f"I couldn't find any units with rent information{self._among(query)}."
+        parts = []
+        if occupied_mask.any():
+            parts.append(f"your tenants pay an average of ${frame.rent[occupied_mask].mean():,.2f} per month across {int(np.count_nonzero(occupied_mask))} occupied units")
+        if vacant_mask.any():
+            parts.append(f"your {int(np.count_nonzero(vacant_mask))} vacant units are listed at an average of ${frame.rent[vacant_mask].mean():,.2f}")
+        response = " and ".join(parts) + "."
+        if query.has_filters():
+            response = f"Looking at {self._units_phrase(query)}, " + response
+        return response[0].upper() + response[1:]
+
+    def _metric_values(self, frame, query) -> np.ndarray:
+        """Value each unit is ranked by, NaN where the unit doesn't take part"""
+        if query.metric == 'rent_per_sqft':
+            valid = (frame.rent > 0) & (frame.sqft > 0)
+            values = np.divide(frame.rent, frame.sqft, out=np.zeros_like(frame.rent), where=valid)
+        else:
+            valid = frame.rent > 0
+            values = frame.rent
+        if query.status == 'vacant':
+            valid = valid & ~frame.occupied
+        elif query.status == 'occupied':
+            valid = valid & frame.occupied
+        return np.where(valid, values, np.nan)
+
+    def _ranked_rows(self, frame, query) -> List:
+        """(property name, unit number, value) for the top/bottom k of the filtered units"""
+        values = self._metric_values(frame, query)
+        candidates = np.flatnonzero(self._mask(query, frame) & ~np.isnan(values))
+        keys = -values[candidates] if query.descending else values[candidates]
+        chosen = candidates[np.argsort(keys, kind='stable')[:query.limit]]
+        return [(frame.names[frame.property_index[row]], frame.unit_numbers[row], float(values[row])) for row in chosen]
+
+    def _metric_phrase(self, query) -> str:
+        return "rent per square foot" if query.metric == 'rent_per_sqft' else "rent"
+
+    def _format_value(self, query, value: float) -> str:
+        if query.metric == 'rent_per_sqft':
+            return f"${value:,.2f}/sq ft"
+        return f"${value:,.2f}/month"
+
+    def _ranked_units(self, frame, index, query) -> str:
+        if index is not None and not query.has_filters():
+            ordering = ordering_name(query.metric, query.status)
+            results = index.top_units(ordering, query.limit) if query.descending \
+                else index.bottom_units(ordering, query.limit)
+            rows = [(row['property'], row['unit']['number'], row['value']) for row in results]
+        else:
+            rows = self._ranked_rows(frame, query)
+
+        metric = self._metric_phrase(query)
+        if not rows:
+            return f"I couldn't find any {self._units_phrase(query, query.status or '')} with {metric} information to rank."
+
+        end = "top" if query.descending else ("cheapest" if query.metric == 'rent' else "bottom")
+        descriptions = [f"unit {number} at {name} ({self._format_value(query, value)})" for name, number, value in rows]
+        if len(rows) == 1:
+            return f"Your {end} {self._units_phrase(query, query.status or '', plural=False)} by {metric} is {descriptions[0]}."
+        return f"Your {end} {len(rows)} {self._units_phrase(query, query.status or '')} by {metric} are " + ", ".join(descriptions[:-1]) + f" and {descriptions[-1]}."
+
+    def _unit_rank(self, frame, index, query) -> str:
+        if index is None:
+            index = PortfolioIndex.from_summary(frame.summary())
+        matches = index.find_unit(query.unit_number, query.property_names)
+        if not matches:
+            where = f" at {' and '.join(query.property_names)}" if query.property_names else ""
+            return f"I couldn't find unit {query.unit_number}{where} in your portfolio."
+
+        ordering = ordering_name(query.metric, query.status)
+        among = f"{query.status} units" if query.status else "units"
+        answers = []
+        for prop_name, unit in matches[:3]:
+            ranked = index.unit_rank(ordering, prop_name, unit['number'])
+            label = f"Unit {unit['number']} at {prop_name}"
+            if ranked is None:
+                answers.append(f"{label} isn't ranked among your {among} by {self._metric_phrase(query)}.")
+                continue
+            rank, out_of, value = ranked
+            answers.append(f"{label} ranks {_ordinal(rank)} of {out_of} {among} by {self._metric_phrase(query)}, at {self._format_value(query, value)}.")
+        if len(matches) > 3:
+            answers.append(f"There are {len(matches) - 3} more units numbered {query.unit_number}; name the property to narrow it down.")
+        return " ".join(answers)
+
+
+def _ordinal(number: int) -> str:
+    if 10 <= number % 100 <= 20:
+        suffix = 'th'
+    else:
+        suffix = {1: 'st', 2: 'nd', 3: 'rd'}.get(number % 10, 'th')
+    return f"{number}{suffix}"
+
+
+# Global query planner and engine instances
+query_planner = QueryPlanner()
+query_engine = QueryEngine()
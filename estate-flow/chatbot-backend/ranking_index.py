@@ -0,0 +1,253 @@
+import threading
+from bisect import bisect_left, insort
+from typing import Dict, List, Optional, Tuple
+import logging
+from portfolio_engine import to_number
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def _per_sqft(unit: Dict) -> Optional[float]:
+    sqft = to_number(unit.get('square_feet', 0))
+    if sqft <= 0 or unit['rent'] <= 0:
+        return None
+    return unit['rent'] / sqft
+
+
+def _rent(unit: Dict) -> Optional[float]:
+    return unit['rent'] if unit['rent'] > 0 else None
+
+
+# Orderings kept by the index, named "<metric>" for every unit or
+# "<status>_<metric>" for occupied/vacant units; each maps a unit to the value
+# it is ranked by, or None when the unit doesn't take part (no rent, no size)
+UNIT_ORDERINGS = {
+    'rent': _rent,
+    'rent_per_sqft': _per_sqft,
+    'occupied_rent': lambda unit: _rent(unit) if unit['is_occupied'] else None,
+    'vacant_rent': lambda unit: _rent(unit) if not unit['is_occupied'] else None,
+    'occupied_rent_per_sqft': lambda unit: _per_sqft(unit) if unit['is_occupied'] else None,
+    'vacant_rent_per_sqft': lambda unit: _per_sqft(unit) if not unit['is_occupied'] else None,
+}
+
+
+def ordering_name(metric: str, status: Optional[str] = None) -> str:
+    return f"{status}_{metric}" if status else metric
+
+
+class RankedList:
+    """Entries kept sorted highest value first.
+
+    Keys are (-value, seq, entry_id) tuples, where seq is the order an entry
+    was first seen, so ties keep portfolio order. Reads are O(log n + k) with
+    bisect; inserts and removals bisect to the position and shift the list.
+    """
+
+    def __init__(self):
+        self._keys = []
+        self._entry_keys = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def load(self, entries: List[Tuple]):
+        """Bulk-load (entry_id, value, seq) triples with a single sort"""
+        self._keys = sorted((-value, seq, entry_id) for entry_id, value, seq in entries)
+        self._entry_keys = {key[2]: key for key in self._keys}
+
+    def add(self, entry_id, value: float, seq: int):
+        self.remove(entry_id)
+        key = (-value, seq, entry_id)
+        insort(self._keys, key)
+        self._entry_keys[entry_id] = key
+
+    def remove(self, entry_id):
+        key = self._entry_keys.pop(entry_id, None)
+        if key is not None:
+            del self._keys[bisect_left(self._keys, key)]
+
+    def top(self, k: int) -> List[Tuple]:
+        """Highest k as (entry_id, value), first seen first on ties"""
+        return [(entry_id, -negated) for negated, _, entry_id in self._keys[:k]]
+
+    def bottom(self, k: int) -> List[Tuple]:
+        """Lowest k as (entry_id, value), first seen first on ties"""
+        result = []
+        end = len(self._keys)
+        while end > 0 and len(result) < k:
+            negated = self._keys[end - 1][0]
+            # Start of the block of entries sharing this value
+            start = bisect_left(self._keys, (negated, -1))
+            block = self._keys[start:end][:k - len(result)]
+            result.extend((entry_id, -value) for value, _, entry_id in block)
+            end = start
+        return result
+
+    def rank(self, entry_id) -> Optional[int]:
+        """1-based position from the top, or None if the entry isn't ranked"""
+        key = self._entry_keys.get(entry_id)
+        if key is None:
+            return None
+        return bisect_left(self._keys, key) + 1
+
+
+class PortfolioIndex:
+    """Per-portfolio ranking index for the analytics helpers.
+
+    Keeps units ordered by rent and by rent per square foot (overall and split
+    into occupied and vacant), properties ordered by monthly revenue, and the
+    vacancy totals. It is built once per portfolio version, or kept by the
+    portfolio store and updated unit by unit as deltas arrive.
+    """
+
+    def __init__(self):
+        self.units = {}
+        self.properties = {}
+        self.orderings = {name: RankedList() for name in UNIT_ORDERINGS}
+        self.property_revenue = RankedList()
+        self.vacant_rent_total = 0.0
+        self._vacant = {}
+        self._unit_seq = {}
+        self._property_seq = {}
+        self._next_seq = 0
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_summary(cls, property_summary: Dict) -> 'PortfolioIndex':
+        """Build every ordering in one pass plus one sort each"""
+        index = cls()
+
+        # Repeated unit numbers or property names collapse onto one entry (the
+        # later row wins, as in the portfolio store) but keep their first position
+        for prop in property_summary.get('properties', []):
+            name = prop.get('name')
+            units = index.units.setdefault(name, {})
+            for unit in prop.get('units', []):
+                number = str(unit.get('number'))
+                index._unit_seq.setdefault((name, number), index._take_seq())
+                units[number] = unit
+            index._property_seq.setdefault(name, index._take_seq())
+            index.properties[name] = prop
+
+        entries = {name: [] for name in UNIT_ORDERINGS}
+        for name, units in index.units.items():
+            for number, unit in units.items():
+                unit_id = (name, number)
+                seq = index._unit_seq[unit_id]
+                for ordering, value_of in UNIT_ORDERINGS.items():
+                    value = value_of(unit)
+                    if value is not None:
+                        entries[ordering].append((unit_id, value, seq))
+                if not unit['is_occupied']:
+                    index._vacant[unit_id] = unit
+                    index.vacant_rent_total += unit['rent']
+
+        for ordering, ordering_entries in entries.items():
+            index.orderings[ordering].load(ordering_entries)
+        index.property_revenue.load([
+            (name, prop.get('monthly_revenue', 0), index._property_seq[name])
+            for name, prop in index.properties.items()
+        ])
+        return index
+
+    @property
+    def vacant_count(self) -> int:
+        return len(self._vacant)
+
+    def upsert_unit(self, property_name: str, unit: Dict):
+        number = str(unit.get('number'))
+        unit_id = (property_name, number)
+        with self._lock:
+            self.remove_unit(property_name, number)
+            seq = self._unit_seq.setdefault(unit_id, self._take_seq())
+            self.units.setdefault(property_name, {})[number] = unit
+            for name, value_of in UNIT_ORDERINGS.items():
+                value = value_of(unit)
+                if value is not None:
+                    self.orderings[name].add(unit_id, value, seq)
+            if not unit['is_occupied']:
+                self._vacant[unit_id] = unit
+                self.vacant_rent_total += unit['rent']
+
+    def remove_unit(self, property_name: str, number):
+        unit_id = (property_name, str(number))
+        with self._lock:
+            unit = self.units.get(property_name, {}).pop(unit_id[1], None)
+            if unit is None:
+                return
+            for ordering in self.orderings.values():
+                ordering.remove(unit_id)
+            if self._vacant.pop(unit_id, None) is not None:
+                self.vacant_rent_total -= unit['rent']
+
+    def update_property(self, prop: Dict):
+        """Refresh a property's revenue ranking from its rollup"""
+        name = prop.get('name')
+        with self._lock:
+            seq = self._property_seq.setdefault(name, self._take_seq())
+            self.properties[name] = prop
+            self.property_revenue.add(name, prop.get('monthly_revenue', 0), seq)
+
+    def remove_property(self, name: str):
+        with self._lock:
+            for number in list(self.units.get(name, {})):
+                self.remove_unit(name, number)
+            self.units.pop(name, None)
+            self.properties.pop(name, None)
+            self.property_revenue.remove(name)
+
+    def top_units(self, ordering: str, k: int) -> List[Dict]:
+        with self._lock:
+            return [self._unit_result(unit_id, value) for unit_id, value in self.orderings[ordering].top(k)]
+
+    def bottom_units(self, ordering: str, k: int) -> List[Dict]:
+        with self._lock:
+            return [self._unit_result(unit_id, value) for unit_id, value in self.orderings[ordering].bottom(k)]
+
+    def unit_rank(self, ordering: str, property_name: str, number) -> Optional[Tuple[int, int, float]]:
+        """(rank, out_of, value) for a unit within an ordering, or None if it isn't in it"""
+        unit_id = (property_name, str(number))
+        with self._lock:
+            ranked = self.orderings[ordering]
+            rank = ranked.rank(unit_id)
+            if rank is None:
+                return None
+            return rank, len(ranked), UNIT_ORDERINGS[ordering](self.units[property_name][unit_id[1]])
+
+    def find_unit(self, number, property_names: Optional[List[str]] = None) -> List[Tuple[str, Dict]]:
+        """(property name, unit) for every unit with this number, optionally within the named properties"""
+        number = str(number).lower()
+        with self._lock:
+            names = property_names or list(self.units)
+            matches = []
+            for name in names:
+                for unit_number, unit in self.units.get(name, {}).items():
+                    if unit_number.lower() == number:
+                        matches.append((name, unit))
+            return matches
+
+    def vacant_units(self, k: int) -> List[Dict]:
+        """Up to k vacant units, highest listed rent first, then unpriced ones in portfolio order"""
+        with self._lock:
+            result = self.top_units('vacant_rent', k)
+            if len(result) < k:
+                priced = {(row['property'], str(row['unit'].get('number'))) for row in result}
+                for unit_id, unit in self._vacant.items():
+                    if len(result) >= k:
+                        break
+                    if unit_id not in priced:
+                        result.append({'property': unit_id[0], 'unit': unit, 'value': unit['rent']})
+            return result
+
+    def top_properties(self, k: int) -> List[Dict]:
+        with self._lock:
+            return [self.properties[name] for name, _ in self.property_revenue.top(k)]
+
+    def _unit_result(self, unit_id, value) -> Dict:
+        return {'property': unit_id[0], 'unit': self.units[unit_id[0]][unit_id[1]], 'value': value}
+
+    def _take_seq(self) -> int:
+        self._next_seq += 1
+        return self._next_seq
@@ -0,0 +1,63 @@
+import threading
+import time
+from typing import Dict, Optional
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, bursts up to `capacity`.
+
+    A rate of 0 or less disables limiting.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self, tokens: float = 1) -> float:
+        """Take tokens if available; returns 0, or the seconds to wait before retrying"""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens: float = 1, timeout: Optional[float] = None) -> bool:
+        """Block until tokens are available; False if that would take longer than timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait <= 0:
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+_server_limiters: Dict[str, TokenBucket] = {}
+_server_limiters_lock = threading.Lock()
+
+
+def server_limiter(host: str, port: int, rate: float, capacity: Optional[float] = None) -> TokenBucket:
+    """Shared bucket per mail server, so every sender targeting it draws from one budget"""
+    key = f"{host}:{port}"
+    with _server_limiters_lock:
+        limiter = _server_limiters.get(key)
+        if limiter is None:
+            limiter = _server_limiters[key] = TokenBucket(rate, capacity)
+        return limiter
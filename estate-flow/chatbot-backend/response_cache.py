@@ -0,0 +1,268 @@
+"""Cache of OpenAI answers, keyed by the normalized question.
+
+Open-ended questions that the local query engine can't answer go to OpenAI,
+and users ask the same few of them in slightly different words ("how's my
+portfolio doing", "how is the portfolio doing?") against data that hasn't
+changed. Each answer is stored under the portfolio version it was generated
+for, keyed by the question's content words in order: lowercased,
+contractions expanded, stop and filler words dropped, plurals and a few
+synonyms folded. A later question about the same version with the same key
+gets that answer. Order matters ("from Ocean View to Sunset Gardens" is not
+the reverse move), and so does every other word, since one word can ask for
+something else ("in spanish", "as a table", "politely", "was" for "will").
+Everything runs in process; nothing leaves the machine.
+
+Entries of older portfolio versions are dropped as soon as a stored
+portfolio changes; answers for `properties` payloads are keyed by content
+and age out. Memory is bounded by RESPONSE_CACHE_SIZE answers overall and
+RESPONSE_CACHE_PER_PORTFOLIO per version, least recently used first.
+"""
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_CONTRACTIONS = (
+    (re.compile(r"\bwon't\b"), "will not"),
+    (re.compile(r"\bcan't\b"), "can not"),
+    (re.compile(r"n't\b"), " not"),
+    (re.compile(r"'re\b"), " are"),
+    (re.compile(r"'s\b"), " is"),
+    (re.compile(r"'m\b"), " am"),
+    (re.compile(r"'ve\b"), " have"),
+    (re.compile(r"'ll\b"), " will"),
+    (re.compile(r"'d\b"), " would"),
+)
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+# Words that don't change what is being asked. Tense (was, will, would), direction
+# (from, to) and advice (should) do, so they stay in the key
+STOP_WORDS = frozenset((
+    'a', 'an', 'the', 'is', 'are', 'am', 'be', 'do', 'does', 'my', 'our', 'me',
+    'i', 'we', 'us', 'you', 'your', 'it', 'its', 'this', 'that', 'these', 'those', 'there', 'of', 'in', 'on',
+    'at', 'for', 'with', 'by', 'and', 'or', 'so', 'please', 'can', 'could',
+    'tell', 'show', 'give', 'let', 'know', 'like', 'want', 'need', 'just', 'some', 'any', 'right',
+    'about', 'now', 'currently', 'current', 'today', 'overall', 'really', 'hey', 'hi', 'thanks', 'thank'
+))
+
+# Different words for the same thing, folded onto one (after plurals are folded)
+SYNONYMS = {
+    'empty': 'vacant', 'available': 'vacant', 'unoccupied': 'vacant', 'unrented': 'vacant', 'vacancy': 'vacant',
+    'rented': 'occupied', 'leased': 'occupied', 'filled': 'occupied',
+    'apartment': 'unit', 'apt': 'unit', 'flat': 'unit', 'suite': 'unit',
+    'renter': 'tenant', 'resident': 'tenant', 'occupant': 'tenant', 'lessee': 'tenant',
+    'building': 'property', 'complex': 'property',
+    'income': 'revenue', 'earning': 'revenue', 'cashflow': 'revenue',
+    'boost': 'increase', 'raise': 'increase', 'grow': 'increase', 'reduce': 'decrease',
+}
+
+# Also dropped: asides that never change the answer (as folded by question_terms)
+FILLER_WORDS = frozenset((
+    'ok', 'okay', 'well', 'um', 'uh', 'hello', 'again', 'quick', 'question', 'wondering', 'wonder',
+    'curious', 'actually', 'basically', 'honestly', 'guess', 'think', 'look', 'looking', 'see',
+    'ask', 'asking',
+))
+
+
+def _fold(word: str) -> str:
+    """Plural to singular, then onto the synonym's canonical word"""
+    if len(word) > 4 and word.endswith('ies'):
+        word = word[:-3] + 'y'
+    elif len(word) > 3 and word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        word = word[:-1]
+    return SYNONYMS.get(word, word)
+
+
+def question_terms(text: str) -> List[str]:
+    """The question's content words, in order, normalized for matching"""
+    text = text.lower().replace('’', "'")
+    for pattern, replacement in _CONTRACTIONS:
+        text = pattern.sub(replacement, text)
+    terms = [_fold(word) for word in _WORD_RE.findall(text) if word not in STOP_WORDS]
+    return [term for term in terms if term not in FILLER_WORDS]
+
+
+def question_key(question: str) -> str:
+    """Cache key: the normalized content words in order, or '' for a question with none"""
+    return ' '.join(question_terms(question))
+
+
+class CachedAnswer:
+    """One stored answer and what it cost to produce"""
+
+    __slots__ = ('question', 'answer', 'seconds', 'tokens', 'created_at', 'hits')
+
+    def __init__(self, question: str, answer: str, seconds: float, tokens: int):
+        self.question = question
+        self.answer = answer
+        self.seconds = seconds
+        self.tokens = tokens
+        self.created_at = time.monotonic()
+        self.hits = 0
+
+
+class ResponseCache:
+    """Bounded LRU cache of AI answers per portfolio version, looked up by normalized question"""
+
+    def __init__(self, max_entries: int = None, per_portfolio: int = None, ttl_seconds: float = None,
+                 enabled: bool = None):
+        self.enabled = enabled if enabled is not None else os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() != 'false'
+        self.max_entries = max_entries or int(os.getenv('RESPONSE_CACHE_SIZE', '1000'))
+        self.per_portfolio = per_portfolio or int(os.getenv('RESPONSE_CACHE_PER_PORTFOLIO', '100'))
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else float(os.getenv('RESPONSE_CACHE_TTL', '3600'))
+        # Portfolio version (snapshot key) -> normalized question -> answer, both in LRU order
+        self._versions = OrderedDict()
+        # Stored portfolio -> (snapshot key, version number) of its newest version
+        self._lineages = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.reworded_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.seconds_saved = 0.0
+        self.tokens_saved = 0
+
+    def lookup(self, snapshot, question: str) -> Optional[str]:
+        """The stored answer to this question, or one worded the same once normalized, about the snapshot's version"""
+        if not self.enabled:
+            return None
+        key = question_key(question)
+        if not key:
+            return None
+
+        with self._lock:
+            entries = self._versions.get(snapshot.key) if self._is_current(snapshot) else None
+            if entries:
+                self._versions.move_to_end(snapshot.key)
+                self._expire(snapshot.key, entries)
+                entry = entries.get(key)
+                if entry is not None:
+                    return self._hit(entries, key, entry, question)
+            self.misses += 1
+            return None
+
+    def store(self, snapshot, question: str, answer: str, seconds: float, tokens: int = 0):
+        """Remember an AI answer along with the time and tokens it took"""
+        if not self.enabled or not answer:
+            return
+        key = question_key(question)
+        if not key:
+            return
+        entry = CachedAnswer(question, answer, seconds, tokens)
+
+        with self._lock:
+            if not self._is_current(snapshot):
+                # The portfolio changed while this answer was being generated
+                return
+            entries = self._versions.get(snapshot.key)
+            if entries is None:
+                entries = self._versions[snapshot.key] = OrderedDict()
+            self._versions.move_to_end(snapshot.key)
+            if key not in entries:
+                self._size += 1
+            entries[key] = entry
+            entries.move_to_end(key)
+            self.stores += 1
+            while len(entries) > self.per_portfolio:
+                entries.popitem(last=False)
+                self._size -= 1
+                self.evictions += 1
+            while self._size > self.max_entries:
+                self._evict_oldest()
+
+    def clear(self):
+        with self._lock:
+            self._versions.clear()
+            self._lineages.clear()
+            self._size = 0
+
+    def stats(self) -> Dict:
+        """Hit/miss counters and what the hits saved, for monitoring"""
+        with self._lock:
+            hits = self.exact_hits + self.reworded_hits
+            lookups = hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'entries': self._size,
+                'portfolio_versions': len(self._versions),
+                'max_entries': self.max_entries,
+                'per_portfolio': self.per_portfolio,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': hits,
+                'exact_hits': self.exact_hits,
+                'reworded_hits': self.reworded_hits,
+                'misses': self.misses,
+                'stores': self.stores,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+                'seconds_saved': round(self.seconds_saved, 3),
+                'tokens_saved': self.tokens_saved,
+                'hit_ratio': round(hits / lookups, 4) if lookups else 0.0
+            }
+
+    def _hit(self, entries: OrderedDict, key: str, entry: CachedAnswer, question: str) -> str:
+        entries.move_to_end(key)
+        entry.hits += 1
+        if question.strip().lower() == entry.question.strip().lower():
+            self.exact_hits += 1
+        else:
+            self.reworded_hits += 1
+        self.seconds_saved += entry.seconds
+        self.tokens_saved += entry.tokens
+        logger.info(f"Answering from the response cache (stored for \"{entry.question}\")")
+        return entry.answer
+
+    def _is_current(self, snapshot) -> bool:
+        """False for a superseded version of a stored portfolio; a newer one drops the previous version's answers"""
+        if snapshot.lineage is None:
+            return True
+        previous = self._lineages.get(snapshot.lineage)
+        if previous is not None:
+            key, version = previous
+            if key == snapshot.key:
+                return True
+            if snapshot.version is not None and version is not None and snapshot.version < version:
+                return False
+            self._drop_version(key)
+            self.invalidations += 1
+        self._lineages[snapshot.lineage] = (snapshot.key, snapshot.version)
+        return True
+
+    def _drop_version(self, version: str):
+        entries = self._versions.pop(version, None)
+        if entries:
+            self._size -= len(entries)
+
+    def _expire(self, version: str, entries: OrderedDict):
+        if self.ttl_seconds <= 0:
+            return
+        cutoff = time.monotonic() - self.ttl_seconds
+        for key in [key for key, entry in entries.items() if entry.created_at < cutoff]:
+            del entries[key]
+            self._size -= 1
+            self.expirations += 1
+
+    def _evict_oldest(self):
+        version, entries = next(iter(self._versions.items()))
+        if entries:
+            entries.popitem(last=False)
+            self._size -= 1
+            self.evictions += 1
+        if not entries:
+            del self._versions[version]
+
+
+# Global response cache instance
+response_cache = ResponseCache()
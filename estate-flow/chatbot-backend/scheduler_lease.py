@@ -0,0 +1,209 @@
+"""SQLite lease that elects one process to run the rent scheduler.
+
+Every worker process watches the same lease row. /scheduler/start turns the
+scheduler on for all of them by setting the row's enabled flag; whichever
+worker takes the lease starts its scheduler and renews the lease every
+SCHEDULER_LEASE_HEARTBEAT seconds. If it dies or stalls, the lease expires
+after SCHEDULER_LEASE_TTL seconds and another worker takes over. The fencing
+token goes up on every change of holder.
+"""
+import os
+import socket
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, Optional
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    holder TEXT,
+    acquired_at REAL,
+    renewed_at REAL,
+    expires_at REAL NOT NULL DEFAULT 0,
+    fencing_token INTEGER NOT NULL DEFAULT 0,
+    enabled INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+def _timestamp(value: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(value).isoformat(timespec='seconds') if value else None
+
+
+class SchedulerLease:
+    """A named lease in SQLite held by at most one worker at a time, kept alive by a heartbeat thread"""
+
+    def __init__(self, name: str = 'rent-scheduler', path: str = None, ttl: float = None,
+                 heartbeat: float = None, worker_id: str = None):
+        self.name = name
+        self.path = path or os.getenv('SCHEDULER_LEASE_PATH', 'scheduler_lease.db')
+        self.ttl = ttl if ttl is not None else float(os.getenv('SCHEDULER_LEASE_TTL', '30'))
+        self.heartbeat = heartbeat if heartbeat is not None else float(os.getenv('SCHEDULER_LEASE_HEARTBEAT', '10'))
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        # Called in the heartbeat thread when this worker gains or loses the lease
+        self.on_acquired: Optional[Callable[[], None]] = None
+        self.on_lost: Optional[Callable[[], None]] = None
+        self.is_leader = False
+
+        self._lock = threading.Lock()
+        self._transition_lock = threading.RLock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.execute("INSERT OR IGNORE INTO leases (name) VALUES (?)", (self.name,))
+
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start watching the lease; this worker campaigns for it whenever the scheduler is enabled"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='scheduler-lease', daemon=True)
+            self._thread.start()
+        logger.info(f"Scheduler lease watcher started as {self.worker_id} ({self.path})")
+
+    def stop(self):
+        """Stop watching and hand the lease back so another worker can take it at once"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.heartbeat + 5)
+        with self._transition_lock:
+            if self.is_leader:
+                self._lose()
+                self.release()
+
+    def enable(self):
+        """Turn the scheduler on for every worker; returns once this worker has tried for the lease"""
+        self._set_enabled(True)
+        self.start()
+        self.tick()
+
+    def disable(self):
+        """Turn the scheduler off for every worker; another worker holding the lease stops on its next heartbeat"""
+        self._set_enabled(False)
+        self.tick()
+
+    def tick(self):
+        """One heartbeat: renew or give up the lease if held, otherwise campaign for it if enabled"""
+        with self._transition_lock:
+            try:
+                enabled = self.enabled()
+                if self.is_leader:
+                    if not enabled:
+                        self._lose()
+                        self.release()
+                    elif not self.try_acquire():
+                        logger.warning(f"Scheduler lease lost by {self.worker_id}")
+                        self._lose()
+                elif enabled and self.try_acquire():
+                    logger.info(f"Scheduler lease acquired by {self.worker_id}")
+                    self.is_leader = True
+                    if self.on_acquired is not None:
+                        try:
+                            self.on_acquired()
+                        except Exception:
+                            # Let a worker that can run the scheduler have it
+                            self._lose()
+                            self.release()
+                            raise
+            except Exception as e:
+                logger.error(f"Scheduler lease heartbeat failed: {str(e)}")
+
+    def try_acquire(self) -> bool:
+        """Take or renew the lease if it's free, expired or already ours"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT * FROM leases WHERE name = ?", (self.name,)).fetchone()
+                if row['holder'] == self.worker_id and row['expires_at'] > now:
+                    self._conn.execute("UPDATE leases SET renewed_at = ?, expires_at = ? WHERE name = ?",
+                                       (now, now + self.ttl, self.name))
+                elif row['holder'] is None or row['expires_at'] <= now:
+                    self._conn.execute(
+                        "UPDATE leases SET holder = ?, acquired_at = ?, renewed_at = ?, expires_at = ?, "
+                        "fencing_token = fencing_token + 1 WHERE name = ?",
+                        (self.worker_id, now, now, now + self.ttl, self.name)
+                    )
+                else:
+                    self._conn.execute("COMMIT")
+                    return False
+                self._conn.execute("COMMIT")
+                return True
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def confirm(self) -> bool:
+        """Renew the lease only if this worker still holds it and it hasn't expired; checked before each scheduled run"""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE leases SET renewed_at = ?, expires_at = ? WHERE name = ? AND holder = ? AND expires_at > ?",
+                (now, now + self.ttl, self.name, self.worker_id, now)
+            )
+        return cursor.rowcount == 1
+
+    def release(self):
+        with self._lock:
+            self._conn.execute("UPDATE leases SET holder = NULL, expires_at = 0 WHERE name = ? AND holder = ?",
+                               (self.name, self.worker_id))
+
+    def enabled(self) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT enabled FROM leases WHERE name = ?", (self.name,)).fetchone()
+        return bool(row['enabled'])
+
+    def status(self) -> Dict:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM leases WHERE name = ?", (self.name,)).fetchone()
+        held = row['holder'] is not None and row['expires_at'] > now
+        return {
+            'name': self.name,
+            'enabled': bool(row['enabled']),
+            'holder': row['holder'] if held else None,
+            'acquired_at': _timestamp(row['acquired_at']) if held else None,
+            'renewed_at': _timestamp(row['renewed_at']) if held else None,
+            'expires_in_seconds': round(row['expires_at'] - now, 1) if held else None,
+            'fencing_token': row['fencing_token'],
+            'worker_id': self.worker_id,
+            'is_leader': self.is_leader,
+            'ttl_seconds': self.ttl,
+            'heartbeat_seconds': self.heartbeat
+        }
+
+    def _set_enabled(self, enabled: bool):
+        with self._lock:
+            self._conn.execute("UPDATE leases SET enabled = ? WHERE name = ?", (int(enabled), self.name))
+
+    def _lose(self):
+        self.is_leader = False
+        if self.on_lost is not None:
+            try:
+                self.on_lost()
+            except Exception as e:
+                logger.error(f"Error stopping the scheduler after losing the lease: {str(e)}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.tick()
+            self._wake.wait(self.heartbeat)
+            self._wake.clear()
+
+
+# Global scheduler lease instance
+scheduler_lease = SchedulerLease()
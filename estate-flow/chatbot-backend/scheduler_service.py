@@ -1,219 +1,378 @@
-import schedule
-import time
-import threading
-from datetime import datetime, timedelta
-import json
+from datetime import datetime
 import os
-from typing import List, Dict
+import time
+from typing import List, Dict, Tuple
 import logging
 from email_service import email_service
+from property_db import PropertyDatabase
+from due_date_index import DueDateIndex
+from timer_scheduler import timer_scheduler, TimerScheduler
+from scheduler_lease import scheduler_lease, SchedulerLease
+from notification_ledger import notification_ledger, NotificationLedger, LedgerKey, ledger_key
+from metrics import SCHEDULER_RUN_SECONDS, SCHEDULER_RUNS, SCHEDULER_TENANTS
+from profiling import profiler, span
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def record_run_metrics(runner: str, seconds: float, report: Dict):
+    """Count a real (not dry) run of the daily checks for /metrics"""
+    SCHEDULER_RUN_SECONDS.labels(runner).observe(seconds)
+    SCHEDULER_RUNS.labels(runner, 'failed' if report.get('errors') or report.get('failed') else 'succeeded').inc()
+    notified = report.get('totals', report)
+    for check, result_key in (('overdue', 'overdue_tenants'), ('reminders', 'reminders_queued')):
+        if notified.get(result_key):
+            SCHEDULER_TENANTS.labels(check, 'notified').inc(notified[result_key])
+        if report['already_sent'].get(check):
+            SCHEDULER_TENANTS.labels(check, 'already_sent').inc(report['already_sent'][check])
+
 class RentScheduler:
-    def __init__(self, data_file_path="properties_data.json"):
+    def __init__(self, data_file_path="properties_data.json", db_path=None, job_set=None, scheduler: TimerScheduler = None,
+                 landlord_email=None, lease: SchedulerLease = None, ledger: NotificationLedger = None):
         self.data_file_path = data_file_path
+        # Where overdue summaries go; defaults to LANDLORD_EMAIL
+        self.landlord_email = landlord_email
+        # Indexed store the checks query; re-imported from data_file_path whenever that file changes
+        self.store = PropertyDatabase(db_path)
         self.running = False
-        self.scheduler_thread = None
+        
+        # This scheduler's jobs, kept apart from other landlords' sets on the shared timer
+        self.timer = scheduler or timer_scheduler
+        self.jobs = self.timer.job_set(job_set or os.getenv('SCHEDULER_JOB_SET', 'default'))
+        # When set, scheduled runs go ahead only while this worker holds the lease
+        self.lease = lease
+        # When set, each notice goes out once per tenant, unit, period and type
+        self.ledger = ledger
         
         # Schedule configurations
         self.check_overdue_time = "09:00"  # Check at 9 AM daily
+        self.check_cron = os.getenv('RENT_CHECK_CRON')  # Cron expression; overrides check_overdue_time when set
         self.reminder_days_before = [3, 1]  # Send reminders 3 and 1 days before due date
-        self.grace_period_days = 3  # Days after due date before sending overdue notices
+        self.grace_period_days = 3  # Days after due date before sending overdue notices (tenants can override)
+        self.lease_expiry_days = 60  # Look-ahead for leases coming up for renewal
+        
+        # Due-date index over the store, rebuilt only when the data or grace period changes
+        self._due_index = None
+        self._due_index_key = None
+        
+        # What the most recent run queued in the outbox, and skipped as already sent, per notification type
+        self.last_queued = {}
+        self.last_skipped = {}
         
-    def load_properties_data(self) -> List[Dict]:
-        """Load properties data from JSON file"""
+        # Notices listed individually in a dry-run report
+        self.dry_run_sample_size = int(os.getenv('DRY_RUN_SAMPLE_SIZE', '50'))
+        
+    def sync_store(self):
+        """Pick up edits to the JSON data file (one stat call when nothing changed)"""
         try:
-            if os.path.exists(self.data_file_path):
-                with open(self.data_file_path, 'r') as file:
-                    return json.load(file)
-            else:
-                logger.warning(f"Properties data file not found: {self.data_file_path}")
-                return []
+            self.store.sync_from_json(self.data_file_path)
         except Exception as e:
-            logger.error(f"Error loading properties data: {str(e)}")
-            return []
+            logger.error(f"Error importing properties data into the store: {str(e)}")
+    
+    def due_index(self) -> DueDateIndex:
+        """Calendar index of due dates and lease ends for today, built in one pass over the tenants it can need"""
+        self.sync_store()
+        today = datetime.now().date()
+        # Leases that ended before today are left out, so the index is rebuilt when the day changes
+        key = (self.store.revision(), self.grace_period_days, today)
+        if self._due_index is None or key != self._due_index_key:
+            self._due_index = DueDateIndex.build(self.store.scheduled_tenants(today), self.grace_period_days)
+            self._due_index_key = key
+        return self._due_index
     
     def get_overdue_tenants(self) -> List[Dict]:
         """Get list of tenants with overdue rent"""
-        properties = self.load_properties_data()
-        overdue_tenants = []
-        current_date = datetime.now()
-        
-        for property_data in properties:
-            for unit in property_data.get('units', []):
-                tenant = unit.get('tenant')
-                if not tenant or unit.get('rentPaid', False):
-                    continue
-                
-                # Calculate if rent is overdue
-                # Assuming rent is due on the 1st of each month
-                this_month_due = datetime(current_date.year, current_date.month, 1)
-                if current_date.day < 1:
-                    # If we're before the 1st, check last month's rent
-                    if current_date.month == 1:
-                        this_month_due = datetime(current_date.year - 1, 12, 1)
-                    else:
-                        this_month_due = datetime(current_date.year, current_date.month - 1, 1)
-                
-                grace_period_end = this_month_due + timedelta(days=self.grace_period_days)
-                
-                if current_date > grace_period_end:
-                    days_overdue = (current_date - grace_period_end).days
-                    
-                    overdue_tenants.append({
-                        'property_name': property_data.get('name', 'Unknown Property'),
-                        'unit_number': unit.get('number', 'N/A'),
-                        'tenant_name': tenant.get('name', 'Unknown'),
-                        'tenant_email': tenant.get('email', ''),
-                        'tenant_phone': tenant.get('phone', ''),
-                        'rent': unit.get('rent', 0),
-                        'days_overdue': days_overdue,
-                        'due_date': this_month_due.strftime('%B 1, %Y')
-                    })
-        
-        return overdue_tenants
+        today = datetime.now().date()
+        return [self._notice_fields(tenant, days_overdue=tenant['days_overdue'])
+                for tenant in self.due_index().overdue_as_of(today)]
     
     def get_tenants_for_reminder(self, days_before: int) -> List[Dict]:
         """Get tenants who should receive rent reminders"""
-        properties = self.load_properties_data()
-        reminder_tenants = []
-        current_date = datetime.now()
-        
-        # Calculate next month's due date
-        if current_date.month == 12:
-            next_due_date = datetime(current_date.year + 1, 1, 1)
-        else:
-            next_due_date = datetime(current_date.year, current_date.month + 1, 1)
-        
-        reminder_date = next_due_date - timedelta(days=days_before)
-        
-        # Check if today is a reminder day
-        if current_date.date() != reminder_date.date():
-            return []
-        
-        for property_data in properties:
-            for unit in property_data.get('units', []):
-                tenant = unit.get('tenant')
-                if not tenant or unit.get('rentPaid', False):
-                    continue
-                
-                reminder_tenants.append({
-                    'property_name': property_data.get('name', 'Unknown Property'),
-                    'unit_number': unit.get('number', 'N/A'),
-                    'tenant_name': tenant.get('name', 'Unknown'),
-                    'tenant_email': tenant.get('email', ''),
-                    'tenant_phone': tenant.get('phone', ''),
-                    'rent': unit.get('rent', 0),
-                    'due_date': next_due_date.strftime('%B 1, %Y')
-                })
-        
-        return reminder_tenants
+        today = datetime.now().date()
+        return [self._notice_fields(tenant) for tenant in self.due_index().reminders_on(today, [days_before])]
+    
+    def get_leases_ending(self, within_days: int = None) -> List[Dict]:
+        """Tenants whose lease ends within the next within_days days"""
+        today = datetime.now().date()
+        within_days = self.lease_expiry_days if within_days is None else within_days
+        return [
+            dict(self._notice_fields(tenant), lease_end=tenant['lease_end'].isoformat(), days_left=tenant['days_left'])
+            for tenant in self.due_index().leases_expiring(today, within_days)
+        ]
+    
+    @staticmethod
+    def _notice_fields(tenant: Dict, **extra) -> Dict:
+        """Index entry in the shape the email templates expect"""
+        fields = {
+            'property_name': tenant['property_name'],
+            'unit_number': tenant['unit_number'],
+            'tenant_name': tenant['tenant_name'],
+            'tenant_email': tenant['tenant_email'] or '',
+            'tenant_phone': tenant['tenant_phone'] or '',
+            'rent': tenant['rent'] or 0
+        }
+        fields.update(extra)
+        due_date = tenant.get('due_date')
+        if due_date is not None:
+            fields['due_date'] = f"{due_date.strftime('%B')} {due_date.day}, {due_date.year}"
+        return fields
+    
+    @span('plan')
+    def plan_overdue(self) -> Tuple[List[Dict], List[LedgerKey]]:
+        """Overdue tenants not yet reported for their current period, with their ledger keys"""
+        tenants = self.due_index().overdue_as_of(datetime.now().date())
+        keys = [ledger_key(self.jobs.name, tenant, tenant['due_date'], 'overdue') for tenant in tenants]
+        return self._unsent('overdue', tenants, keys)
+    
+    @span('plan')
+    def plan_reminders(self) -> Tuple[List[Dict], List[LedgerKey]]:
+        """Tenants due a reminder today that haven't had this one for the period, with their ledger keys"""
+        # Every offset answered from the same index in one lookup per offset
+        tenants = []
+        for tenant in self.due_index().reminders_on(datetime.now().date(), self.reminder_days_before):
+            if tenant.get('tenant_email'):
+                tenants.append(tenant)
+            else:
+                logger.warning(f"No email address for tenant {tenant['tenant_name']}")
+        keys = [ledger_key(self.jobs.name, tenant, tenant['due_date'], f"reminder-{tenant['days_before']}d") for tenant in tenants]
+        return self._unsent('reminders', tenants, keys)
+    
+    def _unsent(self, name: str, tenants: List[Dict], keys: List[LedgerKey]) -> Tuple[List[Dict], List[LedgerKey]]:
+        if self.ledger is None or not keys:
+            self.last_skipped[name] = 0
+            return tenants, keys
+        sent = self.ledger.already_sent(keys)
+        self.last_skipped[name] = sum(sent)
+        if self.last_skipped[name]:
+            logger.info(f"Skipping {self.last_skipped[name]} {name} notices already sent this period")
+        return [tenant for tenant, done in zip(tenants, sent) if not done], [key for key, done in zip(keys, sent) if not done]
+    
+    @span('claim')
+    def _claim(self, name: str, tenants: List[Dict], keys: List[LedgerKey]) -> Tuple[List[Dict], List[LedgerKey]]:
+        """Record the notices in the ledger, keeping only those no overlapping run recorded first"""
+        if self.ledger is None or not keys:
+            return tenants, keys
+        claimed = self.ledger.claim(keys)
+        self.last_skipped[name] += len(claimed) - sum(claimed)
+        return [tenant for tenant, ok in zip(tenants, claimed) if ok], [key for key, ok in zip(keys, claimed) if ok]
     
-    def check_and_send_overdue_notifications(self):
-        """Check for overdue rent and send notifications"""
+    def check_and_send_overdue_notifications(self) -> int:
+        """Check for overdue rent and send notifications; returns the number of newly overdue tenants reported"""
         try:
             logger.info("Checking for overdue rent payments...")
-            overdue_tenants = self.get_overdue_tenants()
+            overdue_tenants, keys = self._claim('overdue', *self.plan_overdue())
             
             if overdue_tenants:
                 logger.info(f"Found {len(overdue_tenants)} overdue tenants")
-                success = email_service.send_rent_overdue_notification(overdue_tenants)
-                if success:
-                    logger.info("Overdue rent notification sent successfully")
-                else:
-                    logger.error("Failed to send overdue rent notification")
+                notification = email_service.build_rent_overdue_notification(
+                    [self._notice_fields(tenant, days_overdue=tenant['days_overdue']) for tenant in overdue_tenants],
+                    self.landlord_email
+                )
+                # One summary covers every tenant in it
+                self._queue_batch('overdue', [notification], [keys])
+                logger.info("Overdue rent notification queued")
             else:
                 logger.info("No overdue rent payments found")
+            return len(overdue_tenants)
                 
         except Exception as e:
             logger.error(f"Error checking overdue rent: {str(e)}")
+            raise
     
-    def check_and_send_reminders(self):
-        """Check for upcoming rent due dates and send reminders"""
+    def check_and_send_reminders(self) -> int:
+        """Check for upcoming rent due dates and send reminders; returns the number queued"""
         try:
-            for days_before in self.reminder_days_before:
-                logger.info(f"Checking for rent reminders ({days_before} days before due)")
-                reminder_tenants = self.get_tenants_for_reminder(days_before)
+            logger.info(f"Checking for rent reminders ({', '.join(str(days) for days in self.reminder_days_before)} days before due)")
+            tenants, keys = self._claim('reminders', *self.plan_reminders())
+            reminders = [email_service.build_rent_reminder(self._notice_fields(tenant)) for tenant in tenants]
+            
+            if reminders:
+                # Queued in one transaction; the outbox dispatcher sends them in rate-limited batches
+                self._queue_batch('reminders', reminders, [[key] for key in keys])
+                logger.info(f"Queued {len(reminders)} rent reminders")
+            return len(reminders)
                 
-                for tenant in reminder_tenants:
-                    if tenant.get('tenant_email'):
-                        success = email_service.send_rent_reminder_to_tenant(tenant)
-                        if success:
-                            logger.info(f"Reminder sent to {tenant['tenant_name']}")
-                        else:
-                            logger.error(f"Failed to send reminder to {tenant['tenant_name']}")
-                    else:
-                        logger.warning(f"No email address for tenant {tenant['tenant_name']}")
-                        
         except Exception as e:
             logger.error(f"Error sending rent reminders: {str(e)}")
+            raise
+    
+    @span('queue')
+    def _queue_batch(self, name: str, emails: List, keys: List[List[LedgerKey]] = None) -> List[int]:
+        """Hand emails to the outbox and note the run for the status endpoint.
+
+        keys[i] are the ledger entries emails[i] covers; they are released if
+        queueing fails, so the next run tries them again.
+        """
+        try:
+            message_ids = email_service.queue_bulk(emails)
+        except Exception:
+            if self.ledger is not None and keys:
+                self.ledger.release([key for email_keys in keys for key in email_keys])
+            raise
+        if self.ledger is not None and keys:
+            self.ledger.attach(
+                [key for email_keys in keys for key in email_keys],
+                [message_id for message_id, email_keys in zip(message_ids, keys) for _ in email_keys]
+            )
+        self.last_queued[name] = {
+            'count': len(message_ids),
+            'first_message_id': message_ids[0] if message_ids else None,
+            'last_message_id': message_ids[-1] if message_ids else None,
+            'queued_at': datetime.now().isoformat()
+        }
+        return message_ids
     
-    def run_daily_checks(self):
-        """Run all daily checks"""
-        logger.info("Running daily rent checks...")
-        self.check_and_send_overdue_notifications()
-        self.check_and_send_reminders()
+    def run_daily_checks(self, checks: List[str] = None, dry_run: bool = False) -> Dict:
+        """Run all daily checks, or only the named ones; a failing check doesn't stop the others.
+
+        Returns what each check found, with the error of any that failed,
+        so a retry can run just the checks that failed. With dry_run nothing
+        is queued or recorded; the report lists what would be sent and
+        estimates how long the run would take. A run armed for profiling
+        reports its profile_id.
+        """
+        with profiler.scheduler_run(f"rent checks ({self.jobs.name})") as profile:
+            report = self._run_checks(checks, dry_run)
+        if profile is not None:
+            report['profile_id'] = profile.id
+        return report
+    
+    def _run_checks(self, checks: List[str], dry_run: bool) -> Dict:
+        logger.info(f"Running daily rent checks{' (dry run)' if dry_run else ''}...")
+        if self.ledger is not None and not dry_run:
+            with span('prune ledger'):
+                self.ledger.prune()
+        self.last_skipped = {}
+        report = {'overdue_tenants': None, 'reminders_queued': None, 'already_sent': self.last_skipped, 'errors': {}}
+        started = time.monotonic()
+        if dry_run:
+            report.update(dry_run=True, emails=0, would_send=[])
+        for name, result_key, check in (('overdue', 'overdue_tenants', self.check_and_send_overdue_notifications),
+                                        ('reminders', 'reminders_queued', self.check_and_send_reminders)):
+            if checks is not None and name not in checks:
+                continue
+            try:
+                with span(name):
+                    report[result_key] = self._dry_run_check(name, report) if dry_run else check()
+            except Exception as e:
+                report['errors'][name] = str(e)
+        if dry_run:
+            report['estimated_seconds'] = {
+                'planning_and_rendering': round(time.monotonic() - started, 3),
+                'delivery': email_service.estimate_delivery_seconds(report['emails'])
+            }
+        else:
+            record_run_metrics('single', time.monotonic() - started, report)
+        return report
+    
+    def _dry_run_check(self, name: str, report: Dict) -> int:
+        """Plan and render one check's notices without queueing or recording them"""
+        if name == 'overdue':
+            tenants, keys = self.plan_overdue()
+            emails = [email_service.build_rent_overdue_notification(
+                [self._notice_fields(tenant, days_overdue=tenant['days_overdue']) for tenant in tenants],
+                self.landlord_email
+            )] if tenants else []
+        else:
+            tenants, keys = self.plan_reminders()
+            emails = [email_service.build_rent_reminder(self._notice_fields(tenant)) for tenant in tenants]
+        report['emails'] += len(emails)
+        room = max(0, self.dry_run_sample_size - len(report['would_send']))
+        for tenant, key in list(zip(tenants, keys))[:room]:
+            report['would_send'].append({
+                'type': key[4],
+                'to': emails[0].to_email if name == 'overdue' else tenant['tenant_email'],
+                'tenant': tenant['tenant_name'],
+                'property': tenant['property_name'],
+                'unit': tenant['unit_number'],
+                'period': key[3]
+            })
+        return len(tenants)
+    
+    def _run_scheduled_checks(self):
+        if self.lease is not None and not self.lease.confirm():
+            logger.warning("Skipping scheduled rent checks: this worker no longer holds the scheduler lease")
+            return
+        report = self.run_daily_checks()
+        if report['errors']:
+            # Recorded as a failed run in the job history
+            raise RuntimeError('; '.join(f"{name}: {error}" for name, error in report['errors'].items()))
+    
+    def check_schedule(self) -> str:
+        """Cron expression for the daily checks"""
+        if self.check_cron:
+            return self.check_cron
+        hour, minute = (int(part) for part in self.check_overdue_time.split(':'))
+        return f"{minute} {hour} * * *"
     
     def setup_schedule(self):
         """Setup the schedule for automated checks"""
         # Daily check for overdue rent and reminders
-        schedule.every().day.at(self.check_overdue_time).do(self.run_daily_checks)
+        self.jobs.add('daily-checks', self._run_scheduled_checks, cron=self.check_schedule())
         
         # You can add more schedules here:
-        # schedule.every().monday.at("10:00").do(self.weekly_summary)
-        # schedule.every().month.do(self.monthly_report)
+        # self.jobs.add('weekly-summary', self.weekly_summary, cron='0 10 * * 1')
+        # self.jobs.add('monthly-report', self.monthly_report, cron='@monthly')
         
-        logger.info(f"Scheduler configured to run daily at {self.check_overdue_time}")
+        logger.info(f"Scheduler configured to run on '{self.check_schedule()}' (job set {self.jobs.name})")
+    
+    def reschedule(self, check_time: str = None, cron: str = None):
+        """Change when the daily checks run; takes effect immediately if the scheduler is running"""
+        if check_time is not None:
+            self.check_overdue_time = check_time
+        if cron is not None:
+            self.check_cron = cron
+        if self.running:
+            self.setup_schedule()
     
     def start_scheduler(self):
-        """Start the scheduler in a separate thread"""
+        """Start the scheduler"""
         if self.running:
             logger.warning("Scheduler is already running")
             return
         
         self.setup_schedule()
+        self.timer.start()
         self.running = True
-        
-        def run_scheduler():
-            logger.info("Rent scheduler started")
-            while self.running:
-                schedule.run_pending()
-                time.sleep(60)  # Check every minute
-            logger.info("Rent scheduler stopped")
-        
-        self.scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
-        self.scheduler_thread.start()
-        logger.info("Scheduler thread started")
+        logger.info("Rent scheduler started")
     
     def stop_scheduler(self):
         """Stop the scheduler"""
+        self.jobs.clear()
         self.running = False
-        if self.scheduler_thread:
-            self.scheduler_thread.join(timeout=5)
-        schedule.clear()
+        # The timer thread wakes and exits straight away once no job set has jobs left
+        if not self.timer.job_count():
+            self.timer.stop()
         logger.info("Scheduler stopped")
     
-    def run_manual_check(self):
+    def run_manual_check(self, dry_run: bool = False) -> Dict:
         """Manually trigger a check (for testing)"""
         logger.info("Running manual rent check...")
-        self.run_daily_checks()
+        return self.run_daily_checks(dry_run=dry_run)
     
     def get_schedule_status(self) -> Dict:
         """Get current scheduler status"""
         return {
             'running': self.running,
-            'next_run': str(schedule.next_run()) if schedule.jobs else None,
+            'next_run': str(self.jobs.next_run()) if self.jobs.jobs else None,
             'check_time': self.check_overdue_time,
+            'check_schedule': self.check_schedule(),
+            'job_set': self.jobs.name,
             'grace_period_days': self.grace_period_days,
             'reminder_days_before': self.reminder_days_before,
-            'scheduled_jobs': len(schedule.jobs)
+            'leases_ending': len(self.get_leases_ending()),
+            'scheduled_jobs': len(self.jobs.jobs),
+            'jobs': self.jobs.status(),
+            'last_queued': self.last_queued,
+            'last_skipped': self.last_skipped,
+            'notification_ledger': self.ledger.stats() if self.ledger is not None else None,
+            'property_store': self.store.counts(),
+            'outbox': email_service.outbox.stats()
         }
 
 # Global scheduler instance
-rent_scheduler = RentScheduler()
+rent_scheduler = RentScheduler(lease=scheduler_lease, ledger=notification_ledger)
 
 # Functions for external use
 def start_rent_scheduler():
@@ -224,9 +383,9 @@ def stop_rent_scheduler():
     """Stop the rent scheduler"""
     rent_scheduler.stop_scheduler()
 
-def manual_rent_check():
+def manual_rent_check(dry_run=False):
     """Manually trigger a rent check"""
-    rent_scheduler.run_manual_check()
+    return rent_scheduler.run_manual_check(dry_run)
 
 def get_scheduler_status():
     """Get scheduler status"""
@@ -0,0 +1,326 @@
+"""Daily rent checks for many landlords, sharded across worker processes.
+
+Landlords are listed in a JSON file (LANDLORDS_FILE, default landlords.json):
+
+    [
+      {"id": "acme", "email": "owner@acme.example", "data_file": "data/acme.json"},
+      {"id": "baker", "email": "ops@baker.example", "data_file": "data/baker.json", "db_path": "data/baker.db"}
+    ]
+
+Relative paths are resolved against the landlords file. Each landlord gets its
+own RentScheduler (data file, SQLite store and overdue-summary recipient).
+Landlords are spread over SCHEDULER_SHARDS shards, balanced by data file size,
+and every shard runs in its own worker process. A check that fails is retried
+on its own, so a retry never re-queues notices that already went out, and a
+shard whose process dies is retried without touching the other shards.
+
+Run once from the command line with:
+
+    python shard_runner.py [--landlords landlords.json] [--shards 4] [--only acme baker] [--dry-run]
+"""
+import argparse
+import heapq
+import json
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+import logging
+from email_service import email_service
+from scheduler_service import RentScheduler, record_run_metrics
+from profiling import profiler, span
+from timer_scheduler import timer_scheduler, TimerScheduler
+from scheduler_lease import scheduler_lease, SchedulerLease
+from notification_ledger import notification_ledger
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def load_landlords(path: str) -> List[Dict]:
+    """Landlord entries from the landlords file, with paths made absolute"""
+    with open(path, 'r') as file:
+        entries = json.load(file)
+    base_dir = os.path.dirname(os.path.abspath(path))
+    landlords = []
+    seen = set()
+    for position, entry in enumerate(entries):
+        landlord_id = str(entry.get('id') or entry.get('name') or position)
+        if landlord_id in seen:
+            raise ValueError(f"Duplicate landlord id {landlord_id!r} in {path}")
+        seen.add(landlord_id)
+        data_file = entry.get('data_file') or entry.get('dataFile')
+        if not data_file:
+            raise ValueError(f"Landlord {landlord_id!r} has no data_file in {path}")
+        data_file = os.path.join(base_dir, data_file)
+        db_path = entry.get('db_path') or entry.get('dbPath')
+        landlords.append({
+            'id': landlord_id,
+            'email': entry.get('email'),
+            'data_file': data_file,
+            # Each landlord's store lives next to its data file unless given explicitly
+            'db_path': os.path.join(base_dir, db_path) if db_path else os.path.splitext(data_file)[0] + '.db'
+        })
+    return landlords
+
+
+def partition(landlords: List[Dict], shard_count: int) -> List[List[Dict]]:
+    """Split landlords into at most shard_count shards of similar total data size.
+
+    Largest portfolios are placed first, each on the currently lightest shard.
+    """
+    shard_count = max(1, min(shard_count, len(landlords)))
+    shards = [[] for _ in range(shard_count)]
+    loads = [(0, index) for index in range(shard_count)]
+    weighted = sorted(
+        landlords,
+        key=lambda landlord: os.path.getsize(landlord['data_file']) if os.path.exists(landlord['data_file']) else 0,
+        reverse=True
+    )
+    for landlord in weighted:
+        load, index = heapq.heappop(loads)
+        shards[index].append(landlord)
+        size = os.path.getsize(landlord['data_file']) if os.path.exists(landlord['data_file']) else 0
+        heapq.heappush(loads, (load + size, index))
+    return [shard for shard in shards if shard]
+
+
+def run_shard(tasks: List[Dict]) -> Dict[str, Dict]:
+    """Run the daily checks for one shard's landlords (executes in a worker process)"""
+    # Workers only queue; the parent process's dispatcher delivers, so nothing is cut off when a worker exits
+    email_service.outbox.autostart = False
+    results = {}
+    for task in tasks:
+        started = time.monotonic()
+        try:
+            if not os.path.exists(task['data_file']):
+                raise FileNotFoundError(f"Data file not found: {task['data_file']}")
+            scheduler = RentScheduler(task['data_file'], db_path=task['db_path'], job_set=f"landlord:{task['id']}",
+                                      landlord_email=task['email'], ledger=notification_ledger)
+            try:
+                report = scheduler.run_daily_checks(task['checks'], task['dry_run'])
+            finally:
+                scheduler.store.close()
+        except Exception as e:
+            logger.error(f"Rent checks for landlord {task['id']} failed: {str(e)}")
+            report = {'overdue_tenants': None, 'reminders_queued': None, 'already_sent': {}, 'errors': {'setup': str(e)}}
+        report['duration_seconds'] = round(time.monotonic() - started, 3)
+        report['pid'] = os.getpid()
+        results[task['id']] = report
+    return results
+
+
+class ShardedRentRunner:
+    """Runs every landlord's daily checks across a pool of worker processes and merges one run report"""
+
+    def __init__(self, landlords_file: str = None, shards: int = None, max_attempts: int = None,
+                 retry_delay: float = None, start_method: str = None, scheduler: TimerScheduler = None,
+                 lease: SchedulerLease = None):
+        self.landlords_file = landlords_file or os.getenv('LANDLORDS_FILE', 'landlords.json')
+        self.shards = shards or int(os.getenv('SCHEDULER_SHARDS', str(os.cpu_count() or 1)))
+        self.max_attempts = max_attempts or int(os.getenv('SHARD_MAX_ATTEMPTS', '3'))
+        self.retry_delay = retry_delay if retry_delay is not None else float(os.getenv('SHARD_RETRY_DELAY_SECONDS', '5'))
+        # Workers are spawned fresh rather than forked from a process full of threads
+        self.start_method = start_method or os.getenv('SHARD_START_METHOD', 'spawn')
+        self.timer = scheduler or timer_scheduler
+        self.jobs = None
+        # When set, scheduled runs go ahead only while this worker holds the lease
+        self.lease = lease
+        self.last_report = None
+        self._run_lock = threading.Lock()
+
+    @property
+    def configured(self) -> bool:
+        return os.path.exists(self.landlords_file)
+
+    def run(self, landlord_ids: Optional[List[str]] = None, dry_run: bool = False) -> Dict:
+        """Run the checks for every landlord (or the given ids) and return the merged report.
+
+        With dry_run nothing is queued; the report says what would be sent.
+        """
+        if not self._run_lock.acquire(blocking=False):
+            raise RuntimeError("A sharded rent check is already running")
+        try:
+            # Profiled when armed: the span tree and functions cover this process; workers are not profiled
+            with profiler.scheduler_run('sharded rent checks') as profile:
+                report = self._run(landlord_ids, dry_run)
+            if profile is not None:
+                report['profile_id'] = profile.id
+            return report
+        finally:
+            self._run_lock.release()
+
+    def _run(self, landlord_ids: Optional[List[str]], dry_run: bool) -> Dict:
+        landlords = load_landlords(self.landlords_file)
+        if landlord_ids is not None:
+            wanted = set(landlord_ids)
+            unknown = wanted - {landlord['id'] for landlord in landlords}
+            if unknown:
+                raise ValueError(f"Unknown landlords: {', '.join(sorted(unknown))}")
+            landlords = [landlord for landlord in landlords if landlord['id'] in wanted]
+
+        started_at = datetime.now()
+        started = time.monotonic()
+        shards = partition(landlords, self.shards) if landlords else []
+        logger.info(f"Running rent checks for {len(landlords)} landlords in {len(shards)} shards")
+
+        results = {}
+        pending = {}
+        for index, shard in enumerate(shards):
+            pending[index] = [dict(landlord, checks=None, dry_run=dry_run) for landlord in shard]
+            for landlord in shard:
+                results[landlord['id']] = {'shard': index, 'attempts': 0, 'overdue_tenants': None,
+                                           'reminders_queued': None, 'already_sent': {}, 'errors': {},
+                                           'duration_seconds': 0.0}
+
+        for attempt in range(1, self.max_attempts + 1):
+            if not pending:
+                break
+            if attempt > 1:
+                delay = self.retry_delay * 2 ** (attempt - 2)
+                logger.warning(f"Retrying {sum(len(tasks) for tasks in pending.values())} landlords "
+                               f"in {len(pending)} shards in {delay:g}s (attempt {attempt})")
+                time.sleep(delay)
+            with span(f'attempt {attempt}'):
+                outcomes = self._run_round(pending)
+            retry = {}
+            for index, tasks in pending.items():
+                outcome = outcomes[index]
+                for task in tasks:
+                    result = results[task['id']]
+                    result['attempts'] += 1
+                    if isinstance(outcome, Exception):
+                        # The worker itself failed, so nothing in this shard is known to have run
+                        result['errors'] = {'shard': str(outcome) or type(outcome).__name__}
+                        retry.setdefault(index, []).append(task)
+                        continue
+                    report = outcome[task['id']]
+                    for key in ('overdue_tenants', 'reminders_queued'):
+                        if report[key] is not None:
+                            result[key] = report[key]
+                    result['already_sent'].update(report['already_sent'])
+                    for key in ('emails', 'would_send', 'estimated_seconds'):
+                        if key in report:
+                            result[key] = report[key]
+                    result['errors'] = report['errors']
+                    result['duration_seconds'] = round(result['duration_seconds'] + report['duration_seconds'], 3)
+                    if report['errors']:
+                        # Only the checks that failed run again, so nothing already queued is sent twice
+                        checks = task['checks'] if 'setup' in report['errors'] else sorted(report['errors'])
+                        retry.setdefault(index, []).append(dict(task, checks=checks))
+            pending = retry
+
+        if not dry_run:
+            # Deliver what the workers queued
+            email_service.outbox.start()
+        for result in results.values():
+            result['status'] = 'failed' if result['errors'] else 'succeeded'
+        failed = sorted(landlord_id for landlord_id, result in results.items() if result['errors'])
+        report = {
+            'run_id': uuid.uuid4().hex[:12],
+            'started_at': started_at.isoformat(timespec='seconds'),
+            'finished_at': datetime.now().isoformat(timespec='seconds'),
+            'duration_seconds': round(time.monotonic() - started, 3),
+            'landlords': len(landlords),
+            'shards': len(shards),
+            'succeeded': len(landlords) - len(failed),
+            'failed': failed,
+            'totals': {
+                key: sum(result[key] or 0 for result in results.values())
+                for key in ('overdue_tenants', 'reminders_queued')
+            },
+            'already_sent': {
+                name: sum(result['already_sent'].get(name, 0) for result in results.values())
+                for name in ('overdue', 'reminders')
+            },
+            'results': results
+        }
+        if dry_run:
+            emails = sum(result.get('emails', 0) for result in results.values())
+            report.update(dry_run=True, emails=emails,
+                          estimated_delivery_seconds=email_service.estimate_delivery_seconds(emails))
+        else:
+            # Workers' own counters die with their processes, so the merged report is what counts
+            record_run_metrics('sharded', report['duration_seconds'], report)
+        self.last_report = report
+        logger.info(f"Sharded rent checks finished in {report['duration_seconds']}s: "
+                    f"{report['succeeded']} landlords succeeded, {len(failed)} failed")
+        return report
+
+    def _run_round(self, pending: Dict[int, List[Dict]]) -> Dict[int, object]:
+        """Run each pending shard in its own process; a shard's outcome is its results or the exception it died with"""
+        with ThreadPoolExecutor(max_workers=min(len(pending), self.shards)) as threads:
+            futures = {index: threads.submit(self._run_isolated, tasks) for index, tasks in pending.items()}
+            outcomes = {}
+            for index, future in futures.items():
+                try:
+                    outcomes[index] = future.result()
+                except Exception as e:
+                    logger.error(f"Shard {index} failed: {str(e) or type(e).__name__}")
+                    outcomes[index] = e
+            return outcomes
+
+    def _run_isolated(self, tasks: List[Dict]) -> Dict[str, Dict]:
+        # A process of its own, so a crash breaks only this shard's pool
+        context = multiprocessing.get_context(self.start_method)
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            return pool.submit(run_shard, tasks).result()
+
+    def _run_scheduled(self):
+        if self.lease is not None and not self.lease.confirm():
+            logger.warning("Skipping scheduled sharded rent checks: this worker no longer holds the scheduler lease")
+            return
+        report = self.run()
+        if report['failed']:
+            # Recorded as a failed run in the job history
+            raise RuntimeError(f"Rent checks failed for {', '.join(report['failed'])}")
+
+    def start(self, cron: str = None):
+        """Run the sharded checks daily on the shared timer (RENT_CHECK_CRON, default 09:00)"""
+        self.jobs = self.timer.job_set('landlords')
+        self.jobs.add('sharded-daily-checks', self._run_scheduled, cron=cron or os.getenv('RENT_CHECK_CRON') or '0 9 * * *')
+        self.timer.start()
+        logger.info(f"Sharded rent checks scheduled for the landlords in {self.landlords_file}")
+
+    def stop(self):
+        if self.jobs is not None:
+            self.jobs.clear()
+        if not self.timer.job_count():
+            self.timer.stop()
+
+    def status(self) -> Dict:
+        return {
+            'configured': self.configured,
+            'landlords_file': self.landlords_file,
+            'shards': self.shards,
+            'max_attempts': self.max_attempts,
+            'running': bool(self.jobs and self.jobs.jobs),
+            'next_run': str(self.jobs.next_run()) if self.jobs and self.jobs.jobs else None,
+            'in_progress': self._run_lock.locked(),
+            'last_run': {key: value for key, value in self.last_report.items() if key != 'results'} if self.last_report else None
+        }
+
+
+# Global sharded runner instance
+sharded_rent_runner = ShardedRentRunner(lease=scheduler_lease)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run every landlord's daily rent checks across worker processes")
+    parser.add_argument('--landlords', default=None, help='Landlords file (default: LANDLORDS_FILE or landlords.json)')
+    parser.add_argument('--shards', type=int, default=None, help='Worker processes (default: SCHEDULER_SHARDS or CPU count)')
+    parser.add_argument('--only', nargs='+', default=None, help='Landlord ids to run')
+    parser.add_argument('--dry-run', action='store_true', help="Report what would be sent without queueing anything")
+    args = parser.parse_args()
+
+    runner = ShardedRentRunner(args.landlords, args.shards)
+    print(json.dumps(runner.run(args.only, args.dry_run), indent=2))
+
+
+if __name__ == '__main__':
+    main()
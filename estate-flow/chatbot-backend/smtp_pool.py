@@ -0,0 +1,257 @@
+import os
+import smtplib
+import socket
+import ssl
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Union
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Errors that mean the session itself is broken. Listed explicitly rather than as OSError,
+# which every smtplib.SMTPException derives from: a refused recipient or rejected message
+# (SMTPResponseException, SMTPRecipientsRefused) leaves a healthy session and is not retried
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError,
+                     smtplib.SMTPHeloError, ConnectionError, socket.timeout, ssl.SSLError)
+
+
+class SMTPPoolTimeout(Exception):
+    """Raised when no pooled connection became free within the acquire timeout"""
+
+
+class PooledConnection:
+    """An authenticated SMTP session plus the bookkeeping the pool needs"""
+
+    def __init__(self, smtp: smtplib.SMTP):
+        self.smtp = smtp
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.messages_sent = 0
+
+    def idle_for(self) -> float:
+        return time.monotonic() - self.last_used
+
+    def close(self):
+        try:
+            self.smtp.quit()
+        except Exception:
+            try:
+                self.smtp.close()
+            except Exception:
+                pass
+
+
+class SMTPConnectionPool:
+    """Bounded pool of logged-in SMTP sessions reused across sends.
+
+    A connection is opened (connect, STARTTLS, login) only when no idle one is
+    available and the pool is below max_size; otherwise callers wait for one
+    to be returned. Connections that sat idle longer than noop_after are
+    checked with NOOP before reuse, connections are retired after
+    max_messages sends (servers such as Gmail cap messages per session), and
+    connections idle longer than idle_timeout are closed by a reaper thread.
+    A send that fails because the session dropped is retried once on a fresh
+    connection.
+    """
+
+    def __init__(self, host: str, port: int, username: Optional[str] = None, password: Optional[str] = None,
+                 max_size: int = None, max_messages: int = None, idle_timeout: float = None,
+                 noop_after: float = None, acquire_timeout: float = None, use_tls: bool = True,
+                 connect_timeout: float = 30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.max_size = max_size or int(os.getenv('SMTP_POOL_SIZE', '4'))
+        self.max_messages = max_messages or int(os.getenv('SMTP_MAX_MESSAGES_PER_CONNECTION', '100'))
+        self.idle_timeout = idle_timeout if idle_timeout is not None else float(os.getenv('SMTP_IDLE_TIMEOUT', '60'))
+        self.noop_after = noop_after if noop_after is not None else float(os.getenv('SMTP_NOOP_AFTER', '10'))
+        self.acquire_timeout = acquire_timeout if acquire_timeout is not None else float(os.getenv('SMTP_ACQUIRE_TIMEOUT', '60'))
+        self.use_tls = use_tls
+        self.connect_timeout = connect_timeout
+
+        self._idle = []
+        self._open = 0
+        self._condition = threading.Condition()
+        self._reaper = None
+        self._closed = False
+
+        self.connections_opened = 0
+        self.connections_reused = 0
+        self.reconnects = 0
+        self.health_check_failures = 0
+        self.idle_evictions = 0
+        self.retired = 0
+        self.messages_sent = 0
+
+    def send(self, from_addr: str, to_addrs: Union[str, List[str]], message: Union[str, bytes]) -> Dict:
+        """Send one message over a pooled session; returns sendmail's refused-recipients dict"""
+        for attempt in range(2):
+            try:
+                with self.connection() as connection:
+                    refused = connection.smtp.sendmail(from_addr, to_addrs, message)
+                    connection.messages_sent += 1
+                    with self._condition:
+                        self.messages_sent += 1
+                    return refused
+            except CONNECTION_ERRORS as e:
+                if attempt:
+                    raise
+                with self._condition:
+                    self.reconnects += 1
+                logger.warning(f"SMTP session failed ({str(e)}), retrying on a new connection")
+
+    @contextmanager
+    def connection(self):
+        """Check out a healthy connection; it is discarded if the block raises a connection error"""
+        connection = self._acquire()
+        healthy = True
+        try:
+            yield connection
+        except CONNECTION_ERRORS:
+            healthy = False
+            raise
+        except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused):
+            # The server rejected this message but the session is still up;
+            # reset it so the next message starts clean
+            try:
+                connection.smtp.rset()
+            except Exception:
+                healthy = False
+            raise
+        finally:
+            self._release(connection, healthy)
+
+    def evict_idle(self) -> int:
+        """Close connections that have been idle longer than idle_timeout"""
+        with self._condition:
+            stale = [connection for connection in self._idle if connection.idle_for() > self.idle_timeout]
+            for connection in stale:
+                self._idle.remove(connection)
+                self._open -= 1
+            self.idle_evictions += len(stale)
+            if stale:
+                self._condition.notify_all()
+        for connection in stale:
+            connection.close()
+        return len(stale)
+
+    def close(self):
+        """Close every idle connection; connections in use are closed when returned"""
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+            self._condition.notify_all()
+        for connection in idle:
+            connection.close()
+
+    def stats(self) -> Dict:
+        with self._condition:
+            return {
+                'max_size': self.max_size,
+                'open': self._open,
+                'idle': len(self._idle),
+                'in_use': self._open - len(self._idle),
+                'connections_opened': self.connections_opened,
+                'connections_reused': self.connections_reused,
+                'reconnects': self.reconnects,
+                'health_check_failures': self.health_check_failures,
+                'idle_evictions': self.idle_evictions,
+                'retired': self.retired,
+                'messages_sent': self.messages_sent
+            }
+
+    def _acquire(self) -> PooledConnection:
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            with self._condition:
+                connection = None
+                while connection is None:
+                    if self._idle:
+                        # Most recently used first, so surplus connections age out at the bottom
+                        connection = self._idle.pop()
+                    elif self._open < self.max_size:
+                        self._open += 1
+                        break
+                    else:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise SMTPPoolTimeout(f"No SMTP connection free after {self.acquire_timeout}s")
+                        self._condition.wait(remaining)
+
+            if connection is None:
+                try:
+                    return self._open_connection()
+                except Exception:
+                    with self._condition:
+                        self._open -= 1
+                        self._condition.notify()
+                    raise
+
+            if self._is_healthy(connection):
+                with self._condition:
+                    self.connections_reused += 1
+                return connection
+            # Dead session: drop it and go round again (a new one can be opened in its place)
+            connection.close()
+            with self._condition:
+                self._open -= 1
+                self.health_check_failures += 1
+
+    def _release(self, connection: PooledConnection, healthy: bool):
+        connection.last_used = time.monotonic()
+        retire = not healthy or self._closed or connection.messages_sent >= self.max_messages
+        with self._condition:
+            if retire:
+                self._open -= 1
+                if healthy:
+                    self.retired += 1
+            else:
+                self._idle.append(connection)
+            self._condition.notify()
+        if retire:
+            connection.close()
+
+    def _is_healthy(self, connection: PooledConnection) -> bool:
+        if connection.idle_for() < self.noop_after:
+            return True
+        try:
+            code, _ = connection.smtp.noop()
+            return code == 250
+        except Exception:
+            return False
+
+    def _open_connection(self) -> PooledConnection:
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.connect_timeout)
+        try:
+            if self.use_tls:
+                smtp.starttls(context=ssl.create_default_context())
+            if self.username and self.password:
+                smtp.login(self.username, self.password)
+        except Exception:
+            smtp.close()
+            raise
+        with self._condition:
+            self.connections_opened += 1
+        logger.info(f"Opened SMTP connection to {self.host}:{self.port} ({self._open}/{self.max_size} open)")
+        self._start_reaper()
+        return PooledConnection(smtp)
+
+    def _start_reaper(self):
+        if self._reaper is not None or self.idle_timeout <= 0:
+            return
+        with self._condition:
+            if self._reaper is not None:
+                return
+            self._reaper = threading.Thread(target=self._reap, name='smtp-pool-reaper', daemon=True)
+            self._reaper.start()
+
+    def _reap(self):
+        while not self._closed:
+            time.sleep(max(1.0, self.idle_timeout / 2))
+            self.evict_idle()
@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def portfolio_fingerprint(properties: List[Dict]) -> str:
+    """Stable content hash of a properties payload.
+
+    The payload is normalized (sorted keys, compact separators) before hashing
+    so the same portfolio always maps to the same key regardless of key order.
+    """
+    normalized = json.dumps(properties, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+class PortfolioSnapshot:
+    """Everything derived from one portfolio version.
+
+    Holds the computed property_summary plus lazily built artifacts such as the
+    rendered system prompt and the fallback-analytics indexes, so repeated
+    questions against the same portfolio reuse them instead of recomputing.
+    lineage names the stored portfolio the version belongs to and version its
+    version number (both None for properties payloads), so caches can drop a
+    version once a newer one appears.
+    """
+
+    def __init__(self, key: str, summary: Dict, lineage: str = None, version: int = None):
+        self.key = key
+        self.summary = summary
+        self.lineage = lineage
+        self.version = version
+        self.created_at = time.monotonic()
+        self._artifacts = {}
+
+    def memo(self, name: str, factory: Callable):
+        """Return the named artifact, building it on first use"""
+        value = self._artifacts.get(name)
+        if value is None:
+            value = factory()
+            self._artifacts[name] = value
+        return value
+
+
+class SummaryCache:
+    """Bounded LRU cache of portfolio snapshots with a time-to-live"""
+
+    def __init__(self, max_entries: int = None, ttl_seconds: float = None):
+        self.max_entries = max_entries or int(os.getenv('SUMMARY_CACHE_SIZE', '64'))
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else float(os.getenv('SUMMARY_CACHE_TTL', '600'))
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get_or_build(self, key: str, build_summary: Callable[[], Dict], lineage: str = None,
+                     version: int = None) -> PortfolioSnapshot:
+        """Return the cached snapshot for key, computing the summary on a miss"""
+        with self._lock:
+            snapshot = self._entries.get(key)
+            if snapshot is not None and self._expired(snapshot):
+                del self._entries[key]
+                self.expirations += 1
+                snapshot = None
+            if snapshot is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return snapshot
+            self.misses += 1
+
+        # Build outside the lock so one large portfolio doesn't stall other requests
+        snapshot = PortfolioSnapshot(key, build_summary(), lineage, version)
+
+        with self._lock:
+            self._entries[key] = snapshot
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return snapshot
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        """Hit/miss counters for monitoring"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+    def _expired(self, snapshot: PortfolioSnapshot) -> bool:
+        return self.ttl_seconds > 0 and time.monotonic() - snapshot.created_at > self.ttl_seconds
+
+
+# Global summary cache instance
+summary_cache = SummaryCache()
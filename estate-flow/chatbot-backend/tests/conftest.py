@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The backend modules live flat in chatbot-backend/, next to this directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
@@ -0,0 +1,67 @@
+from email import message_from_string
+from email.errors import HeaderParseError
+from email.header import decode_header, make_header
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+import pytest
+
+from email_templates import MimeSkeleton
+
+
+def unfold(value):
+    return str(make_header(decode_header(value.replace('\n', ''))))
+
+
+def stdlib_message(sender, to_email, subject, body, boundary):
+    message = MIMEMultipart('alternative', boundary=boundary)
+    message['From'] = sender
+    message['To'] = to_email
+    message['Subject'] = subject
+    message.attach(MIMEText(body, 'plain'))
+    return message_from_string(message.as_string())
+
+
+@pytest.mark.parametrize('subject, to_email', [
+    ('Sunset\nBcc: victim@evil.example', 'tenant@example.com'),
+    ('Rent reminder\r', 'tenant@example.com'),
+    ('Rent reminder', 'tenant@example.com\nBcc: victim@evil.example'),
+])
+def test_line_breaks_in_headers_are_rejected(subject, to_email):
+    with pytest.raises(HeaderParseError):
+        MimeSkeleton('me@example.com').render(to_email, subject, 'Hello')
+
+
+def test_sender_with_line_break_is_rejected():
+    with pytest.raises(HeaderParseError):
+        MimeSkeleton('me@example.com\nBcc: victim@evil.example')
+
+
+@pytest.mark.parametrize('subject', [
+    'Rent Payment Reminder - Sunset Gardens',
+    'Rent Payment Reminder - ' + 'Sunset Gardens Apartment Homes ' * 5,
+    'Rappel de loyer - Résidence ' + 'Les Jardins du Soleil ' * 5,
+])
+def test_headers_parse_back_like_the_stdlib(subject):
+    skeleton = MimeSkeleton('me@example.com')
+    rendered = skeleton.render('tenant@example.com', subject, 'Hello')
+    # The boundary line is as long as the stdlib writes it; headers built from data are folded
+    head = [line for line in rendered.split('\n\n')[0].split('\n') if not line.startswith('Content-Type')]
+    assert all(len(line) <= 78 for line in head)
+
+    parsed = message_from_string(rendered)
+    expected = stdlib_message('me@example.com', 'tenant@example.com', subject, 'Hello', skeleton.boundary)
+    for name in ('From', 'To', 'Subject', 'Content-Type'):
+        assert unfold(parsed[name]) == unfold(expected[name])
+    assert parsed.get_payload()[0].get_payload() == 'Hello'
+
+
+def test_boundary_collision_leaves_the_skeleton_unchanged():
+    skeleton = MimeSkeleton('me@example.com')
+    boundary = skeleton.boundary
+    rendered = skeleton.render('tenant@example.com', 'Hi', f"text with {boundary} inside")
+
+    assert skeleton.boundary == boundary
+    parsed = message_from_string(rendered)
+    assert parsed.get_boundary() != boundary
+    assert boundary in parsed.get_payload()[0].get_payload()
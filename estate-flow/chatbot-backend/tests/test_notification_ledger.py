@@ -0,0 +1,48 @@
+import time
+
+from notification_ledger import NotificationLedger
+
+KEY = ('reminders', 'ana@example.com', 'Sunset Gardens/101', '2026-11-01', 'reminder')
+OTHER = ('reminders', 'li@example.com', 'Sunset Gardens/103', '2026-11-01', 'reminder')
+
+
+def make_ledger(tmp_path, claim_timeout=300):
+    return NotificationLedger(str(tmp_path / 'ledger.db'), capacity=1000, claim_timeout=claim_timeout)
+
+
+def test_claim_is_once_per_key(tmp_path):
+    ledger = make_ledger(tmp_path)
+    assert ledger.claim([KEY, OTHER]) == [True, True]
+    assert ledger.claim([KEY]) == [False]
+    assert ledger.already_sent([KEY, OTHER]) == [True, True]
+
+
+def test_abandoned_claim_is_sent_again(tmp_path):
+    ledger = make_ledger(tmp_path, claim_timeout=0.05)
+    ledger.claim([KEY, OTHER])
+    ledger.attach([OTHER], [7])
+
+    # The run died before queueing KEY's notice
+    time.sleep(0.1)
+    assert ledger.already_sent([KEY, OTHER]) == [False, True]
+    assert ledger.claim([KEY, OTHER]) == [True, False]
+    assert ledger.already_sent([KEY]) == [True]
+    assert ledger.claim([KEY]) == [False]
+
+
+def test_claim_taken_over_by_another_process(tmp_path):
+    first = make_ledger(tmp_path, claim_timeout=0.05)
+    second = make_ledger(tmp_path, claim_timeout=0.05)
+    first.claim([KEY])
+    assert second.claim([KEY]) == [False]
+    time.sleep(0.1)
+    assert second.claim([KEY]) == [True]
+    assert first.claim([KEY]) == [False]
+
+
+def test_released_keys_are_free(tmp_path):
+    ledger = make_ledger(tmp_path)
+    ledger.claim([KEY])
+    ledger.release([KEY])
+    assert ledger.already_sent([KEY]) == [False]
+    assert ledger.claim([KEY]) == [True]
@@ -0,0 +1,143 @@
+import time
+
+import pytest
+
+import outbox as outbox_module
+from outbox import DEAD, PENDING, SENDING, SENT, EmailOutbox
+
+
+class FakeSender:
+    """send_batch stand-in that records each batch and answers with the queued statuses"""
+
+    def __init__(self):
+        self.batches = []
+        self.statuses = []
+
+    def __call__(self, messages):
+        self.batches.append([message['id'] for message in messages])
+        results = []
+        for _ in messages:
+            status = self.statuses.pop(0) if self.statuses else 'sent'
+            if isinstance(status, Exception):
+                raise status
+            results.append({'status': status, 'error': None if status == 'sent' else f"{status} by fake"})
+        return results
+
+
+@pytest.fixture
+def sender():
+    return FakeSender()
+
+
+def make_outbox(path, sender, **overrides):
+    settings = dict(base_delay=10, max_delay=25, max_attempts=3, claim_timeout=60)
+    settings.update(overrides)
+    box = EmailOutbox(sender, path=str(path), **settings)
+    box.autostart = False
+    return box
+
+
+@pytest.fixture
+def outbox(tmp_path, sender):
+    return make_outbox(tmp_path / 'outbox.db', sender)
+
+
+def make_due(outbox):
+    with outbox._lock:
+        outbox._conn.execute("UPDATE outbox SET next_attempt_at = 0 WHERE status = ?", (PENDING,))
+
+
+def test_backoff_doubles_up_to_the_cap(outbox, monkeypatch):
+    monkeypatch.setattr(outbox_module.random, 'uniform', lambda low, high: 1.0)
+    assert [outbox.backoff(attempts) for attempts in (1, 2, 3, 10)] == [10, 20, 25, 25]
+
+
+def test_failed_message_waits_for_its_backoff(outbox, sender):
+    message_id = outbox.enqueue('tenant@example.com', 'Rent reminder', 'Rent is due')
+    sender.statuses = ['failed']
+    before = time.time()
+    assert outbox.dispatch_once() == 1
+
+    message = outbox.get(message_id)
+    assert (message['status'], message['attempts'], message['last_error']) == (PENDING, 1, 'failed by fake')
+    assert before + 8 <= message['next_attempt_at'] <= time.time() + 12
+    assert outbox.dispatch_once() == 0
+
+    make_due(outbox)
+    assert outbox.dispatch_once() == 1
+    message = outbox.get(message_id)
+    assert (message['status'], message['attempts'], message['last_error']) == (SENT, 2, None)
+    assert message['sent_at'] is not None
+    assert sender.batches == [[message_id], [message_id]]
+
+
+def test_message_is_dead_lettered_after_max_attempts(outbox, sender):
+    message_id = outbox.enqueue('tenant@example.com', 'Rent reminder', 'Rent is due')
+    sender.statuses = ['failed'] * 3
+    for _ in range(3):
+        make_due(outbox)
+        assert outbox.dispatch_once() == 1
+
+    message = outbox.get(message_id)
+    assert (message['status'], message['attempts']) == (DEAD, 3)
+    assert [dead['id'] for dead in outbox.dead_letters()] == [message_id]
+    make_due(outbox)
+    assert outbox.dispatch_once() == 0
+    assert outbox.stats()['dead_lettered_since_start'] == 1
+
+
+def test_skipped_and_crashed_batches(outbox, sender):
+    skipped, retried = outbox.enqueue_many([
+        ('', 'Rent reminder', 'Rent is due', False, None),
+        ('tenant@example.com', 'Rent reminder', 'Rent is due', False, None),
+    ])
+    sender.statuses = ['skipped', 'failed']
+    outbox.dispatch_once()
+    assert (outbox.get(skipped)['status'], outbox.get(skipped)['attempts']) == (DEAD, 1)
+    assert outbox.get(retried)['status'] == PENDING
+
+    # A send_batch that raises fails the whole batch instead of losing it
+    sender.statuses = [ConnectionError('smtp down')]
+    make_due(outbox)
+    outbox.dispatch_once()
+    message = outbox.get(retried)
+    assert (message['status'], message['attempts'], message['last_error']) == (PENDING, 2, 'smtp down')
+
+
+def test_retry_dead_requeues_with_a_fresh_budget(outbox, sender):
+    first, second, pending = outbox.enqueue_many([
+        ('a@example.com', 'Notice', 'Body', False, None),
+        ('b@example.com', 'Notice', 'Body', False, None),
+        ('c@example.com', 'Notice', 'Body', False, None),
+    ])
+    sender.statuses = ['skipped', 'skipped', 'failed']
+    outbox.dispatch_once()
+
+    assert outbox.retry_dead([first, pending]) == 1
+    assert (outbox.get(first)['status'], outbox.get(first)['attempts']) == (PENDING, 0)
+    assert outbox.get(second)['status'] == DEAD
+    assert outbox.get(pending)['attempts'] == 1
+    assert not outbox.stats()['dispatcher_running']
+
+    assert outbox.retry_dead() == 1
+    assert outbox.retry_dead() == 0
+    assert outbox.dispatch_once() == 2
+    assert {outbox.get(first)['status'], outbox.get(second)['status']} == {SENT}
+    assert outbox.get(pending)['status'] == PENDING
+
+
+def test_stale_sending_claims_are_released(tmp_path, sender):
+    crashed = make_outbox(tmp_path / 'outbox.db', sender)
+    message_id = crashed.enqueue('tenant@example.com', 'Rent reminder', 'Rent is due')
+    # Claimed by a dispatcher that died before reporting back
+    assert [message['id'] for message in crashed._claim_batch()] == [message_id]
+
+    survivor = make_outbox(tmp_path / 'outbox.db', sender, claim_timeout=0.1)
+    assert survivor.dispatch_once() == 0
+    assert survivor.get(message_id)['status'] == SENDING
+
+    time.sleep(0.15)
+    assert survivor.dispatch_once() == 1
+    message = survivor.get(message_id)
+    assert (message['status'], message['attempts']) == (SENT, 1)
+    assert sender.batches == [[message_id]]
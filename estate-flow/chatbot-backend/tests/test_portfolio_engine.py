@@ -0,0 +1,66 @@
+import math
+
+import numpy as np
+import pytest
+
+from portfolio_engine import normalize_rents, parse_rent
+
+# (value, rent, flagged)
+CASES = [
+    (2500, 2500.0, False),
+    (1875.5, 1875.5, False),
+    (1e20, 1e20, False),
+    ('2500', 2500.0, False),
+    ('$2,500.00', 2500.0, False),
+    ('€1.234,56', 1234.56, False),
+    ('3200,50', 3200.5, False),
+    ('2.5k', 2500.0, False),
+    ('', 0.0, False),
+    (None, 0.0, False),
+    ('1e3', 0.0, True),
+    ('1_000', 0.0, True),
+    ('nan', 0.0, True),
+    ('inf', 0.0, True),
+    ('-Infinity', 0.0, True),
+    (float('nan'), 0.0, True),
+    (float('inf'), 0.0, True),
+    (True, 0.0, True),
+    ('call me', 0.0, True),
+]
+
+NEIGHBOURS = [
+    [],
+    [1200],
+    ['1200'],
+    ['$1,200'],
+    ['1.234,56'],
+    [None, 1200],
+    ['two thousand', 950.0],
+    ['line\nbreak'],
+]
+
+
+@pytest.mark.parametrize('value, rent, flagged', CASES)
+def test_value_parses_the_same_in_any_column(value, rent, flagged):
+    assert parse_rent(value) == rent
+    for neighbours in NEIGHBOURS:
+        for column in ([value] + neighbours, neighbours + [value]):
+            rents, unparseable = normalize_rents(column)
+            position = next(i for i, cell in enumerate(column) if cell is value)
+            assert rents[position] == rent, column
+            assert unparseable[position] == flagged, column
+
+
+def test_whole_column_matches_each_value():
+    column = [value for value, _, _ in CASES]
+    rents, unparseable = normalize_rents(column)
+    for position, value in enumerate(column):
+        alone, alone_flag = normalize_rents([value])
+        assert rents[position] == alone[0]
+        assert unparseable[position] == alone_flag[0]
+    assert np.isfinite(rents).all()
+
+
+def test_parse_rent_is_finite():
+    for value in ('nan', 'inf', float('nan'), float('-inf')):
+        assert math.isfinite(parse_rent(value))
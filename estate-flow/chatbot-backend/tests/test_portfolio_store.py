@@ -0,0 +1,109 @@
+import threading
+
+import pytest
+
+from portfolio_store import PortfolioRecord
+
+
+def make_record():
+    record = PortfolioRecord('test')
+    record.load([
+        {'name': 'Maple Court', 'address': '1 Maple Drive', 'units': [
+            {'number': '101', 'rent': '$1,200', 'tenant': {'name': 'Sarah Johnson'}},
+            {'number': '102', 'rent': '$1,500', 'tenant': None},
+        ]},
+        {'name': 'Harbor Point', 'address': '9 Coast Highway', 'units': [
+            {'number': '1', 'rent': 2000, 'tenant': {'name': 'Mike Chen'}},
+        ]},
+    ])
+    return record
+
+
+def test_mixed_valid_and_invalid_delta_changes_nothing():
+    record = make_record()
+    index = record.ranking_index()
+    version = record.version
+    summary = record.summary()
+
+    with pytest.raises(ValueError):
+        record.apply_delta(
+            added=[{'property': 'Maple Court', 'unit': {'number': '103', 'rent': 9000, 'tenant': {'name': 'New'}}}],
+            changed=[{'property': 'Maple Court', 'unit': 'not a unit'}],
+            removed=[]
+        )
+
+    assert record.version == version
+    assert record.summary() is summary
+    assert '103' not in record.properties['Maple Court']['units']
+    assert record.ranking_index() is index
+    assert index.top_units('rent', 1)[0]['value'] == 2000
+
+
+def test_invalid_removal_changes_nothing():
+    record = make_record()
+    version = record.version
+
+    with pytest.raises(ValueError):
+        record.apply_delta(
+            added=[],
+            changed=[{'property': 'Maple Court', 'unit': {'number': '101', 'rent': 1, 'tenant': {'name': 'Sarah'}}}],
+            removed=['101']
+        )
+
+    assert record.version == version
+    assert record.properties['Maple Court']['units']['101']['rent'] == 1200
+
+
+def test_removed_properties_are_dropped():
+    record = make_record()
+    record.apply_delta(added=[], changed=[], removed=[], removed_properties=['Harbor Point'])
+
+    summary = record.summary()
+    assert summary['total_properties'] == 1
+    assert [prop['name'] for prop in summary['properties']] == ['Maple Court']
+    assert summary['monthly_revenue'] == 1200
+
+
+def test_delta_waits_for_ranking_index_readers():
+    record = make_record()
+    version = record.version
+    index = record.ranking_index()
+    delta = threading.Thread(target=record.apply_delta, kwargs={
+        'added': [{'property': 'Maple Court', 'unit': {'number': '103', 'rent': 9000, 'tenant': {'name': 'New'}}}],
+        'changed': [],
+        'removed': [{'property': 'Harbor Point', 'number': '1'}],
+    })
+
+    with record.ranking_index_at(version) as reading:
+        delta.start()
+        delta.join(0.2)
+        assert delta.is_alive()
+        assert reading.top_units('rent', 1)[0]['value'] == 2000
+        assert reading.find_unit('103') == []
+    delta.join()
+
+    with record.ranking_index_at(version) as reading:
+        assert reading is None
+    with record.ranking_index_at(record.version) as latest:
+        assert latest is index
+        assert latest.top_units('rent', 1)[0]['value'] == 9000
+        assert latest.find_unit('1') == []
+
+
+@pytest.mark.parametrize('properties, message', [
+    ([{'name': 'Maple Court', 'units': [{'number': '101', 'rent': 1200}, {'number': 101, 'rent': 1300}]}],
+     'Duplicate unit 101 at Maple Court'),
+    ([{'name': 'Maple Court', 'units': [{'number': '101', 'rent': 1200}]},
+      {'name': 'Maple Court', 'units': [{'number': '102', 'rent': 1300}]}],
+     'Duplicate property Maple Court'),
+])
+def test_duplicates_are_rejected_not_merged(properties, message):
+    record = make_record()
+    version = record.version
+    summary = record.summary()
+
+    with pytest.raises(ValueError, match=message):
+        record.load(properties)
+
+    assert record.version == version
+    assert record.summary() is summary
@@ -0,0 +1,11 @@
+from profiling import Profiler
+
+
+def test_profiling_is_off_unless_enabled(monkeypatch):
+    monkeypatch.delenv('PROFILING_ENABLED', raising=False)
+    assert Profiler().requested_mode('1') is None
+
+    monkeypatch.setenv('PROFILING_ENABLED', 'true')
+    assert Profiler().requested_mode('1') == 'deterministic'
+    assert Profiler().requested_mode('sample') == 'sample'
+    assert Profiler().requested_mode('0') is None
@@ -0,0 +1,36 @@
+from datetime import date
+
+from property_db import PropertyDatabase
+
+
+def tenant(name, paid, lease_end):
+    return {'rentPaid': paid, 'tenant': {'name': name, 'leaseEnd': lease_end}}
+
+
+def test_scheduled_tenants_skips_paid_tenants_with_past_leases(tmp_path):
+    store = PropertyDatabase(str(tmp_path / 'properties.db'))
+    store.import_properties([{'name': 'Sunset Gardens', 'units': [
+        dict(tenant('Unpaid, lease ended', False, '2026-01-31'), number='101'),
+        dict(tenant('Paid, lease ended', True, '2026-01-31'), number='102'),
+        dict(tenant('Paid, lease ends later', True, '2026-12-31'), number='103'),
+        dict(tenant('Paid, no lease end', True, None), number='104'),
+        dict(tenant('Unpaid, lease ends later', False, '2026-11-30'), number='105'),
+        dict(tenant('Paid, lease ends today', True, '2026-10-18'), number='106'),
+    ]}])
+
+    names = [row['tenant_name'] for row in store.scheduled_tenants(date(2026, 10, 18))]
+    assert names == ['Unpaid, lease ended', 'Paid, lease ends later', 'Unpaid, lease ends later',
+                     'Paid, lease ends today']
+
+
+def test_scheduled_tenants_reads_through_the_indexes(tmp_path):
+    store = PropertyDatabase(str(tmp_path / 'properties.db'))
+    statements = []
+    store._conn.set_trace_callback(statements.append)
+    store.scheduled_tenants(date(2026, 10, 18))
+    store._conn.set_trace_callback(None)
+
+    plan = ' '.join(row[3] for row in store._conn.execute(f"EXPLAIN QUERY PLAN {statements[-1]}"))
+    assert 'idx_tenants_rent_paid_due_day' in plan
+    assert 'idx_tenants_lease_end' in plan
+    assert 'SCAN t' not in plan
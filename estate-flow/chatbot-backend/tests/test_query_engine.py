@@ -0,0 +1,85 @@
+import pytest
+
+from portfolio_engine import PortfolioFrame
+from query_engine import QueryEngine, QueryPlanner
+
+PROPERTIES = [
+    {'name': 'Sunset Gardens', 'address': '12 Sunset Blvd', 'units': [
+        {'number': '101', 'bedrooms': 1, 'bathrooms': 1, 'squareFeet': 650, 'rent': 1400, 'tenant': {'name': 'Ana Ruiz'}},
+        {'number': '102', 'bedrooms': 2, 'bathrooms': 1, 'squareFeet': 900, 'rent': 1900, 'tenant': None},
+        {'number': '103', 'bedrooms': 3, 'bathrooms': 2, 'squareFeet': 1200, 'rent': 2600, 'tenant': {'name': 'Li Wei'}},
+    ]},
+    {'name': 'Harbor Point', 'address': '9 Coast Highway', 'units': [
+        {'number': '1', 'bedrooms': 2, 'bathrooms': 2, 'squareFeet': 1000, 'rent': 2200, 'tenant': None},
+        {'number': '2', 'bedrooms': 4, 'bathrooms': 3, 'squareFeet': 1600, 'rent': 3400, 'tenant': {'name': 'Sam Cole'}},
+    ]},
+]
+NAMES = ['Sunset Gardens', 'Harbor Point']
+
+planner = QueryPlanner()
+
+
+def answer(question):
+    query = planner.plan(question, NAMES)
+    assert query is not None, question
+    return query, QueryEngine().execute(query, PortfolioFrame.from_properties(PROPERTIES))
+
+
+@pytest.mark.parametrize('question', [
+    'Is unit 101 occupied?',
+    'Which property has the most vacant units?',
+    'Which property has the highest occupancy?',
+    'How many units are over 1000 square feet?',
+    'What is the rent for units over 1000 sq ft?',
+    'Which units have occupancy above 90%?',
+    'How many tenants have been here more than 2 years?',
+    'How many units at Sunset Gardens versus Harbor Point?',
+    'What is the most common rent?',
+])
+def test_unplanned_questions_go_to_the_model(question):
+    assert planner.plan(question, NAMES) is None
+
+
+def test_more_than_bedrooms_is_a_lower_bound():
+    query, response = answer('How many units have more than 2 bedrooms?')
+    assert (query.min_bedrooms, query.max_bedrooms) == (3, None)
+    assert query.min_rent is None and query.max_rent is None
+    assert response.startswith('You have 2 units with 3 or more bedrooms')
+
+
+@pytest.mark.parametrize('question, bounds', [
+    ('How many units have 2 bedrooms?', (2, 2)),
+    ('How many units have at least 3 bedrooms?', (3, None)),
+    ('How many units have 2+ bedrooms?', (2, None)),
+    ('How many units have 2 bedrooms or fewer?', (None, 2)),
+    ('How many units have fewer than 3 bedrooms?', (None, 2)),
+    ('How many units are studios?', (0, 0)),
+])
+def test_bedroom_bounds(question, bounds):
+    query = planner.plan(question, NAMES)
+    assert (query.min_bedrooms, query.max_bedrooms) == bounds
+
+
+def test_cheapest_vacant_unit_lists_vacancies():
+    query, response = answer('What is the cheapest vacant unit?')
+    assert query.intent == 'cheapest_vacant'
+    assert 'unit 102 at Sunset Gardens' in response
+    assert '$1,900.00' in response
+
+
+def test_rent_bounds_need_a_dollar_sign_or_rent_word():
+    query = planner.plan('Which vacant 2 bedroom units at Sunset Gardens are under $2,000?', NAMES)
+    assert query.intent == 'list_vacant'
+    assert query.property_names == ['Sunset Gardens']
+    assert (query.min_bedrooms, query.max_bedrooms, query.max_rent) == (2, 2, 2000)
+
+    query = planner.plan('How many units rent for over 2000?', NAMES)
+    assert query.min_rent == 2000
+
+
+def test_supported_questions_still_plan():
+    assert planner.plan('Which property performs best?', NAMES).intent == 'best_property'
+    query = planner.plan('top 10 vacant units by rent per square foot', NAMES)
+    assert (query.intent, query.limit, query.metric) == ('ranked_units', 10, 'rent_per_sqft')
+    assert planner.plan('Where does unit 101 rank by rent?', NAMES).unit_number == '101'
+    assert planner.plan("What's my occupancy rate?", NAMES).intent == 'occupancy'
@@ -0,0 +1,80 @@
+import pytest
+
+from response_cache import ResponseCache
+from summary_cache import PortfolioSnapshot
+
+QUESTION = 'How can I improve my portfolio?'
+
+
+def snapshot(version=1):
+    return PortfolioSnapshot(f"portfolio:abc:{version}", {'properties': []}, lineage='portfolio:abc', version=version)
+
+
+def make_cache():
+    return ResponseCache(max_entries=100, per_portfolio=10, ttl_seconds=0, enabled=True)
+
+
+@pytest.mark.parametrize('question', [
+    'how could we improve the portfolio',
+    'Actually, how can I improve my portfolio?',
+    'how can i improve my portfolios',
+])
+def test_rewording_reuses_the_answer(question):
+    cache = make_cache()
+    current = snapshot()
+    cache.store(current, QUESTION, 'answer', seconds=1.0)
+    assert cache.lookup(current, question) == 'answer'
+    assert cache.stats()['reworded_hits'] == 1
+
+
+def test_same_question_is_an_exact_hit():
+    cache = make_cache()
+    current = snapshot()
+    cache.store(current, QUESTION, 'answer', seconds=1.0)
+    assert cache.lookup(current, QUESTION) == 'answer'
+    assert cache.stats()['exact_hits'] == 1
+
+
+@pytest.mark.parametrize('question', [
+    'How can I improve my portfolio in spanish?',
+    'How can I improve my portfolio in french?',
+    'Write a short email on how I can improve my portfolio',
+    'How can I improve my portfolio, as a table?',
+    'Politely, how can I improve my portfolio?',
+])
+def test_extra_words_ask_for_a_different_answer(question):
+    cache = make_cache()
+    current = snapshot()
+    cache.store(current, QUESTION, 'answer', seconds=1.0)
+    assert cache.lookup(current, question) is None
+
+    # Nor the other way round
+    cache = make_cache()
+    cache.store(current, question, 'answer', seconds=1.0)
+    assert cache.lookup(current, QUESTION) is None
+
+
+@pytest.mark.parametrize('stored, asked', [
+    ('Should I move tenants from Sunset Gardens to Ocean View?',
+     'Should I move tenants from Ocean View to Sunset Gardens?'),
+    ('Is Sunset Gardens doing better than Ocean View?', 'Is Ocean View doing better than Sunset Gardens?'),
+    ('What was my revenue?', 'What will my revenue be?'),
+    ('Should I raise the rent?', 'Can I raise the rent?'),
+])
+def test_order_tense_and_direction_matter(stored, asked):
+    cache = make_cache()
+    current = snapshot()
+    cache.store(current, stored, 'answer', seconds=1.0)
+    assert cache.lookup(current, asked) is None
+
+
+def test_older_version_never_replaces_a_newer_one():
+    cache = make_cache()
+    newer = snapshot(2)
+    cache.store(newer, QUESTION, 'new answer', seconds=1.0)
+
+    # Built after the newer one (e.g. a request that read the portfolio just before a delta)
+    older = snapshot(1)
+    cache.store(older, QUESTION, 'old answer', seconds=1.0)
+    assert cache.lookup(older, QUESTION) is None
+    assert cache.lookup(newer, QUESTION) == 'new answer'
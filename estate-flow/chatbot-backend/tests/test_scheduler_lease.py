@@ -0,0 +1,91 @@
+import time
+
+import pytest
+
+from scheduler_lease import SchedulerLease
+
+TTL = 0.2
+
+
+@pytest.fixture
+def leases(tmp_path):
+    path = str(tmp_path / 'lease.db')
+    # A long heartbeat keeps the watcher threads out of the way; the tests tick by hand
+    pair = [SchedulerLease(path=path, ttl=TTL, heartbeat=60, worker_id=worker) for worker in ('a', 'b')]
+    events = []
+    for lease in pair:
+        lease.on_acquired = lambda worker=lease.worker_id: events.append(('acquired', worker))
+        lease.on_lost = lambda worker=lease.worker_id: events.append(('lost', worker))
+    yield pair + [events]
+    for lease in pair:
+        lease.stop()
+
+
+def test_takeover_after_expiry(leases):
+    a, b, events = leases
+    a.enable()
+    b.tick()
+    assert a.is_leader and not b.is_leader
+    assert b.status()['holder'] == 'a'
+
+    time.sleep(TTL * 1.5)
+    assert not a.confirm()
+    b.tick()
+    assert b.is_leader
+    assert b.status()['holder'] == 'b'
+
+    a.tick()
+    assert not a.is_leader
+    assert events == [('acquired', 'a'), ('acquired', 'b'), ('lost', 'a')]
+
+
+def test_fencing_token_goes_up_on_each_new_holder(leases):
+    a, b, _ = leases
+    a.enable()
+    assert a.status()['fencing_token'] == 1
+
+    a.tick()
+    assert a.confirm()
+    assert a.status()['fencing_token'] == 1
+
+    time.sleep(TTL * 1.5)
+    b.tick()
+    assert b.status()['fencing_token'] == 2
+
+    b.stop()
+    a.tick()
+    assert a.is_leader
+    assert a.status()['fencing_token'] == 3
+
+
+def test_disable_and_enable_hand_the_lease_over(leases):
+    a, b, events = leases
+    a.enable()
+    b.disable()
+    assert b.status()['enabled'] is False
+    assert a.is_leader
+
+    a.tick()
+    assert not a.is_leader
+    assert a.status()['holder'] is None
+
+    # Released rather than left to expire, so the next worker takes it straight away
+    b.enable()
+    assert b.is_leader
+    a.tick()
+    assert not a.is_leader
+    assert events == [('acquired', 'a'), ('lost', 'a'), ('acquired', 'b')]
+
+
+def test_failed_start_releases_the_lease(leases):
+    a, b, _ = leases
+
+    def fail():
+        raise RuntimeError('no scheduler here')
+
+    a.on_acquired = fail
+    a.enable()
+    assert not a.is_leader
+    assert a.status()['holder'] is None
+    b.tick()
+    assert b.is_leader
@@ -0,0 +1,74 @@
+import smtplib
+
+import pytest
+
+import smtp_pool
+from smtp_pool import SMTPConnectionPool
+
+
+class FakeSMTP:
+    """Stands in for smtplib.SMTP; sendmail raises the next queued error, if any"""
+    instances = []
+    errors = []
+
+    def __init__(self, host, port, timeout=None):
+        self.sent = 0
+        self.resets = 0
+        self.closed = False
+        FakeSMTP.instances.append(self)
+
+    def sendmail(self, from_addr, to_addrs, message):
+        if FakeSMTP.errors:
+            raise FakeSMTP.errors.pop(0)
+        self.sent += 1
+        return {}
+
+    def rset(self):
+        self.resets += 1
+
+    def noop(self):
+        return 250, b'OK'
+
+    def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    FakeSMTP.instances = []
+    FakeSMTP.errors = []
+    monkeypatch.setattr(smtp_pool.smtplib, 'SMTP', FakeSMTP)
+    return SMTPConnectionPool('smtp.test', 587, max_size=1, idle_timeout=0, use_tls=False)
+
+
+@pytest.mark.parametrize('error', [
+    smtplib.SMTPRecipientsRefused({'bad@example.com': (550, b'No such user')}),
+    smtplib.SMTPDataError(554, b'Message rejected'),
+    smtplib.SMTPSenderRefused(553, b'Sender refused', 'me@example.com'),
+])
+def test_rejection_resets_and_keeps_the_session(pool, error):
+    FakeSMTP.errors = [error]
+    with pytest.raises(type(error)):
+        pool.send('me@example.com', ['bad@example.com'], 'hi')
+
+    assert len(FakeSMTP.instances) == 1
+    session = FakeSMTP.instances[0]
+    assert session.resets == 1 and not session.closed
+    assert pool.stats()['reconnects'] == 0
+
+    pool.send('me@example.com', ['ok@example.com'], 'hi')
+    assert len(FakeSMTP.instances) == 1
+    assert session.sent == 1
+
+
+def test_dropped_session_retries_on_a_new_connection(pool):
+    FakeSMTP.errors = [smtplib.SMTPServerDisconnected('gone')]
+    pool.send('me@example.com', ['ok@example.com'], 'hi')
+
+    assert len(FakeSMTP.instances) == 2
+    assert FakeSMTP.instances[0].closed
+    assert FakeSMTP.instances[1].sent == 1
+    assert pool.stats()['reconnects'] == 1
@@ -0,0 +1,108 @@
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+from timer_scheduler import CronExpression, TimerScheduler
+
+
+def test_fields_parse_ranges_lists_and_steps():
+    cron = CronExpression('*/15 9-17/2 1,15 */3 1-5')
+    assert cron.minutes == {0, 15, 30, 45}
+    assert cron.hours == {9, 11, 13, 15, 17}
+    assert cron.days == {1, 15}
+    assert cron.months == {1, 4, 7, 10}
+    assert cron.weekdays == {1, 2, 3, 4, 5}
+    assert CronExpression('0 0 * * 7').weekdays == {0}
+    assert CronExpression('5/20 * * * *').minutes == {5, 25, 45}
+
+
+@pytest.mark.parametrize('expression', [
+    '* * * *', '60 * * * *', '* 24 * * *', '0 0 0 * *', '0 0 * 13 *', '0 0 * * 8',
+    '5-1 * * * *', '*/0 * * * *', 'a * * * *',
+])
+def test_invalid_fields_are_rejected(expression):
+    with pytest.raises(ValueError):
+        CronExpression(expression)
+
+
+def test_day_of_month_or_day_of_week():
+    # 2026-10-18 is a Sunday; the 1st or any Monday matches
+    cron = CronExpression('0 0 1 * 1')
+    assert cron.next_after(datetime(2026, 10, 18, 12, 0)) == datetime(2026, 10, 19)
+    assert cron.next_after(datetime(2026, 10, 26)) == datetime(2026, 11, 1)
+    # With one day field left as *, only the other one counts
+    assert CronExpression('0 0 * * 1').next_after(datetime(2026, 10, 18)) == datetime(2026, 10, 19)
+    assert CronExpression('0 0 1 * *').next_after(datetime(2026, 10, 18)) == datetime(2026, 11, 1)
+
+
+@pytest.mark.parametrize('expression, after, expected', [
+    ('0 0 31 * *', datetime(2026, 4, 1), datetime(2026, 5, 31)),
+    ('0 9 * * *', datetime(2026, 1, 31, 9, 0), datetime(2026, 2, 1, 9, 0)),
+    ('30 23 31 12 *', datetime(2026, 12, 31, 23, 30), datetime(2027, 12, 31, 23, 30)),
+    ('@yearly', datetime(2026, 12, 31, 23, 59, 30), datetime(2027, 1, 1)),
+    ('0 12 29 2 *', datetime(2026, 3, 1), datetime(2028, 2, 29, 12, 0)),
+    ('*/10 * * * *', datetime(2026, 12, 31, 23, 55), datetime(2027, 1, 1)),
+])
+def test_next_after_crosses_month_and_year_ends(expression, after, expected):
+    assert CronExpression(expression).next_after(after) == expected
+
+
+def test_impossible_date_never_matches():
+    with pytest.raises(ValueError):
+        CronExpression('0 0 31 2 *').next_after(datetime(2026, 1, 1))
+
+
+def live_jobs(scheduler):
+    return [entry[3] for entry in scheduler._heap if entry[2] == entry[3].generation]
+
+
+def test_replacing_a_job_invalidates_its_heap_entry():
+    scheduler = TimerScheduler(workers=1)
+    jobs = scheduler.job_set('landlord')
+    old = jobs.add('rent', lambda: None, interval_seconds=60)
+    new = jobs.add('rent', lambda: None, cron='0 9 * * *')
+
+    assert jobs.jobs['rent'] is new
+    assert {entry[3] for entry in scheduler._heap} == {old, new}
+    assert live_jobs(scheduler) == [new]
+
+
+def test_removing_a_job_invalidates_its_heap_entry():
+    scheduler = TimerScheduler(workers=1)
+    jobs = scheduler.job_set('landlord')
+    jobs.add('rent', lambda: None, interval_seconds=60)
+    kept = jobs.add('leases', lambda: None, interval_seconds=60)
+
+    assert jobs.remove('rent')
+    assert not jobs.remove('rent')
+    assert live_jobs(scheduler) == [kept]
+    scheduler.remove_job_set('landlord')
+    assert live_jobs(scheduler) == []
+    assert scheduler.job_count() == 0
+
+
+def test_replaced_and_removed_jobs_never_run():
+    scheduler = TimerScheduler(workers=2)
+    jobs = scheduler.job_set('landlord')
+    runs = {'old': 0, 'removed': 0}
+    ran = threading.Event()
+
+    def count(name):
+        runs[name] += 1
+
+    jobs.add('rent', lambda: count('old'), interval_seconds=0.05)
+    jobs.add('rent', ran.set, interval_seconds=0.05)
+    jobs.add('leases', lambda: count('removed'), interval_seconds=0.05)
+    jobs.remove('leases')
+
+    scheduler.start()
+    try:
+        assert ran.wait(2)
+        time.sleep(0.2)
+    finally:
+        scheduler.stop(wait=True)
+
+    assert runs == {'old': 0, 'removed': 0}
+    assert jobs.jobs['rent'].run_count >= 2
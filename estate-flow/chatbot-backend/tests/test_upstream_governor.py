@@ -0,0 +1,153 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from upstream_governor import CircuitBreaker, UpstreamGovernor, UpstreamUnavailable
+
+
+def make_governor(**overrides):
+    settings = dict(max_concurrency=1, requests_per_minute=6000, tokens_per_minute=600000,
+                    queue_timeout=1, max_queue=1, failure_threshold=2, cooldown=0.1)
+    settings.update(overrides)
+    return UpstreamGovernor('test', **settings)
+
+
+def wait_until(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_full_queue_is_refused_at_once():
+    governor = make_governor()
+    permit = governor.acquire(10)
+    admitted = []
+    waiter = threading.Thread(target=lambda: admitted.append(governor.acquire(10)))
+    waiter.start()
+    wait_until(lambda: governor.slots.waiting == 1)
+
+    started = time.monotonic()
+    with pytest.raises(UpstreamUnavailable) as error:
+        governor.acquire(10)
+    assert error.value.reason == 'queue_full'
+    assert time.monotonic() - started < 0.5
+
+    with permit:
+        pass
+    waiter.join(2)
+    assert len(admitted) == 1
+    assert governor.stats()['in_flight'] == 1
+    assert governor.stats()['queued'] == 0
+
+
+def test_queue_timeout_leaves_the_queue():
+    governor = make_governor(queue_timeout=0.05)
+    permit = governor.acquire(10)
+
+    with pytest.raises(UpstreamUnavailable) as error:
+        governor.acquire(10)
+    assert error.value.reason == 'queue_timeout'
+    assert governor.slots.waiting == 0
+
+    with permit:
+        pass
+    assert governor.slots.in_use == 0
+    with governor.acquire(10):
+        pass
+
+
+def fail(governor):
+    with pytest.raises(ConnectionError):
+        with governor.acquire(10):
+            raise ConnectionError('upstream down')
+
+
+def test_breaker_opens_half_opens_and_closes():
+    governor = make_governor(max_concurrency=2, max_queue=2)
+    fail(governor)
+    assert governor.breaker.state == CircuitBreaker.CLOSED
+    fail(governor)
+    assert governor.breaker.state == CircuitBreaker.OPEN
+
+    with pytest.raises(UpstreamUnavailable) as error:
+        governor.acquire(10)
+    assert error.value.reason == 'circuit_open'
+    assert 0 < error.value.retry_after <= 0.1
+
+    time.sleep(0.12)
+    probe = governor.acquire(10)
+    assert governor.breaker.state == CircuitBreaker.HALF_OPEN
+    # Only the one probe goes through while half open
+    with pytest.raises(UpstreamUnavailable):
+        governor.acquire(10)
+    with probe:
+        pass
+    assert governor.breaker.state == CircuitBreaker.CLOSED
+    assert governor.breaker.failures == 0
+    with governor.acquire(10):
+        pass
+
+
+def test_failed_probe_reopens_the_breaker():
+    governor = make_governor()
+    fail(governor)
+    fail(governor)
+    time.sleep(0.12)
+    fail(governor)
+    assert governor.breaker.state == CircuitBreaker.OPEN
+    assert governor.breaker.times_opened == 2
+
+
+def test_client_error_does_not_count_as_upstream_failure():
+    governor = make_governor(failure_threshold=1)
+    error = ValueError('bad request')
+    error.status_code = 400
+    with pytest.raises(ValueError):
+        with governor.acquire(10):
+            raise error
+    assert governor.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_cancelled_async_waiter_gives_up_its_place():
+    governor = make_governor()
+
+    async def scenario():
+        permit = await governor.acquire_async(10)
+        waiter = asyncio.create_task(governor.acquire_async(10))
+        await asyncio.sleep(0.01)
+        assert governor.slots.waiting == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert governor.slots.waiting == 0
+        with permit:
+            pass
+
+    asyncio.run(scenario())
+    assert governor.slots.in_use == 0
+    with governor.acquire(10):
+        pass
+
+
+def test_slot_handed_to_a_cancelled_async_waiter_is_released():
+    governor = make_governor()
+
+    async def scenario():
+        permit = await governor.acquire_async(10)
+        waiter = asyncio.create_task(governor.acquire_async(10))
+        await asyncio.sleep(0.01)
+        # The slot goes to the waiter, which is cancelled before it can use it
+        with permit:
+            pass
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+    asyncio.run(scenario())
+    assert governor.slots.waiting == 0
+    assert governor.slots.in_use == 0
+    with governor.acquire(10):
+        pass
@@ -0,0 +1,325 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CRON_ALIASES = {
+    '@yearly': '0 0 1 1 *',
+    '@annually': '0 0 1 1 *',
+    '@monthly': '0 0 1 * *',
+    '@weekly': '0 0 * * 0',
+    '@daily': '0 0 * * *',
+    '@midnight': '0 0 * * *',
+    '@hourly': '0 * * * *',
+}
+
+# Longest single sleep: deadlines are wall-clock times, so re-check now and
+# then in case the system clock was changed while we slept
+MAX_SLEEP_SECONDS = 300
+
+
+class CronExpression:
+    """Five-field cron expression: minute hour day-of-month month day-of-week.
+
+    Fields accept *, numbers, ranges (1-5), lists (1,15) and steps (*/15,
+    9-17/2). Day of week runs 0-6 from Sunday (7 is also Sunday). As in
+    cron, when both day fields are restricted a day matching either one
+    counts. The @daily/@hourly/... aliases are accepted too.
+    """
+
+    FIELD_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 6))
+
+    def __init__(self, expression: str):
+        self.expression = expression.strip()
+        fields = CRON_ALIASES.get(self.expression, self.expression).split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression needs 5 fields, got {len(fields)}: {expression!r}")
+        parsed = []
+        for field, (low, high) in zip(fields, self.FIELD_RANGES):
+            parsed.append(self._parse_field(field, low, high, expression))
+        self.minutes, self.hours, self.days, self.months, weekdays = parsed
+        self.weekdays = {day % 7 for day in weekdays}
+        self._any_day = fields[2] == '*'
+        self._any_weekday = fields[4] == '*'
+
+    @staticmethod
+    def _parse_field(field: str, low: int, high: int, expression: str) -> set:
+        values = set()
+        # Day of week also accepts 7 for Sunday
+        high = 7 if (low, high) == (0, 6) else high
+        for part in field.split(','):
+            value_range, _, step = part.partition('/')
+            try:
+                step = int(step) if step else 1
+                if value_range == '*':
+                    start, end = low, high
+                elif '-' in value_range:
+                    start, end = (int(bound) for bound in value_range.split('-', 1))
+                else:
+                    start = int(value_range)
+                    end = high if step > 1 else start
+            except ValueError:
+                raise ValueError(f"Invalid cron field {field!r} in {expression!r}")
+            if step < 1 or start < low or end > high or start > end:
+                raise ValueError(f"Cron field {field!r} out of range {low}-{high} in {expression!r}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, moment: datetime) -> bool:
+        day_ok = moment.day in self.days
+        weekday_ok = (moment.isoweekday() % 7) in self.weekdays
+        if self._any_day:
+            return weekday_ok
+        if self._any_weekday:
+            return day_ok
+        return day_ok or weekday_ok
+
+    def next_after(self, moment: datetime) -> datetime:
+        """First matching minute strictly after moment"""
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = candidate + timedelta(days=366 * 5)
+        while candidate < limit:
+            if candidate.month not in self.months:
+                month_start = candidate.replace(day=1, hour=0, minute=0)
+                candidate = (month_start + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + timedelta(days=1)
+            elif candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+            elif candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+            else:
+                return candidate
+        raise ValueError(f"Cron expression {self.expression!r} never matches")
+
+    def __str__(self):
+        return self.expression
+
+
+class Job:
+    """A callback run on a cron schedule or at a fixed interval, with its recent runs"""
+
+    def __init__(self, job_set: str, name: str, callback: Callable, cron: Optional[str] = None,
+                 interval_seconds: Optional[float] = None, history_size: int = None):
+        if (cron is None) == (interval_seconds is None):
+            raise ValueError("A job needs exactly one of cron or interval_seconds")
+        self.job_set = job_set
+        self.name = name
+        self.callback = callback
+        self.cron = CronExpression(cron) if cron is not None else None
+        self.interval_seconds = interval_seconds
+        self.next_run = None
+        self.running = False
+        self.run_count = 0
+        self.history = deque(maxlen=history_size or int(os.getenv('JOB_HISTORY_SIZE', '20')))
+        # Bumped on every reschedule/removal; heap entries with an older generation are stale
+        self.generation = 0
+
+    def schedule_next(self, after: datetime):
+        self.generation += 1
+        if self.cron is not None:
+            self.next_run = self.cron.next_after(after)
+        else:
+            self.next_run = after + timedelta(seconds=self.interval_seconds)
+
+    def status(self) -> Dict:
+        return {
+            'name': self.name,
+            'schedule': str(self.cron) if self.cron is not None else f"every {self.interval_seconds:g}s",
+            'next_run': self.next_run.isoformat(sep=' ', timespec='seconds') if self.next_run else None,
+            'running': self.running,
+            'run_count': self.run_count,
+            'history': list(self.history)
+        }
+
+
+class JobSet:
+    """Named group of jobs (for example one landlord's) sharing a scheduler"""
+
+    def __init__(self, scheduler: 'TimerScheduler', name: str):
+        self.scheduler = scheduler
+        self.name = name
+        self.jobs = {}
+
+    def add(self, name: str, callback: Callable, cron: Optional[str] = None,
+            interval_seconds: Optional[float] = None) -> Job:
+        """Add or replace a job; it is scheduled straight away"""
+        job = Job(self.name, name, callback, cron, interval_seconds)
+        self.scheduler._register(self, job)
+        return job
+
+    def remove(self, name: str) -> bool:
+        return self.scheduler._unregister(self, name)
+
+    def clear(self):
+        for name in list(self.jobs):
+            self.remove(name)
+
+    def run_now(self, name: str):
+        """Run a job immediately on the worker pool, outside its schedule"""
+        self.scheduler._submit(self.jobs[name])
+
+    def next_run(self) -> Optional[datetime]:
+        runs = [job.next_run for job in self.jobs.values() if job.next_run is not None]
+        return min(runs) if runs else None
+
+    def status(self) -> List[Dict]:
+        with self.scheduler._condition:
+            return [job.status() for job in self.jobs.values()]
+
+
+class TimerScheduler:
+    """Heap-ordered timer queue that runs jobs at their deadlines.
+
+    A single thread sleeps until the earliest deadline and is woken straight
+    away when jobs are added, removed or rescheduled, or when the scheduler
+    stops. Due jobs run on a small worker pool, so a slow job doesn't delay
+    the others; a job that is still running when it comes due again skips
+    that run. Jobs are grouped into independent job sets.
+    """
+
+    def __init__(self, workers: int = None):
+        self.workers = workers or int(os.getenv('SCHEDULER_WORKERS', '4'))
+        self._heap = []
+        self._seq = itertools.count()
+        self._job_sets = {}
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self._executor = None
+
+    def job_set(self, name: str) -> JobSet:
+        with self._condition:
+            job_set = self._job_sets.get(name)
+            if job_set is None:
+                job_set = self._job_sets[name] = JobSet(self, name)
+            return job_set
+
+    def remove_job_set(self, name: str):
+        with self._condition:
+            job_set = self._job_sets.pop(name, None)
+        if job_set is not None:
+            job_set.clear()
+
+    def job_sets(self) -> List[str]:
+        with self._condition:
+            return list(self._job_sets)
+
+    def job_count(self) -> int:
+        with self._condition:
+            return sum(len(job_set.jobs) for job_set in self._job_sets.values())
+
+    def start(self):
+        with self._condition:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='scheduler-job')
+            self._thread = threading.Thread(target=self._run, name='timer-scheduler', daemon=True)
+            self._thread.start()
+        logger.info("Timer scheduler started")
+
+    def stop(self, wait: bool = False):
+        """Stop dispatching; the timer thread wakes and exits immediately"""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+            thread, executor = self._thread, self._executor
+            self._thread = None
+        if thread is not None:
+            thread.join()
+        if executor is not None:
+            executor.shutdown(wait=wait)
+        logger.info("Timer scheduler stopped")
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _register(self, job_set: JobSet, job: Job):
+        with self._condition:
+            previous = job_set.jobs.get(job.name)
+            if previous is not None:
+                previous.generation += 1
+            job_set.jobs[job.name] = job
+            job.schedule_next(datetime.now())
+            self._push(job)
+            self._condition.notify_all()
+
+    def _unregister(self, job_set: JobSet, name: str) -> bool:
+        with self._condition:
+            job = job_set.jobs.pop(name, None)
+            if job is None:
+                return False
+            job.generation += 1
+            job.next_run = None
+            self._condition.notify_all()
+            return True
+
+    def _push(self, job: Job):
+        heapq.heappush(self._heap, (job.next_run, next(self._seq), job.generation, job))
+
+    def _run(self):
+        with self._condition:
+            while not self._stopping:
+                # Drop entries for jobs that were removed or rescheduled since they were pushed
+                while self._heap and self._heap[0][2] != self._heap[0][3].generation:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                deadline = self._heap[0][0]
+                delay = (deadline - datetime.now()).total_seconds()
+                if delay > 0:
+                    self._condition.wait(min(delay, MAX_SLEEP_SECONDS))
+                    continue
+                _, _, _, job = heapq.heappop(self._heap)
+                # Runs missed while the process was suspended collapse into this one
+                job.schedule_next(max(deadline, datetime.now()))
+                self._push(job)
+                self._submit_locked(job)
+
+    def _submit(self, job: Job):
+        with self._condition:
+            self._submit_locked(job)
+
+    def _submit_locked(self, job: Job):
+        if job.running:
+            logger.warning(f"Job {job.job_set}/{job.name} is still running, skipping this run")
+            job.history.append({'started_at': datetime.now().isoformat(timespec='seconds'), 'status': 'skipped',
+                                'error': 'previous run still in progress'})
+            return
+        if self._executor is None:
+            raise RuntimeError("Timer scheduler is not running")
+        job.running = True
+        self._executor.submit(self._execute, job)
+
+    def _execute(self, job: Job):
+        started_at = datetime.now()
+        started = time.monotonic()
+        entry = {'started_at': started_at.isoformat(timespec='seconds'), 'status': 'succeeded', 'error': None}
+        try:
+            job.callback()
+        except Exception as e:
+            logger.error(f"Job {job.job_set}/{job.name} failed: {str(e)}")
+            entry['status'] = 'failed'
+            entry['error'] = str(e)
+        entry['duration_seconds'] = round(time.monotonic() - started, 3)
+        with self._condition:
+            job.running = False
+            job.run_count += 1
+            job.history.append(entry)
+
+
+# Global timer scheduler instance
+timer_scheduler = TimerScheduler()
@@ -0,0 +1,308 @@
+"""Client-side admission control for OpenAI calls.
+
+Every call first takes a permit from the governor:
+
+- a concurrency slot: at most max_concurrency calls are in flight, and
+  callers queue for a slot in arrival order
+- a request and a token from each token bucket, sized to the account's
+  requests/minute and tokens/minute quota (prompt plus max_tokens, as
+  OpenAI counts them), so bursts are spread out instead of answered with 429s
+- a circuit breaker: after failure_threshold consecutive upstream failures
+  (connection errors, timeouts, 5xx) calls are refused straight away for
+  cooldown seconds, then one probe call decides whether to close it again
+
+A caller that can't get a permit within queue_timeout, or finds more than
+max_queue callers already waiting, or hits an open breaker gets
+UpstreamUnavailable at once, and the analyzer answers from the local
+fallback instead. Slots can be waited for from threads (Flask) and from
+asyncio tasks (asgi.py); both share one queue.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Optional
+import logging
+from rate_limit import TokenBucket
+from metrics import UPSTREAM_REJECTIONS
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class UpstreamUnavailable(Exception):
+    """Raised instead of calling the upstream; reason is circuit_open, queue_full or queue_timeout"""
+
+    def __init__(self, reason: str, retry_after: float = None):
+        super().__init__(f"Upstream unavailable: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def is_upstream_failure(error: BaseException) -> bool:
+    """Whether an error says the upstream is unhealthy (as opposed to rejecting this request)"""
+    status = getattr(error, 'status_code', None)
+    # No status: the call never got an HTTP response (connection error, timeout)
+    return status is None or status >= 500 or status == 408
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a single half-open probe"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int, cooldown: float):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.times_opened = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> float:
+        """0 if a call may go ahead (taking the probe when half open), else seconds until it might"""
+        if self.state == self.CLOSED:
+            return 0.0
+        with self._lock:
+            if self.state == self.OPEN:
+                remaining = self.opened_at + self.cooldown - time.monotonic()
+                if remaining > 0:
+                    return remaining
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN:
+                if self._probing:
+                    return self.cooldown
+                self._probing = True
+            return 0.0
+
+    def record(self, healthy: Optional[bool]):
+        """Outcome of an allowed call: True/False, or None if it ended without telling (client went away)"""
+        with self._lock:
+            self._probing = False
+            if healthy is None:
+                return
+            if healthy:
+                if self.state != self.CLOSED:
+                    logger.info("Upstream recovered, closing circuit breaker")
+                self.state = self.CLOSED
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                logger.warning(f"Opening circuit breaker after {self.failures} upstream failures; "
+                               f"calls go to the fallback for {self.cooldown:g}s")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self.times_opened += 1
+
+
+class _Slots:
+    """FIFO counting semaphore that threads and asyncio tasks can both wait on"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_use = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def try_acquire(self, max_queue: int, waiter) -> Optional[bool]:
+        """True if a slot was free; None if queued behind others; raises when the queue is full"""
+        with self._lock:
+            if self.limit <= 0 or (self.in_use < self.limit and not self._waiters):
+                self.in_use += 1
+                return True
+            if len(self._waiters) >= max_queue:
+                raise UpstreamUnavailable('queue_full')
+            self._waiters.append(waiter)
+            return None
+
+    def acquire(self, timeout: float, max_queue: int) -> bool:
+        event = threading.Event()
+        if self.try_acquire(max_queue, event):
+            return True
+        if event.wait(max(0.0, timeout)):
+            return True
+        return not self._withdraw(event)
+
+    async def acquire_async(self, timeout: float, max_queue: int) -> bool:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if self.try_acquire(max_queue, (loop, future)):
+            return True
+        try:
+            await asyncio.wait_for(asyncio.shield(future), max(0.0, timeout))
+            return True
+        except asyncio.TimeoutError:
+            return not self._withdraw((loop, future))
+        except asyncio.CancelledError:
+            if not self._withdraw((loop, future)):
+                # The slot was handed over just as this task was cancelled
+                self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            if not self._waiters:
+                self.in_use -= 1
+                return
+            # Hand the slot straight to the longest waiter
+            waiter = self._waiters.popleft()
+        if isinstance(waiter, threading.Event):
+            waiter.set()
+        else:
+            loop, future = waiter
+            try:
+                loop.call_soon_threadsafe(_grant, future)
+            except RuntimeError:
+                # That waiter's event loop is gone; pass the slot on
+                self.release()
+
+    def _withdraw(self, waiter) -> bool:
+        """Leave the queue; False if a slot was handed to this waiter meanwhile"""
+        with self._lock:
+            try:
+                self._waiters.remove(waiter)
+                return True
+            except ValueError:
+                return False
+
+
+def _grant(future: asyncio.Future):
+    if not future.done():
+        future.set_result(True)
+
+
+class Permit:
+    """An admitted upstream call; use as `with permit:` around the call to release it and record its health"""
+
+    __slots__ = ('governor',)
+
+    def __init__(self, governor: 'UpstreamGovernor'):
+        self.governor = governor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc is None:
+            healthy = True
+        elif isinstance(exc, Exception):
+            healthy = not self.governor.is_failure(exc)
+        else:
+            # GeneratorExit or cancellation: the caller left, the upstream's health is unknown
+            healthy = None
+        self.governor.breaker.record(healthy)
+        self.governor.slots.release()
+        return False
+
+
+class UpstreamGovernor:
+    """Bounded concurrency, quota-sized token buckets and a circuit breaker in front of one upstream"""
+
+    def __init__(self, name: str = 'openai', max_concurrency: int = None, requests_per_minute: float = None,
+                 tokens_per_minute: float = None, queue_timeout: float = None, max_queue: int = None,
+                 failure_threshold: int = None, cooldown: float = None,
+                 is_failure: Callable[[BaseException], bool] = is_upstream_failure):
+        self.name = name
+        self.max_concurrency = max_concurrency or int(os.getenv('OPENAI_MAX_CONCURRENCY', '8'))
+        self.requests_per_minute = requests_per_minute if requests_per_minute is not None else float(os.getenv('OPENAI_RPM', '500'))
+        self.tokens_per_minute = tokens_per_minute if tokens_per_minute is not None else float(os.getenv('OPENAI_TPM', '200000'))
+        self.queue_timeout = queue_timeout if queue_timeout is not None else float(os.getenv('OPENAI_QUEUE_TIMEOUT', '10'))
+        self.max_queue = max_queue if max_queue is not None else int(os.getenv('OPENAI_MAX_QUEUE', '100'))
+        self.is_failure = is_failure
+        # Bursts of up to a tenth of the minute's quota; the rest is spread over the minute
+        self.requests = TokenBucket(self.requests_per_minute / 60, max(1.0, self.requests_per_minute / 10))
+        self.tokens = TokenBucket(self.tokens_per_minute / 60, max(1.0, self.tokens_per_minute / 10))
+        self.slots = _Slots(self.max_concurrency)
+        self.breaker = CircuitBreaker(
+            failure_threshold or int(os.getenv('OPENAI_BREAKER_FAILURES', '5')),
+            cooldown if cooldown is not None else float(os.getenv('OPENAI_BREAKER_COOLDOWN', '30'))
+        )
+        self.admitted = 0
+
+    def acquire(self, tokens: int) -> Permit:
+        """Wait (up to queue_timeout) for a permit for a call of about `tokens` tokens"""
+        deadline = time.monotonic() + self.queue_timeout
+        self._check_breaker()
+        try:
+            if not self.slots.acquire(self.queue_timeout, self.max_queue):
+                raise UpstreamUnavailable('queue_timeout')
+        except BaseException as e:
+            self._not_admitted(e, holding_slot=False)
+            raise
+        try:
+            for bucket, amount in ((self.requests, 1), (self.tokens, tokens)):
+                if not bucket.acquire(min(amount, bucket.capacity), deadline - time.monotonic()):
+                    raise UpstreamUnavailable('queue_timeout')
+        except BaseException as e:
+            self._not_admitted(e, holding_slot=True)
+            raise
+        return self._admit()
+
+    async def acquire_async(self, tokens: int) -> Permit:
+        """asyncio counterpart of acquire; waiting doesn't block the event loop"""
+        deadline = time.monotonic() + self.queue_timeout
+        self._check_breaker()
+        try:
+            if not await self.slots.acquire_async(self.queue_timeout, self.max_queue):
+                raise UpstreamUnavailable('queue_timeout')
+        except BaseException as e:
+            self._not_admitted(e, holding_slot=False)
+            raise
+        try:
+            for bucket, amount in ((self.requests, 1), (self.tokens, tokens)):
+                amount = min(amount, bucket.capacity)
+                while True:
+                    wait = bucket.try_acquire(amount)
+                    if wait <= 0:
+                        break
+                    if time.monotonic() + wait > deadline:
+                        raise UpstreamUnavailable('queue_timeout')
+                    await asyncio.sleep(wait)
+        except BaseException as e:
+            self._not_admitted(e, holding_slot=True)
+            raise
+        return self._admit()
+
+    def stats(self) -> Dict:
+        return {
+            'in_flight': self.slots.in_use,
+            'queued': self.slots.waiting,
+            'max_concurrency': self.max_concurrency,
+            'admitted': self.admitted,
+            'breaker_state': self.breaker.state,
+            'breaker_failures': self.breaker.failures,
+            'breaker_opened': self.breaker.times_opened
+        }
+
+    def _check_breaker(self):
+        retry_after = self.breaker.allow()
+        if retry_after > 0:
+            UPSTREAM_REJECTIONS.labels(self.name, 'circuit_open').inc()
+            raise UpstreamUnavailable('circuit_open', retry_after)
+
+    def _admit(self) -> Permit:
+        self.admitted += 1
+        return Permit(self)
+
+    def _not_admitted(self, error: BaseException, holding_slot: bool):
+        """Undo a partial admission: a half-open probe that never ran must not block the next one"""
+        self.breaker.record(None)
+        if holding_slot:
+            self.slots.release()
+        if isinstance(error, UpstreamUnavailable):
+            UPSTREAM_REJECTIONS.labels(self.name, error.reason).inc()
+
+
+# Global governor for OpenAI calls
+openai_governor = UpstreamGovernor('openai')
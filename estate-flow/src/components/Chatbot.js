@@ -3,6 +3,60 @@ import { MdSmartToy, MdSend } from 'react-icons/md';
 import { AiOutlineLoading3Quarters } from 'react-icons/ai';
 import './Chatbot.css';
 
+const API_BASE = 'http://localhost:5001';
+
+// Index every unit by property name + unit number, and every property by name
+// (properties without units included), so we can diff portfolios
+const indexPortfolio = (properties) => {
+  const units = new Map();
+  const props = new Map();
+  (properties || []).forEach(prop => {
+    props.set(prop.name, prop.address);
+    (prop.units || []).forEach(unit => {
+      units.set(`${prop.name}::${unit.number}`, {
+        property: prop.name,
+        address: prop.address,
+        unit,
+        serialized: JSON.stringify(unit)
+      });
+    });
+  });
+  return { units, properties: props };
+};
+
+// Unit-level delta between two indexed portfolios. needsReplace is set when a
+// change can't be expressed as unit changes (a new or re-addressed property with no units)
+const diffPortfolios = (previous, current) => {
+  const added = [];
+  const changed = [];
+  const removed = [];
+  const removed_properties = [...previous.properties.keys()].filter(name => !current.properties.has(name));
+  const dropped = new Set(removed_properties);
+
+  current.units.forEach((entry, key) => {
+    const before = previous.units.get(key);
+    if (!before) {
+      added.push({ property: entry.property, address: entry.address, unit: entry.unit });
+    } else if (before.serialized !== entry.serialized || before.address !== entry.address) {
+      changed.push({ property: entry.property, address: entry.address, unit: entry.unit });
+    }
+  });
+
+  previous.units.forEach((entry, key) => {
+    // Units of a removed property go with it
+    if (!current.units.has(key) && !dropped.has(entry.property)) {
+      removed.push({ property: entry.property, number: entry.unit.number });
+    }
+  });
+
+  const withUnits = new Set([...current.units.values()].map(entry => entry.property));
+  const needsReplace = [...current.properties].some(([name, address]) =>
+    !withUnits.has(name) && (!previous.properties.has(name) || previous.properties.get(name) !== address)
+  );
+
+  return { delta: { added, changed, removed, removed_properties }, needsReplace };
+};
+
 const Chatbot = ({ isOpen, onClose, properties }) => {
   const [messages, setMessages] = useState([
     {
@@ -16,6 +70,13 @@ const Chatbot = ({ isOpen, onClose, properties }) => {
   const [isLoading, setIsLoading] = useState(false);
   const messagesEndRef = useRef(null);
   const inputRef = useRef(null);
+  // Server-side copy of the portfolio: uploaded once, then kept in sync with deltas
+  const portfolioRef = useRef({ id: null, version: null, source: null, index: indexPortfolio([]) });
+  // In-flight streamed answer; aborting it makes the backend cancel the OpenAI call
+  const streamRef = useRef(null);
+
+  // Stop any streaming answer when the chatbot goes away
+  useEffect(() => () => streamRef.current?.abort(), []);
 
   // Auto scroll to bottom when new messages arrive
   useEffect(() => {
@@ -33,6 +94,109 @@ const Chatbot = ({ isOpen, onClose, properties }) => {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
   };
 
+  const uploadPortfolio = async () => {
+    const response = await fetch(`${API_BASE}/portfolios`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ properties })
+    });
+    if (!response.ok) {
+      throw new Error('Failed to upload portfolio');
+    }
+    const data = await response.json();
+    portfolioRef.current = {
+      id: data.portfolio.portfolio_id,
+      version: data.portfolio.version,
+      source: properties,
+      index: indexPortfolio(properties)
+    };
+    return portfolioRef.current.id;
+  };
+
+  // Make sure the backend holds the current portfolio and return its ID
+  const syncPortfolio = async () => {
+    const stored = portfolioRef.current;
+    if (!stored.id) {
+      return uploadPortfolio();
+    }
+    if (stored.source === properties) {
+      return stored.id;
+    }
+
+    const index = indexPortfolio(properties);
+    const { delta, needsReplace } = diffPortfolios(stored.index, index);
+    if (needsReplace || delta.added.length || delta.changed.length || delta.removed.length ||
+        delta.removed_properties.length) {
+      const response = needsReplace
+        ? await fetch(`${API_BASE}/portfolios/${stored.id}`, {
+            method: 'PUT',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ properties })
+          })
+        : await fetch(`${API_BASE}/portfolios/${stored.id}`, {
+            method: 'PATCH',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ base_version: stored.version, ...delta })
+          });
+      if (response.status === 404 || response.status === 409) {
+        // Backend restarted or another tab moved the version on: start over
+        return uploadPortfolio();
+      }
+      if (!response.ok) {
+        throw new Error('Failed to update portfolio');
+      }
+      const data = await response.json();
+      stored.version = data.portfolio.version;
+    }
+    stored.source = properties;
+    stored.index = index;
+    return stored.id;
+  };
+
+  const postChat = (payload) => fetch(`${API_BASE}/chat/stream`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+    },
+    body: JSON.stringify(payload),
+    signal: streamRef.current?.signal,
+  });
+
+  // Read server-sent events from /chat/stream, calling onDelta with the text so far
+  const readStream = async (response, onDelta) => {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let text = '';
+
+    for (;;) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      let boundary;
+      while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+        const rawEvent = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+
+        let event = 'message';
+        let data = '';
+        rawEvent.split('\n').forEach(line => {
+          if (line.startsWith('event: ')) event = line.slice(7);
+          else if (line.startsWith('data: ')) data += line.slice(6);
+        });
+        if (!data) continue;
+
+        const payload = JSON.parse(data);
+        if (event === 'error') throw new Error(payload.error);
+        if (event === 'done') return payload.response;
+        text += payload.delta;
+        onDelta(text);
+      }
+    }
+    return text;
+  };
+
   const sendMessage = async () => {
     if (!inputMessage.trim()) return;
 
@@ -47,34 +211,51 @@ const Chatbot = ({ isOpen, onClose, properties }) => {
     setInputMessage('');
     setIsLoading(true);
 
+    streamRef.current?.abort();
+    streamRef.current = new AbortController();
+    const botId = Date.now() + 1;
+
     try {
-      // Send message to Python backend
-      const response = await fetch('http://localhost:5001/chat', {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({
-          message: userMessage.text,
-          properties: properties
-        }),
-      });
+      // Send message to Python backend, referring to the stored portfolio when we can
+      let response;
+      let portfolioId = null;
+      if (properties && properties.length > 0) {
+        try {
+          portfolioId = await syncPortfolio();
+        } catch (syncError) {
+          console.warn('Portfolio sync failed, sending full properties instead:', syncError);
+        }
+      }
+
+      if (portfolioId) {
+        response = await postChat({ message: userMessage.text, portfolio_id: portfolioId });
+        if (response.status === 404) {
+          portfolioRef.current = { id: null, version: null, source: null, index: new Map() };
+          response = await postChat({ message: userMessage.text, properties });
+        }
+      } else {
+        response = await postChat({ message: userMessage.text, properties });
+      }
 
       if (!response.ok) {
         throw new Error('Failed to get response from chatbot');
       }
 
-      const data = await response.json();
-
-      const botMessage = {
-        id: Date.now() + 1,
-        type: 'bot',
-        text: data.response,
-        timestamp: new Date()
-      };
+      // Show the answer as it streams in, then replace it with the final text
+      const showBotText = (text) => setMessages(prev => {
+        const botMessage = { id: botId, type: 'bot', text, timestamp: new Date() };
+        return prev.some(message => message.id === botId)
+          ? prev.map(message => (message.id === botId ? botMessage : message))
+          : [...prev, botMessage];
+      });
 
-      setMessages(prev => [...prev, botMessage]);
+      const finalText = await readStream(response, (text) => {
+        setIsLoading(false);
+        showBotText(text);
+      });
+      showBotText(finalText);
     } catch (error) {
+      if (error.name === 'AbortError') return;
       console.error('Chatbot error:', error);
       
       // Fallback response when backend is not available
@@ -89,7 +270,7 @@ const Chatbot = ({ isOpen, onClose, properties }) => {
         isError: true
       };
 
-      setMessages(prev => [...prev, fallbackMessage]);
+      setMessages(prev => [...prev.filter(message => message.id !== botId), fallbackMessage]);
     } finally {
       setIsLoading(false);
     }
@@ -118,7 +118,7 @@ const EmailAutomation = ({ isOpen, onClose }) => {
       const data = await response.json();
       
       if (data.success) {
-        showMessage(`Test email sent successfully to ${testEmail}`, 'success');
+        showMessage(`Test email queued for ${testEmail}. It should arrive shortly.`, 'success');
       } else {
         showMessage(`Error: ${data.error}`, 'error');
       }